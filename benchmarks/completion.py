@@ -0,0 +1,107 @@
+"""Per-keystroke latency of tag completion, QCompleter's substring filter
+against ``CompletionIndex``, and of fuzzy completion on mistyped tags.
+
+	python benchmarks/completion.py [path/to/danbooru.db]
+
+Without a database, a synthetic vocabulary of 500k tags is generated.
+"""
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from PyQt6.QtCore import Qt
+from PyQt6.QtWidgets import QApplication, QCompleter
+
+from models.tag_completer_model import TagCompleterModel
+
+WORDS = (
+	"hair long short blonde black brown red blue green eyes smile open mouth closed shirt skirt dress "
+	"ribbon bow hat gloves thighhighs boots sky cloud tree flower water outdoors indoors holding "
+	"looking viewer standing sitting solo girl boy multiple animal ears tail wings sword weapon "
+	"school uniform jacket white background simple full body upper cowboy shot from side behind"
+).split()
+
+TYPED = ["long hair", "smile", "hair ribbon", "looking at viewer", "white background", "thighhighs", "blue eyes", "xyzzy"]
+MISTYPED = ["hiar ribbon", "smilling", "lnog hair", "thighighs", "whtie background", "lookign at veiwer"]
+
+
+def synthetic_database(path: Path, size: int):
+	rng = random.Random(0)
+	names = set()
+	while len(names) < size:
+		words = rng.sample(WORDS, rng.randint(1, 3))
+		suffix = f"_{rng.randrange(1000)}" if rng.random() < 0.5 else ""
+		names.add("_".join(words) + suffix)
+	connection = sqlite3.connect(path)
+	connection.execute("CREATE TABLE tags(id integer primary key, name text, post_count integer, category integer)")
+	connection.executemany(
+		"INSERT INTO tags (name, post_count, category) VALUES (?, ?, 0)",
+		((name, int(1_000_000 / (rank + 1) ** 0.8)) for rank, name in enumerate(sorted(names, key=lambda _: rng.random())))
+	)
+	connection.commit()
+	connection.close()
+
+def keystrokes(typed: list[str]) -> list[str]:
+	return [text[:end] for text in typed for end in range(3, len(text) + 1)]
+
+def measure(label: str, query, texts: list[str]):
+	times = []
+	for text in texts:
+		start = time.perf_counter()
+		query(text)
+		times.append((time.perf_counter() - start) * 1000)
+	times.sort()
+	print(
+		f"{label:<16} median {statistics.median(times):8.3f} ms"
+		f"   p95 {times[int(len(times) * 0.95)]:8.3f} ms   max {times[-1]:8.3f} ms"
+	)
+
+def main():
+	application = QApplication(sys.argv[:1])
+
+	with tempfile.TemporaryDirectory() as temp_dir:
+		if len(sys.argv) > 1:
+			db_path = Path(sys.argv[1])
+		else:
+			db_path = Path(temp_dir) / "danbooru.db"
+			synthetic_database(db_path, 500_000)
+
+		start = time.perf_counter()
+		model = TagCompleterModel(db_path)
+		while not model.is_loaded:
+			application.processEvents()
+			time.sleep(0.01)
+		print(f"{model.rowCount(None)} tags loaded and indexed in {time.perf_counter() - start:.2f} s")
+
+		completer = QCompleter()
+		completer.setModel(model)
+		completer.setCompletionColumn(TagCompleterModel.Column.NAME)
+		completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
+		completer.setFilterMode(Qt.MatchFlag.MatchContains)
+		model.sort(TagCompleterModel.Column.POST_COUNT, Qt.SortOrder.DescendingOrder)
+
+		def qcompleter_query(text: str):
+			completer.setCompletionPrefix(text)
+			completions = completer.completionModel()
+			[completions.index(row, 0).data() for row in range(min(50, completions.rowCount()))]
+
+		texts = keystrokes(TYPED)
+		print(f"{len(texts)} keystrokes, 50 matches each")
+		measure("QCompleter", qcompleter_query, texts)
+		measure("CompletionIndex", lambda text: model.completion_index.matches(text, 50), texts)
+
+		texts = keystrokes(MISTYPED)
+		print(f"{len(texts)} mistyped keystrokes, substring topped up with fuzzy matches")
+		measure("fuzzy", lambda text: model.completion_index.complete(text, 50, fuzzy=True), texts)
+		print("\n".join(f"  {text!r}: {model.completion_index.complete(text, 3, fuzzy=True)}" for text in MISTYPED))
+
+	del application
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,104 @@
+"""Memory and per-keystroke latency of the bitmap-backed tag index, against
+sets of images per tag like it used to keep.
+
+	python benchmarks/tag_index.py [images] [tags]
+
+Generates a synthetic directory, 200k images over a vocabulary of 50k tags
+by default, with tag popularity following a power law as on boorus.
+"""
+import itertools
+import random
+import statistics
+import sys
+import time
+from array import array
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "src"))
+
+from PyQt6.QtWidgets import QApplication
+
+from models.directory import Directory
+from models.image import Image
+from models.tag_index_model import TagIndexModel
+from models.tag_query import TagQuery
+from models.tag_vocabulary import TagVocabulary
+
+
+def synthetic_directory(image_count: int, tag_count: int) -> Directory:
+	rng = random.Random(0)
+	tag_ids = TagVocabulary.intern_many(f"tag {rank}" for rank in range(tag_count))
+	weights = list(itertools.accumulate(1 / (rank + 1) ** 0.9 for rank in range(tag_count)))
+	directory = Directory("/nonexistent", load=False)
+	for i in range(image_count):
+		image = Image(Path(f"/nonexistent/{i:07}.png"))
+		ranks = set(rng.choices(range(tag_count), cum_weights=weights, k=rng.randint(10, 50)))
+		image.set_loaded_tags(array("I", (tag_ids[rank] for rank in ranks)))
+		directory.images.append(image)
+	return directory
+
+def set_index_size(directory: Directory) -> int:
+	"""Bytes the former ``dict[int, set[Image]]`` index takes beyond the images."""
+	tag_map: dict[int, set[Image]] = {}
+	for image in directory.images:
+		for tag_id in image.tag_ids:
+			tag_map.setdefault(tag_id, set()).add(image)
+	return sys.getsizeof(tag_map) + sum(sys.getsizeof(images) for images in tag_map.values())
+
+def measure(label: str, query, arguments: list):
+	times = []
+	for argument in arguments:
+		start = time.perf_counter()
+		query(argument)
+		times.append((time.perf_counter() - start) * 1000)
+	times.sort()
+	print(
+		f"{label:<24} median {statistics.median(times):8.3f} ms"
+		f"   p95 {times[int(len(times) * 0.95)]:8.3f} ms   max {times[-1]:8.3f} ms"
+	)
+
+def main():
+	application = QApplication(sys.argv[:1])
+	image_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200_000
+	tag_count = int(sys.argv[2]) if len(sys.argv) > 2 else 50_000
+
+	start = time.perf_counter()
+	directory = synthetic_directory(image_count, tag_count)
+	print(f"{image_count} images, {sum(image.tag_count() for image in directory.images)} tags generated in {time.perf_counter() - start:.1f} s")
+
+	start = time.perf_counter()
+	model = TagIndexModel(directory)
+	bitmaps = model.tag_bitmaps
+	dense = sum(bitmaps.is_dense(tag_id) for tag_id in bitmaps)
+	print(f"{len(bitmaps)} tags indexed in {time.perf_counter() - start:.1f} s, {dense} of them as bitmaps")
+	print(f"index size: bitmaps {bitmaps.memory_size() / 2 ** 20:.1f} MB, sets {set_index_size(directory) / 2 ** 20:.1f} MB")
+
+	rng = random.Random(1)
+	by_count = sorted(bitmaps, key=bitmaps.count, reverse=True)
+	head, middle, tail = by_count[:100], by_count[100:2000], by_count[2000:]
+	classes = {
+		"common": lambda: rng.sample(head, 2),
+		"common x rare": lambda: [rng.choice(head), rng.choice(tail)],
+		"rare": lambda: [rng.choice(middle), rng.choice(tail)],
+	}
+	for label, pick in classes.items():
+		pairs = [pick() for _ in range(200)]
+		print(f"{label} pairs")
+		measure("  intersection count", bitmaps.intersection_count, pairs)
+		measure("  union count", bitmaps.union_count, pairs)
+		measure("  difference count", lambda pair: bitmaps.difference_count(pair[0], pair[1:]), pairs)
+
+	print("co-occurrence, top 20")
+	for label, tags in (("  common", head), ("  middle", middle), ("  rare", tail)):
+		measure(label, lambda tag_id: model.co_occurring(tag_id, 20), rng.sample(tags, 10))
+
+	queries = [
+		TagQuery(f"{TagVocabulary.string(a)} AND NOT {TagVocabulary.string(b)}")
+		for a, b in (rng.sample(head, 2) for _ in range(20))
+	]
+	measure("query a AND NOT b", lambda query: query.evaluate(model), queries)
+
+	del application
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,29 @@
+from typing import Callable
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal, pyqtSlot
+
+
+class BulkTagPlanner(QObject):
+	planned = pyqtSignal(int, str, list) # serial, undo text, deltas
+
+class BulkTagTask(QRunnable):
+	"""Plans a directory-wide tag operation on a worker thread.
+
+	``plan`` only reads snapshots of the affected images' tags and returns
+	history deltas, which are applied on the GUI thread.
+	"""
+	def __init__(self, plan: Callable[[], list], planner: BulkTagPlanner, serial: int, text: str):
+		super().__init__()
+		self.plan = plan
+		self.planner = planner
+		self.serial = serial
+		self.text = text
+
+	@pyqtSlot()
+	def run(self):
+		try:
+			deltas = self.plan()
+		except Exception as exception:
+			print(f"Error planning {self.text}: {str(exception)}")
+			deltas = []
+		self.planner.planned.emit(self.serial, self.text, deltas)
@@ -0,0 +1,78 @@
+from os import PathLike
+
+from PyQt6.QtCore import QCoreApplication, QObject, QThread, pyqtSignal, pyqtSlot
+
+from models.tag_completer_model import TagCompleterModel
+
+
+class CompletionService(QObject):
+	"""Owns the tag vocabulary and answers completion queries on a worker thread.
+
+	Every editor widget shares the one instance. Each query is tagged with the
+	client that made it and a serial number; a newer query from the same client
+	supersedes the older one, which is skipped if it hasn't started and
+	abandoned between matching stages if it has. Results are delivered through
+	``completions_ready`` to whoever is listening, and clients pick out their
+	own by serial.
+	"""
+	completions_ready = pyqtSignal(int, list) # serial, [(name, post_count)]
+	_query = pyqtSignal(int, object, str, int, bool) # serial, client, text, k, fuzzy
+	_instance = None
+
+	def __init__(self, db_path: str | PathLike = "data/danbooru.db"):
+		super().__init__()
+		self.model = TagCompleterModel(db_path)
+		self._serial = 0
+		self._latest: dict[int, int] = {} # client -> serial of its newest query
+
+		self._thread = QThread()
+		self._worker = CompletionWorker(self)
+		self._worker.moveToThread(self._thread)
+		self._query.connect(self._worker.run_query)
+		self._thread.start()
+
+		application = QCoreApplication.instance()
+		if application is not None:
+			application.aboutToQuit.connect(self.close)
+
+	@classmethod
+	def instance(cls):
+		if cls._instance is None:
+			cls._instance = cls()
+		return cls._instance
+
+	def cancel(self, client: int):
+		"""Supersedes the client's pending query without making a new one."""
+		self._serial += 1
+		self._latest[client] = self._serial
+
+	def close(self):
+		if self._thread.isRunning():
+			self._thread.quit()
+			self._thread.wait()
+
+	def is_superseded(self, client: int, serial: int) -> bool:
+		return self._latest.get(client) != serial
+
+	def request(self, client: int, text: str, k: int, fuzzy: bool = False) -> int:
+		"""Queues a query and returns its serial."""
+		self._serial += 1
+		self._latest[client] = self._serial
+		self._query.emit(self._serial, client, text, k, fuzzy)
+		return self._serial
+
+class CompletionWorker(QObject):
+	def __init__(self, service: CompletionService):
+		super().__init__()
+		self.service = service
+
+	@pyqtSlot(int, object, str, int, bool)
+	def run_query(self, serial: int, client: int, text: str, k: int, fuzzy: bool):
+		service = self.service
+		if service.is_superseded(client, serial):
+			return # a newer keystroke is already queued behind this one
+
+		index = service.model.completion_index # swapped whole once the vocabulary loads
+		matches = index.complete(text, k, fuzzy, lambda: service.is_superseded(client, serial))
+		if not service.is_superseded(client, serial):
+			service.completions_ready.emit(serial, matches)
@@ -0,0 +1,53 @@
+import time
+from pathlib import Path
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal, pyqtSlot
+
+from models.directory import Directory
+from models.image import Image
+
+
+class DirectoryScanner(QObject):
+	images_found = pyqtSignal(int, list) # generation, list[Image]
+	scan_finished = pyqtSignal(int, int) # generation, image count
+
+class DirectoryScanTask(QRunnable):
+	"""Lists a directory in the background, handing images over in batches.
+
+	Batches are emitted on a time interval rather than a fixed count, so the
+	first rows show up quickly even on slow network filesystems.
+	"""
+	def __init__(self, path: Path, scanner: DirectoryScanner, generation: int, batch_interval: float = 0.1):
+		super().__init__()
+		self.path = path
+		self.scanner = scanner
+		self.generation = generation
+		self.batch_interval = batch_interval
+		self.canceled = False
+
+	@pyqtSlot()
+	def run(self):
+		batch: list[Image] = []
+		count = 0
+		last_emit = time.monotonic()
+
+		try:
+			for path in Directory.scan(self.path):
+				if self.canceled:
+					return
+				batch.append(Image(path))
+				if time.monotonic() - last_emit >= self.batch_interval:
+					self.scanner.images_found.emit(self.generation, batch)
+					count += len(batch)
+					batch = []
+					last_emit = time.monotonic()
+		except OSError as exception:
+			print(f"Error scanning directory: {str(exception)}")
+
+		if self.canceled:
+			return
+
+		if batch:
+			self.scanner.images_found.emit(self.generation, batch)
+			count += len(batch)
+		self.scanner.scan_finished.emit(self.generation, count)
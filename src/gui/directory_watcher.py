@@ -0,0 +1,288 @@
+import os
+from array import array
+from pathlib import Path
+
+from PyQt6.QtCore import QFileSystemWatcher, QObject, QRunnable, QThreadPool, QTimer, pyqtSignal, pyqtSlot
+
+from models.directory import Directory
+from models.image import Image
+
+# name -> (size, mtime_ns) of every image and sidecar in a directory
+Snapshot = dict[str, tuple[int, int]]
+
+
+class DirectoryChanges:
+	def __init__(self):
+		self.added: list[Path] = [] # image paths
+		self.removed: list[Path] = [] # image paths
+		self.sidecars: list[tuple[Path, array]] = [] # changed sidecar paths with their new tag IDs
+
+	def __bool__(self):
+		return bool(self.added or self.removed or self.sidecars)
+
+class Baseline:
+	"""What a directory looked like to this program before it was watched: the
+	images a scan listed, and the sidecars it read or wrote."""
+	def __init__(self, images: set[str], sidecars: dict[str, tuple[int, int] | None]):
+		self.images = images
+		self.sidecars = sidecars # as last read or written, None if it was missing
+
+	def snapshot(self, current: Snapshot) -> Snapshot:
+		"""Returns a snapshot to diff ``current`` against. Sidecars not read yet
+		are taken as they are, their pending loads will read them. Image stats
+		are never compared, so the listed images get a placeholder."""
+		snapshot = {name: stat for name, stat in current.items() if name.lower().endswith(".txt")}
+		snapshot.update(self.sidecars)
+		snapshot = {name: stat for name, stat in snapshot.items() if stat is not None}
+		snapshot.update(dict.fromkeys(self.images, (0, 0)))
+		return snapshot
+
+class DirectoryWatcher(QObject):
+	"""Watches the open directory and reports changes in coalesced batches.
+
+	``QFileSystemWatcher`` only signals that *something* in the directory
+	changed, and doesn't notice sidecars rewritten in place, so every event
+	(and a slower poll) just schedules a rescan. Rescans are debounced and run
+	in the background, where they diff a stat snapshot and re-parse changed
+	sidecars, so thousands of rewritten files turn into a single update.
+
+	Watching starts once the directory has been scanned, and the first rescan
+	is compared against what the scan found, see ``start``.
+	"""
+	changes_detected = pyqtSignal(DirectoryChanges)
+	_rescanned = pyqtSignal(int, dict, DirectoryChanges) # generation, snapshot, changes
+	_rescan_failed = pyqtSignal(int, object) # generation, Baseline or None
+
+	def __init__(self, coalesce_interval: int = 500, poll_interval: int = 15000):
+		super().__init__()
+		self.path: Path | None = None
+		self.generation = 0
+		self.snapshot: Snapshot | None = None
+		self._images: set[str] | None = None # what the first rescan is compared against, see start
+		self._acknowledged: dict[Path, tuple[int, int] | None] = {} # held back, see acknowledge
+		self._read: set[Path] = set() # acknowledged files that were read rather than written
+		self._rescan_running = False
+		self._rescan_pending = False
+
+		self._watcher = QFileSystemWatcher()
+		self._watcher.directoryChanged.connect(self.on_directory_changed)
+
+		self._coalesce_timer = QTimer()
+		self._coalesce_timer.setSingleShot(True)
+		self._coalesce_timer.setInterval(coalesce_interval)
+		self._coalesce_timer.timeout.connect(self.rescan)
+
+		self._poll_timer = QTimer()
+		self._poll_timer.setInterval(poll_interval)
+		self._poll_timer.timeout.connect(self.rescan)
+
+		self._rescanned.connect(self.on_rescanned)
+		self._rescan_failed.connect(self.on_rescan_failed)
+
+	def acknowledge(self, stats: dict[Path, tuple[int, int] | None], written: bool = False):
+		"""Records files this program wrote or read itself, so they aren't
+		reported as changed. Until the first snapshot, and while a rescan is
+		diffing one, they are held back and applied to its result.
+
+		A file read in a different state than the snapshot holds may have
+		changed after it was read, so that schedules a rescan. Files written
+		only update the snapshot.
+		:param stats: ``(size, mtime_ns)`` per path as written or read, None
+			for files that were missing.
+		"""
+		self._acknowledged.update(stats)
+		if written:
+			self._read.difference_update(stats)
+		else:
+			self._read.update(stats)
+		if self.snapshot is not None and not self._rescan_running:
+			acknowledged, read = self._take_acknowledged()
+			if self._apply(self.snapshot, acknowledged) & read:
+				self._coalesce_timer.start()
+
+	def on_directory_changed(self, path: str):
+		self._coalesce_timer.start() # restarting pushes the rescan back while events keep coming
+
+	def on_rescan_failed(self, generation: int, baseline: Baseline | None):
+		"""Keeps the snapshot, and the baseline's acknowledgements for the next
+		rescan, which the poll retries."""
+		if generation != self.generation:
+			return
+		if baseline is not None:
+			held = self._acknowledged
+			self._acknowledged = {self.path / name: stat for name, stat in baseline.sidecars.items()}
+			self._acknowledged.update(held)
+
+		self._rescan_running = False
+		if self._rescan_pending:
+			self._rescan_pending = False
+			self._coalesce_timer.start()
+
+	def on_rescanned(self, generation: int, snapshot: Snapshot, changes: DirectoryChanges):
+		if generation != self.generation:
+			return
+
+		# Sidecars read or written while the rescan ran are already known,
+		# unless they changed again since
+		acknowledged, read = self._take_acknowledged()
+		changes.sidecars = [
+			(sidecar, tag_ids) for sidecar, tag_ids in changes.sidecars
+			if sidecar.name not in acknowledged or acknowledged[sidecar.name] != snapshot.get(sidecar.name)
+		]
+		if self._apply(snapshot, acknowledged) & read:
+			self._rescan_pending = True
+
+		self.snapshot = snapshot
+		self._images = None
+		self._rescan_running = False
+		if changes:
+			self.changes_detected.emit(changes)
+
+		if self._rescan_pending:
+			self._rescan_pending = False
+			self.rescan()
+
+	def rescan(self):
+		if self.path is None:
+			return
+		if self._rescan_running:
+			self._rescan_pending = True
+			return
+
+		baseline = None
+		if self.snapshot is None and self._images is not None:
+			baseline = Baseline(self._images, self._take_acknowledged()[0])
+
+		self._rescan_running = True
+		task = DirectoryRescanTask(self.path, self.snapshot, self, self.generation, baseline)
+		QThreadPool.globalInstance().start(task)
+
+	def start(self, path: Path, images: set[str] | None = None):
+		"""Starts watching ``path``.
+
+		The first rescan compares the directory against ``images``, the names of
+		the images a scan found, and the sidecars acknowledged since ``stop``, so
+		files changed while the scan ran are reported too. Without ``images`` it
+		only records a baseline.
+		"""
+		acknowledged, read = self._acknowledged, self._read # from the scan of path
+		self.stop()
+		self.path = path
+		self._images = images
+		self._acknowledged, self._read = acknowledged, read
+		self._watcher.addPath(str(path))
+		if self._poll_timer.interval() > 0:
+			self._poll_timer.start()
+		self.rescan()
+
+	def stop(self):
+		self.generation += 1
+		self._coalesce_timer.stop()
+		self._poll_timer.stop()
+		if self._watcher.directories():
+			self._watcher.removePaths(self._watcher.directories())
+		self.path = None
+		self.snapshot = None
+		self._images = None
+		self._acknowledged = {}
+		self._read = set()
+		self._rescan_running = False
+		self._rescan_pending = False
+
+	# --- Private methods
+
+	@staticmethod
+	def _apply(snapshot: Snapshot, acknowledged: dict[str, tuple[int, int] | None]) -> set[str]:
+		"""Puts ``acknowledged`` into ``snapshot``.
+		:returns: The names whose entry that changed. Files read in another
+			state may have been read before their last change.
+		"""
+		changed = set()
+		for name, stat in acknowledged.items():
+			if snapshot.get(name) != stat:
+				changed.add(name)
+				if stat is not None:
+					snapshot[name] = stat
+				else:
+					del snapshot[name]
+		return changed
+
+	def _take_acknowledged(self) -> tuple[dict[str, tuple[int, int] | None], set[str]]:
+		"""Returns the held back acknowledgements in the watched directory by
+		name, and the names of those that were read."""
+		acknowledged = {path.name: stat for path, stat in self._acknowledged.items() if path.parent == self.path}
+		read = {path.name for path in self._read if path.parent == self.path}
+		self._acknowledged = {}
+		self._read = set()
+		return acknowledged, read
+
+class DirectoryRescanTask(QRunnable):
+	def __init__(
+			self,
+			path: Path,
+			snapshot: Snapshot | None,
+			watcher: DirectoryWatcher,
+			generation: int,
+			baseline: Baseline | None = None
+	):
+		super().__init__()
+		self.path = path
+		self.snapshot = snapshot
+		self.watcher = watcher
+		self.generation = generation
+		self.baseline = baseline
+
+	@pyqtSlot()
+	def run(self):
+		snapshot: Snapshot = {}
+		try:
+			with os.scandir(self.path) as entries:
+				for entry in entries:
+					suffix = os.path.splitext(entry.name)[1].lower()
+					if suffix != ".txt" and suffix not in Directory.image_extensions:
+						continue
+					try:
+						if not entry.is_file():
+							continue
+						result = entry.stat()
+					except OSError:
+						continue
+					snapshot[entry.name] = (result.st_size, result.st_mtime_ns)
+		except OSError as exception:
+			# A directory that can't be listed, e.g. a network share dropping out
+			# for a moment, doesn't mean its files are gone
+			print(f"Error rescanning directory: {str(exception)}")
+			self.watcher._rescan_failed.emit(self.generation, self.baseline)
+			return
+
+		changes = DirectoryChanges()
+		if self.snapshot is not None:
+			self._diff(self.snapshot, snapshot, changes)
+		elif self.baseline is not None:
+			self._diff(self.baseline.snapshot(snapshot), snapshot, changes)
+
+		self.watcher._rescanned.emit(self.generation, snapshot, changes)
+
+	# --- Private methods
+
+	def _diff(self, old: Snapshot, new: Snapshot, changes: DirectoryChanges):
+		for name in new.keys() - old.keys():
+			if not name.lower().endswith(".txt"):
+				changes.added.append(self.path / name)
+		for name in old.keys() - new.keys():
+			if not name.lower().endswith(".txt"):
+				changes.removed.append(self.path / name)
+
+		for name, stat in new.items():
+			if name.lower().endswith(".txt") and old.get(name) != stat:
+				sidecar = self.path / name
+				try:
+					with sidecar.open(newline="") as file:
+						tag_ids = Image.parse_tag_text(file.read())
+				except (OSError, UnicodeDecodeError):
+					continue # mid-write or gone again, the next event will catch it
+				changes.sidecars.append((sidecar, tag_ids))
+
+		for name in old.keys() - new.keys():
+			if name.lower().endswith(".txt"):
+				changes.sidecars.append((self.path / name, array("I")))
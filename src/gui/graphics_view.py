@@ -1,10 +1,15 @@
-from PyQt6 import QtWidgets
-from PyQt6.QtCore import Qt, QSize, QThreadPool
+from PyQt6 import QtWidgets, sip
+from PyQt6.QtCore import Qt, QSize, QThreadPool, QTimer
 from PyQt6.QtGui import QWheelEvent, QPixmap, QImage, QPainter
 from PyQt6.QtWidgets import QGraphicsView, QGraphicsScene
 
+from settings.config import Config, Setting
 from models.image import Image
 from gui.image_task import ImageLoader, ImageTask
+from gui.tile_task import TileLoader
+from gui.tiled_image_item import TiledImageItem
+from util.image_decode import read_size, supports_clip_rect
+from util.lru_cache import ByteLRUCache
 
 
 class GraphicsView(QGraphicsView):
@@ -12,32 +17,128 @@ class GraphicsView(QGraphicsView):
 		super().__init__(*args, **kwargs)
 		self.current_zoom = 1.0
 		self.zoom_factor = 1.5
-		self.current_task: ImageTask | None = None
+		self.current_image: Image | None = None
+		self.prefetch: list[Image] = []
+		self.generation = 0 # stamped on each decode, results from replaced tasks are dropped
+		self.tasks: dict[Image, ImageTask] = {} # the current image and its prefetched neighbours
+		self.tiled_item: TiledImageItem | None = None
+		self.tiled_threshold = Config.read(Setting.TiledImageThreshold) * 1000 * 1000
 
 		self.setDragMode(QtWidgets.QGraphicsView.DragMode.ScrollHandDrag)
 		self.setTransformationAnchor(QtWidgets.QGraphicsView.ViewportAnchor.NoAnchor)
 		self.setScene(QGraphicsScene())
 		self.setRenderHint(QPainter.RenderHint.Antialiasing)
 
+		# Full-size decodes get their own small pool so thumbnails can't starve
+		# them, and so only a couple of them ever run at once
+		self.pool = QThreadPool()
+		self.pool.setMaxThreadCount(max(1, Config.read(Setting.ImageWorkers)))
+
+		# Decodes start only once selection stops changing for a moment
+		self.decode_timer = QTimer()
+		self.decode_timer.setSingleShot(True)
+		self.decode_timer.setInterval(Config.read(Setting.ViewerDebounce))
+		self.decode_timer.timeout.connect(self.start_decodes)
+		self.image_cache = ByteLRUCache(Config.read(Setting.ViewerCacheSize) * 1024 * 1024)
+
 		self.loader = ImageLoader()
 		self.loader.image_ready.connect(self.on_image_ready)
+		self.tile_loader = TileLoader()
+		self.tile_loader.tile_ready.connect(self.on_tile_ready)
+
+	def cache_stats(self) -> str:
+		hits = self.image_cache.hits
+		misses = self.image_cache.misses
+		lookups = hits + misses
+		rate = f"{hits / lookups:.0%}" if lookups else "n/a"
+		return (
+			f"Hits: {hits}\nMisses: {misses}\nHit rate: {rate}\n"
+			f"Cached images: {len(self.image_cache)} ({self.image_cache.total_bytes / 1024 / 1024:.0f} MB)"
+		)
+
+	def clear_cache(self):
+		self.image_cache.clear()
+		self.image_cache.reset_stats()
+
+	def load_image(self, image: Image, prefetch: list[Image] | None = None):
+		"""Shows ``image`` and decodes the images in ``prefetch`` in the background.
+
+		A cached frame or the preview is shown at once, while decoding waits for
+		selection to settle, so holding down a navigation key doesn't queue a
+		full decode per step. Decodes of images no longer wanted are canceled,
+		mid-file if they already started.
+		"""
+		self.current_image = image
+		self.prefetch = prefetch or []
+
+		wanted = {image, *self.prefetch}
+		for other in [other for other in self.tasks if other not in wanted]:
+			self._cancel(other)
+
+		size = image.size or read_size(image.path)
+		qimage = self.image_cache.get(image)
+		if qimage is not None:
+			self.set_view(QPixmap.fromImage(qimage))
+		elif size is not None and size.width() * size.height() > self.tiled_threshold and supports_clip_rect(image.path):
+			self.set_tiled_view(image, size)
+		else:
+			preview = image.preview
+			if preview is not None:
+				pixmap = preview.pixmap(QSize(500,500)) # could be done better
+				self.set_view(pixmap)
+			else:
+				self._clear_scene()
+
+		self.decode_timer.start()
+
+	def start_decodes(self):
+		image = self.current_image
+		if image is None:
+			return
 
-	def load_image(self, image: Image):
-		pixmap = image.preview.pixmap(QSize(500,500)) # could be done better
-		self.set_view(pixmap)
+		if image not in self.image_cache and self.tiled_item is None:
+			task = self.tasks.get(image)
+			if task is not None and not task.started:
+				self._cancel(image) # still queued as a prefetch, requeue it in front
+			if image not in self.tasks:
+				self._start(image, 1)
 
-		if self.current_task:
-			self.current_task.canceled = True
+		for neighbour in self.prefetch:
+			if neighbour not in self.tasks and neighbour not in self.image_cache:
+				self._start(neighbour, 0)
 
-		self.current_task = ImageTask(image, self.loader)
-		QThreadPool.globalInstance().start(self.current_task, 1)
+	def on_image_ready(self, image: Image, generation: int, qimage: QImage):
+		task = self.tasks.get(image)
+		if task is None or task.generation != generation:
+			return # canceled or replaced after it finished decoding
+		del self.tasks[image]
+		if qimage.isNull():
+			return
 
-	def on_image_ready(self, qimage: QImage):
-		pixmap = QPixmap.fromImage(qimage)
-		self.set_view(pixmap)
+		self.image_cache.put(image, qimage, qimage.sizeInBytes())
+		if image is self.current_image:
+			self.set_view(QPixmap.fromImage(qimage))
+
+	def on_tile_ready(self, key: tuple, qimage: QImage):
+		item = self.tiled_item
+		if item is None or sip.isdeleted(item) or key[0] is not item.image:
+			return
+		item.on_tile_ready(key, qimage)
+
+	def set_tiled_view(self, image: Image, size: QSize):
+		"""Shows an image too large to decode at once, see ``TiledImageItem``."""
+		preview = image.preview
+		preview = preview.pixmap(QSize(500, 500)) if preview is not None else None
+
+		self._clear_scene()
+		self.tiled_item = TiledImageItem(image, size, self.image_cache, self.pool, self.tile_loader, preview)
+		self.scene().addItem(self.tiled_item)
+		self.current_zoom = 1.0
+		self.setSceneRect(0, 0, size.width(), size.height())
+		self.fitInView(self.tiled_item.boundingRect(), Qt.AspectRatioMode.KeepAspectRatio)
 
 	def set_view(self, pixmap: QPixmap):
-		self.scene().clear()
+		self._clear_scene()
 		self.scene().addPixmap(pixmap)
 		self.current_zoom = 1.0
 		self.setSceneRect(0, 0, pixmap.width(), pixmap.height())
@@ -60,3 +161,22 @@ class GraphicsView(QGraphicsView):
 		new_position = self.mapToScene(event.position().toPoint())
 		delta = new_position - old_position
 		self.translate(delta.x(), delta.y())
+
+	# --- Private methods
+
+	def _cancel(self, image: Image):
+		# Only flagged, the pool deletes finished tasks so they can't be taken back
+		self.tasks.pop(image).canceled = True
+
+	def _clear_scene(self):
+		item = self.tiled_item
+		if item is not None and not sip.isdeleted(item):
+			item.cancel()
+		self.tiled_item = None
+		self.scene().clear()
+
+	def _start(self, image: Image, priority: int):
+		self.generation += 1
+		task = ImageTask(image, self.loader, self.generation, self.tiled_threshold)
+		self.tasks[image] = task
+		self.pool.start(task, priority)
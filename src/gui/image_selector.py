@@ -1,8 +1,13 @@
-from PyQt6.QtCore import QSize
-from PyQt6.QtWidgets import QVBoxLayout, QListView, QDockWidget, QWidget
+from bisect import bisect_left
+
+from PyQt6.QtCore import QSize, QTimer, pyqtSignal
+from PyQt6.QtWidgets import QVBoxLayout, QLineEdit, QListView, QDockWidget, QWidget
 
 
 class ImageSelector(QDockWidget):
+	visible_rows_changed = pyqtSignal(int, int) # first, last
+	filter_changed = pyqtSignal(str) # query text, once typing pauses
+
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
 		self.setObjectName("image_selector")
@@ -11,8 +16,12 @@ class ImageSelector(QDockWidget):
 		vbox = QVBoxLayout()
 		main_widget.setLayout(vbox)
 
+		self.filter_edit = QLineEdit()
+		self.filter_edit.setPlaceholderText("Filter, e.g. 1girl AND NOT solo, tags < 5, file:*.png")
+		self.filter_edit.setClearButtonEnabled(True)
 		self.listview = QListView()
 
+		vbox.addWidget(self.filter_edit)
 		vbox.addWidget(self.listview)
 
 		self.setWidget(main_widget)
@@ -23,3 +32,47 @@ class ImageSelector(QDockWidget):
 		self.listview.setViewMode(QListView.ViewMode.IconMode)
 		self.listview.setResizeMode(QListView.ResizeMode.Adjust)
 		self.listview.setUniformItemSizes(True)
+
+		# Scrolling, resizing and rows arriving all move the scroll bar's value or range
+		self._visible_timer = QTimer()
+		self._visible_timer.setSingleShot(True)
+		self._visible_timer.setInterval(0)
+		self._visible_timer.timeout.connect(self.update_visible_rows)
+		self.listview.verticalScrollBar().valueChanged.connect(self._visible_timer.start)
+		self.listview.verticalScrollBar().rangeChanged.connect(self._visible_timer.start)
+
+		self._filter_timer = QTimer()
+		self._filter_timer.setSingleShot(True)
+		self._filter_timer.setInterval(250)
+		self._filter_timer.timeout.connect(self.apply_filter)
+		self.filter_edit.textChanged.connect(self._filter_timer.start)
+		self.filter_edit.returnPressed.connect(self.apply_filter)
+
+	def apply_filter(self):
+		self._filter_timer.stop()
+		self.filter_changed.emit(self.filter_edit.text())
+
+	def set_filter_error(self, message: str | None):
+		"""Shows why the filter text isn't a valid query, or clears it for None."""
+		self.filter_edit.setToolTip(message or "")
+
+	def update_visible_rows(self):
+		rows = self.visible_rows()
+		if rows is not None:
+			self.visible_rows_changed.emit(*rows)
+
+	def visible_rows(self) -> tuple[int, int] | None:
+		"""Returns the first and last rows in the viewport. Rows are laid out in
+		lines top to bottom, so both ends are found by binary search."""
+		view = self.listview
+		model = view.model()
+		if model is None or model.rowCount() == 0:
+			return None
+
+		height = view.viewport().height()
+		count = model.rowCount()
+		first = bisect_left(range(count), True, key=lambda row: view.visualRect(model.index(row, 0)).bottom() >= 0)
+		last = bisect_left(range(count), True, key=lambda row: view.visualRect(model.index(row, 0)).top() > height) - 1
+		if first > last:
+			return None
+		return first, last
@@ -1,22 +1,72 @@
-from PyQt6.QtCore import QObject, pyqtSignal, QRunnable, pyqtSlot
-from PyQt6.QtGui import QImage
+import math
+
+from PyQt6.QtCore import QFile, QIODevice, QObject, pyqtSignal, QRunnable, pyqtSlot, QSize
+from PyQt6.QtGui import QImage, QImageIOHandler, QImageReader
 
 from models.image import Image
 
 
 class ImageLoader(QObject):
-	image_ready = pyqtSignal(QImage)
+	image_ready = pyqtSignal(Image, int, QImage) # image, generation, decoded image
+
+class CancelableFile(QFile):
+	"""File that fails every read once its task is canceled, so a decoder
+	streaming from it gives up partway through the file."""
+
+	def __init__(self, path: str, task: "ImageTask"):
+		super().__init__(path)
+		self.task = task
+
+	def readData(self, maxlen: int) -> bytes | None:
+		if self.task.canceled:
+			return None # read error
+		return super().readData(maxlen)
 
 class ImageTask(QRunnable):
-	def __init__(self, image: Image, loader: ImageLoader):
+	def __init__(self, image: Image, loader: ImageLoader, generation: int = 0, max_pixels: int = 0):
 		super().__init__()
 		self.image = image
 		self.loader = loader
+		self.generation = generation
+		self.max_pixels = max_pixels # larger images are tiled or scaled down, 0 for no limit
+		self.started = False
 		self.canceled = False
 
 	@pyqtSlot()
 	def run(self):
+		self.started = True
+		if self.canceled:
+			return
+
+		# Qt picks a handler under a lock every reader shares, and detecting the
+		# format there would read through readData, in Python. With the GUI
+		# thread waiting on that lock while holding the GIL, decodes deadlocked.
+		# Detecting it from Qt's own file first keeps Python out of the lock.
+		image_format = QImageReader.imageFormat(str(self.image.path))
+		file = CancelableFile(str(self.image.path), self)
+		if not image_format or not file.open(QIODevice.OpenModeFlag.ReadOnly):
+			error = file.errorString() if image_format else "Unsupported image format"
+			print(f"Error loading image: {error}")
+			self.loader.image_ready.emit(self.image, self.generation, QImage())
+			return
+
+		reader = QImageReader(file, image_format)
+		reader.setAutoTransform(True)
+		size = reader.size()
+		if self.max_pixels and size.isValid() and size.width() * size.height() > self.max_pixels:
+			if reader.supportsOption(QImageIOHandler.ImageOption.ClipRect):
+				qimage = QImage() # drawn from tiles instead
+			else:
+				# Other formats decode the whole image for every tile, so they are
+				# shown whole, scaled down
+				scale = math.sqrt(self.max_pixels / (size.width() * size.height()))
+				reader.setScaledSize(QSize(max(1, int(size.width() * scale)), max(1, int(size.height() * scale))))
+				qimage = reader.read()
+		else:
+			qimage = reader.read()
+			if qimage.isNull() and not self.canceled:
+				print(f"Error loading image: {reader.errorString()}")
+		file.close()
+
 		if not self.canceled:
-			qimage = QImage(str(self.image.path))
-		if not self.canceled:
-			self.loader.image_ready.emit(qimage)
+			self.loader.image_ready.emit(self.image, self.generation, qimage)
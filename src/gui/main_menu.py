@@ -2,6 +2,7 @@ from PyQt6.QtGui import QAction, QIcon, QKeySequence
 from PyQt6.QtWidgets import QMenuBar
 
 from gui.recent_menu import RecentMenu
+from models.tag_history import TagHistory
 
 
 def setup_menu(window: "MainWindow"):
@@ -28,6 +29,17 @@ def setup_menu(window: "MainWindow"):
 	quit_action.triggered.connect(window.close)
 	file_menu.addAction(quit_action)
 
+	edit_menu = menu.addMenu("&Edit")
+
+	history = TagHistory.instance().stack
+	undo_action = history.createUndoAction(edit_menu, "&Undo")
+	undo_action.setIcon(QIcon.fromTheme(QIcon.ThemeIcon.EditUndo))
+	edit_menu.addAction(undo_action)
+
+	redo_action = history.createRedoAction(edit_menu, "&Redo")
+	redo_action.setIcon(QIcon.fromTheme(QIcon.ThemeIcon.EditRedo))
+	edit_menu.addAction(redo_action)
+
 	view_menu = menu.addMenu("&View")
 
 	show_selector_action = QAction("Show Image &Selector", view_menu)
@@ -58,11 +70,44 @@ def setup_menu(window: "MainWindow"):
 	unified_tag_dock_action.triggered.connect(window.toggle_unified_dock)
 	view_menu.addAction(unified_tag_dock_action)
 
+	tags_menu = menu.addMenu("T&ags")
+
+	for entry in (
+		("&Remove Tags...", window.bulk_remove_tag),
+		("Re&name Tag...", window.bulk_rename_tag),
+		("Re&place Tag...", window.bulk_replace_tag),
+		("&Merge Tags...", window.bulk_merge_tags),
+		("&Insert Tag...", window.bulk_insert_tag),
+		None,
+		("Remove &Duplicate Tags", window.bulk_deduplicate),
+		("Sort Tags by &Post Count", window.bulk_sort_by_post_count),
+		("Sort Tags &Alphabetically", window.bulk_sort_by_name),
+	):
+		if entry is None:
+			tags_menu.addSeparator()
+			continue
+		text, slot = entry
+		action = QAction(text, tags_menu)
+		action.triggered.connect(slot)
+		tags_menu.addAction(action)
+
+	tools_menu = menu.addMenu("&Tools")
+
+	clear_thumbnails_action = QAction("Clear &Thumbnail Cache", tools_menu)
+	clear_thumbnails_action.triggered.connect(window.clear_thumbnail_cache)
+	tools_menu.addAction(clear_thumbnails_action)
+
+	viewer_stats_action = QAction("&Viewer Cache Statistics", tools_menu)
+	viewer_stats_action.triggered.connect(window.show_viewer_cache_stats)
+	tools_menu.addAction(viewer_stats_action)
+
 	# Create menu shortcuts
 
 	open_action.setShortcut(QKeySequence.StandardKey.Open)
 	quit_action.setShortcut(QKeySequence.StandardKey.Quit)
 	save_action.setShortcut(QKeySequence.StandardKey.Save)
+	undo_action.setShortcut(QKeySequence.StandardKey.Undo)
+	redo_action.setShortcut(QKeySequence.StandardKey.Redo)
 
 	# Create references
 
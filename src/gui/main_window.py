@@ -1,13 +1,26 @@
-from PyQt6.QtCore import QItemSelectionRange, Qt, QSize, pyqtSignal
+from array import array
+from collections import Counter
+from pathlib import Path
+
+from PyQt6.QtCore import QItemSelectionRange, Qt, QSize, QThreadPool, pyqtSignal
 from PyQt6.QtGui import QAction, QCloseEvent
-from PyQt6.QtWidgets import QMainWindow, QFileDialog
+from PyQt6.QtWidgets import QMainWindow, QFileDialog, QInputDialog, QMessageBox, QProgressBar
 
 from settings.config import Config, Setting
 from models.directory import Directory
+from models.bulk_tag_operations import BulkTagEngine, TagOrder
 from models.directory_image_model import DirectoryImageModel
+from models.edit_journal import EditJournal
+from models.image_filter_model import ImageFilterModel
 from models.tag_index_model import TagIndexModel
 from models.image import Image
 from models.image_tag_model import ImageTagModel
+from models.tag_history import TagHistory
+from models.tag_query import TagQuery
+from gui.completion_service import CompletionService
+from gui.directory_scan_task import DirectoryScanner, DirectoryScanTask
+from gui.directory_watcher import DirectoryChanges, DirectoryWatcher
+from gui.tag_load_task import TagLoader, TagLoadTask
 from gui.main_menu import setup_menu
 from gui.image_selector import ImageSelector
 from gui.image_viewer import ImageViewer
@@ -15,6 +28,8 @@ from gui.tag_editor import TagEditor
 from gui.tag_index import TagIndex
 from gui.unified_tagger import UnifiedTagger
 from settings.shortcut_manager import ShortcutManager
+from util.tag_cache import TagCache
+from util.thumbnail_cache import ThumbnailCache
 
 
 class MainWindow(QMainWindow):
@@ -25,6 +40,13 @@ class MainWindow(QMainWindow):
 
 		self.current_image: Image | None = None
 		self.current_directory: Directory | None = None
+		self.journal: EditJournal | None = None
+		self.journal_records: list[dict] = [] # recovered edits, replayed once the scan finishes
+		self.scan_task: DirectoryScanTask | None = None
+		self.scan_generation = 0
+		self.scan_count = 0
+		self.tag_loads_pending = 0 # tag load tasks of the open directory still running
+		self.travel_direction = 1 # +1 when stepping forward through the list, -1 backward
 
 		# Assemble interface
 
@@ -68,13 +90,45 @@ class MainWindow(QMainWindow):
 
 		setup_menu(self)
 
+		# Create status bar
+
+		self.scan_progress = QProgressBar()
+		self.scan_progress.setRange(0, 0) # busy indicator, total is unknown while scanning
+		self.scan_progress.setMaximumWidth(150)
+		self.scan_progress.hide()
+		self.statusBar().addPermanentWidget(self.scan_progress)
+
+		self.save_progress = QProgressBar()
+		self.save_progress.setMaximumWidth(150)
+		self.save_progress.setFormat("Saving %v/%m")
+		self.save_progress.hide()
+		self.statusBar().addPermanentWidget(self.save_progress)
+
 		# Set models
 
 		self.directory_image_model = DirectoryImageModel()
 		self.tag_index_model = TagIndexModel()
+		self.image_filter_model = ImageFilterModel(self.directory_image_model, self.tag_index_model)
 		self.image_tag_model = ImageTagModel()
+		self.bulk_tags = BulkTagEngine(self.tag_index_model)
+		self.bulk_tags.started.connect(self.on_bulk_started)
+		self.bulk_tags.finished.connect(self.on_bulk_finished)
+
+		self.scanner = DirectoryScanner()
+		self.scanner.images_found.connect(self.on_images_found)
+		self.scanner.scan_finished.connect(self.on_scan_finished)
+
+		# Sidecars are parsed on a dedicated pool so thumbnails keep flowing meanwhile
+		self.tag_pool = QThreadPool()
+		self.tag_pool.setMaxThreadCount(min(8, QThreadPool.globalInstance().maxThreadCount()))
+		self.tag_loader = TagLoader()
+		self.tag_loader.tags_loaded.connect(self.on_tags_loaded)
+		self.tag_cache = TagCache.instance() if Config.read(Setting.TagCacheEnabled) else None
+
+		self.watcher = DirectoryWatcher(poll_interval=Config.read(Setting.WatchPollInterval) * 1000)
+		self.watcher.changes_detected.connect(self.on_directory_changed)
 
-		self.image_selector.listview.setModel(self.directory_image_model)
+		self.image_selector.listview.setModel(self.image_filter_model)
 		self.tag_editor.set_model(self.image_tag_model)
 		self.tag_index.set_model(self.tag_index_model)
 		self.unified_tagger.set_models(self.image_tag_model, self.tag_index_model)
@@ -88,9 +142,14 @@ class MainWindow(QMainWindow):
 		# Connect signals
 
 		self.image_loaded.connect(self.tag_index_model.on_image_loaded)
+		self.image_selector.visible_rows_changed.connect(self.image_filter_model.set_visible_rows)
 		self.image_selector.listview.selectionModel().selectionChanged.connect(self.display_image)
-		self.image_tag_model.image_tags_modified.connect(self.directory_image_model.on_image_tags_modified)
-		self.image_tag_model.image_tags_modified.connect(self.tag_index_model.on_image_tags_modified)
+		self.image_selector.filter_changed.connect(self.set_image_filter)
+		self.image_filter_model.modelReset.connect(self.on_filter_reset)
+		self.directory_image_model.save_progress.connect(self.on_save_progress)
+		self.directory_image_model.save_finished.connect(self.on_save_finished)
+		self.directory_image_model.images_saved.connect(self.on_images_saved)
+		TagHistory.instance().tags_changed.connect(self.on_tags_changed)
 		self.tag_editor.data_changed.connect(self.update_dynamic_labels)
 		self.tag_index.data_changed.connect(self.update_dynamic_labels)
 		self.unified_tagger.data_changed.connect(self.update_dynamic_labels)
@@ -107,6 +166,95 @@ class MainWindow(QMainWindow):
 		self.tag_editor.clear_model()
 
 		self.current_image = None
+		self.image_filter_model.set_pinned(None)
+		self.image_selector.listview.selectionModel().clear()
+		self.image_viewer.gfx_view.scene().clear()
+		self.tag_editor.clear_input()
+
+	def bulk_deduplicate(self):
+		self.bulk_tags.deduplicate()
+
+	def bulk_insert_tag(self):
+		tag = self.ask_tags("Insert Tag", "Tag to add to every image that lacks it:", "")
+		if len(tag) != 1:
+			return
+		position, ok = QInputDialog.getInt(self, "Insert Tag", "Position (0 is first, -1 is last):", 0, -1000, 1000)
+		if ok:
+			self.bulk_tags.insert(tag[0], position)
+
+	def bulk_merge_tags(self):
+		tags = self.ask_tags("Merge Tags", "Tags to merge, separated by commas:")
+		if not tags:
+			return
+		target = self.ask_tags("Merge Tags", "Merge into:", tags[0])
+		if len(target) == 1:
+			self.bulk_tags.merge(tags, target[0])
+
+	def bulk_remove_tag(self):
+		tags = self.ask_tags("Remove Tags", "Tags to remove from every image, separated by commas:")
+		if tags:
+			self.bulk_tags.remove(tags)
+
+	def bulk_rename_tag(self):
+		tag = self.ask_tags("Rename Tag", "Tag to rename:")
+		if len(tag) != 1:
+			return
+		new_tag = self.ask_tags("Rename Tag", f"Rename \"{tag[0]}\" to:", tag[0])
+		if len(new_tag) == 1 and new_tag != tag:
+			self.bulk_tags.rename(tag[0], new_tag[0])
+
+	def bulk_replace_tag(self):
+		tag = self.ask_tags("Replace Tag", "Tag to replace:")
+		if len(tag) != 1:
+			return
+		new_tags = self.ask_tags("Replace Tag", f"Replace \"{tag[0]}\" with, separated by commas:", "")
+		if new_tags:
+			self.bulk_tags.replace(tag[0], new_tags)
+
+	def bulk_sort_by_name(self):
+		self.bulk_tags.reorder(TagOrder.ALPHABETICAL)
+
+	def bulk_sort_by_post_count(self):
+		if CompletionService.instance().model.columns is None:
+			# Every tag would sort as unknown, leaving an empty step on the undo stack
+			self.statusBar().showMessage("Post counts haven't been loaded, so tags can't be sorted by them", 5000)
+			return
+		self.bulk_tags.reorder(TagOrder.POST_COUNT)
+
+	def add_images(self, images: list[Image]):
+		"""Inserts ``images`` of the open directory and loads their tags in the background."""
+		self.directory_image_model.insert_images(images)
+
+		chunk_size = 512
+		for start in range(0, len(images), chunk_size):
+			task = TagLoadTask(images[start:start + chunk_size], self.tag_loader, self.scan_generation, self.tag_cache)
+			self.tag_pool.start(task)
+			self.tag_loads_pending += 1
+		if images:
+			self.bulk_tags.set_indexing(True)
+		self.update_dynamic_labels()
+
+	def ask_tags(self, title: str, label: str, text: str | None = None) -> list[str]:
+		"""Asks for comma separated tags, suggesting the tag selected in the tag index.
+		:returns: The tags entered, or nothing if canceled.
+		"""
+		if text is None:
+			text = self.selected_index_tag()
+		text, ok = QInputDialog.getText(self, title, label, text=text)
+		if not ok:
+			return []
+		return [tag.strip() for tag in text.split(",") if tag.strip()]
+
+	def selected_index_tag(self) -> str:
+		widget = self.unified_tagger.tag_index_widget if self.unified_tagger.isVisible() else self.tag_index.tag_index_widget
+		index = widget.list_view.currentIndex()
+		return index.data(Qt.ItemDataRole.EditRole) if index.isValid() else ""
+
+	def clear_thumbnail_cache(self):
+		ThumbnailCache.instance().clear()
+
+	def show_viewer_cache_stats(self):
+		QMessageBox.information(self, "Viewer Cache", self.image_viewer.gfx_view.cache_stats())
 
 	def display_image(self, selected_items: QItemSelectionRange, deselected_items: QItemSelectionRange):
 		"""Display selected image in graphics view"""
@@ -116,12 +264,216 @@ class MainWindow(QMainWindow):
 
 		index = selected_items.indexes()[0]  # Take the first selected item
 
-		image: Image = self.directory_image_model.data(index, Qt.ItemDataRole.UserRole)
+		image: Image = index.data(Qt.ItemDataRole.UserRole)
+		if image is self.current_image:
+			return # selected again after the filter was reset
+
+		if self.current_image is not None:
+			previous_row = self.image_filter_model.row_of(self.current_image)
+			if previous_row is not None and previous_row != index.row():
+				self.travel_direction = 1 if index.row() > previous_row else -1
 
 		self.image_tag_model.set_image(image)
-		self.image_viewer.gfx_view.load_image(image)
+		self.image_viewer.gfx_view.load_image(image, self.prefetch_candidates(index.row()))
 		self.image_loaded.emit(image)
 		self.current_image = image
+		self.image_filter_model.set_pinned(image)
+		self.update_dynamic_labels()
+
+	def prefetch_candidates(self, row: int) -> list[Image]:
+		"""Returns the images to decode ahead of ``row``: a few in the direction
+		of travel, nearest first, and the one just behind. Rows are those of the
+		filtered list, so only images that can be stepped to are decoded."""
+		depth = Config.read(Setting.PrefetchDepth)
+		rows = [row + self.travel_direction * step for step in range(1, depth + 1)]
+		if depth > 0:
+			rows.append(row - self.travel_direction)
+		images = (self.image_filter_model.image_at(r) for r in rows)
+		return [image for image in images if image is not None]
+
+	def on_bulk_finished(self, text: str, count: int):
+		self.statusBar().showMessage(f"{text}: {count} images changed", 5000)
+
+	def on_bulk_started(self, text: str):
+		self.statusBar().showMessage(f"{text}...")
+
+	def on_directory_changed(self, changes: DirectoryChanges):
+		"""Folds files added, removed or rewritten by other programs into the models."""
+		images = self.directory_image_model.images_by_path()
+
+		added = [Image(path) for path in changes.added if path not in images]
+		if added:
+			self.add_images(added)
+			self.statusBar().showMessage(f"{len(added)} images added", 5000)
+
+		removed = [images[path] for path in changes.removed if path in images]
+		if removed:
+			if self.current_image in removed:
+				self.reset_views()
+			self.tag_index_model.remove_images(removed)
+			self.directory_image_model.remove_images(removed)
+
+		images_by_stem: dict[Path, list[Image]] = {}
+		for image in images.values():
+			images_by_stem.setdefault(image.path.with_suffix(""), []).append(image)
+
+		tag_changes = []
+		conflicts: list[Image] = []
+		for sidecar, tag_ids in changes.sidecars:
+			for image in images_by_stem.get(sidecar.with_suffix(""), []):
+				if not image.is_tags_loaded():
+					continue # its pending background load will read the new file
+				if image.is_modified():
+					image.sidecar_conflict = True
+					conflicts.append(image)
+					continue
+				old_tags = Counter(image.tag_ids)
+				image.replace_tags(array("I", tag_ids))
+				tag_changes.append((image, old_tags, Counter(image.tag_ids)))
+				self.directory_image_model.on_image_tags_modified(image)
+				if image is self.current_image:
+					self.image_tag_model.set_image(image)
+
+		if tag_changes:
+			self.tag_index_model.apply_tag_changes(tag_changes)
+
+		for image in conflicts:
+			self.directory_image_model.on_image_tags_modified(image)
+
+		if conflicts:
+			names = "\n".join(image.path.name for image in conflicts[:10])
+			more = f"\n... and {len(conflicts) - 10} more" if len(conflicts) > 10 else ""
+			QMessageBox.warning(
+				self,
+				"Tags Changed on Disk",
+				"These images have unsaved edits, but their tag files were changed by another program. "
+				"Your edits were kept; saving will overwrite the files on disk.\n\n" + names + more
+			)
+
+		self.update_dynamic_labels()
+
+	def on_filter_reset(self):
+		"""Selects the current image again if the filter still shows it."""
+		row = self.image_filter_model.row_of(self.current_image) if self.current_image else None
+		if row is not None:
+			self.image_selector.listview.setCurrentIndex(self.image_filter_model.index(row))
+
+	def on_images_found(self, generation: int, images: list[Image]):
+		if generation != self.scan_generation:
+			return # batch from a superseded scan
+
+		self.add_images(images)
+		self.scan_count += len(images)
+		self.statusBar().showMessage(f"Scanning... {self.scan_count} images")
+
+	def open_journal(self, path: Path):
+		"""Starts journaling edits in ``path``, offering to recover edits a
+		previous session journaled there but never saved."""
+		self.close_journal()
+		if not Config.read(Setting.JournalEnabled):
+			return
+
+		journal = EditJournal(path)
+		if journal.has_records():
+			records = journal.read()
+			answer = QMessageBox.question(
+				self,
+				"Recover Edits",
+				f"This directory has {len(records)} unsaved tag edits from a previous session. Recover them?",
+				QMessageBox.StandardButton.Yes | QMessageBox.StandardButton.No
+			) if records else QMessageBox.StandardButton.No
+			if answer == QMessageBox.StandardButton.Yes:
+				self.journal_records = records
+			else:
+				journal.discard()
+
+		self.journal = journal
+		Image.journal = journal
+
+	def close_journal(self):
+		Image.journal = None
+		self.journal_records = []
+		if self.journal is not None:
+			self.journal.close()
+			self.journal = None
+
+	def replay_journal(self):
+		"""Applies recovered edits. They are already in the journal, so they
+		aren't journaled again."""
+		records, self.journal_records = self.journal_records, []
+		Image.journal = None
+		try:
+			changes = EditJournal.replay(records, {image.path.name: image for image in self.current_directory.images})
+		finally:
+			Image.journal = self.journal
+
+		self.tag_index_model.apply_tag_changes(changes)
+		for image, _, _ in changes:
+			self.directory_image_model.on_image_tags_modified(image)
+		if any(image is self.current_image for image, _, _ in changes):
+			self.image_tag_model.set_image(self.current_image)
+		self.statusBar().showMessage(f"Recovered edits to {len(changes)} images", 5000)
+		self.update_dynamic_labels()
+
+	def on_images_saved(self, saved: list):
+		self.watcher.acknowledge({image.path.with_suffix(".txt"): stat for image, stat in saved}, written=True)
+		if any(image is self.current_image for image, _ in saved):
+			self.image_tag_model.refresh_modified()
+
+	def on_save_finished(self, count: int, errors: list):
+		self.save_progress.hide()
+		if self.journal is not None and not self.journal_records:
+			self.journal.compact([
+				(image.path.name, array("I", image.tag_ids))
+				for image in self.current_directory.modified_images()
+			])
+		self.statusBar().showMessage(f"Saved {count} images", 5000)
+
+		if errors:
+			lines = "\n".join(f"{image.path.name}: {message}" for image, message in errors[:10])
+			more = f"\n... and {len(errors) - 10} more" if len(errors) > 10 else ""
+			QMessageBox.warning(
+				self,
+				"Save Failed",
+				f"{len(errors)} images could not be saved. They keep their edits and stay marked as modified.\n\n"
+				+ lines + more
+			)
+
+	def on_save_progress(self, done: int, total: int):
+		self.save_progress.setRange(0, total)
+		self.save_progress.setValue(done)
+		self.save_progress.show()
+
+	def on_scan_finished(self, generation: int, count: int):
+		if generation != self.scan_generation:
+			return
+
+		self.scan_task = None
+		if not self.tag_loads_pending:
+			self.bulk_tags.set_indexing(False)
+		self.scan_progress.hide()
+		self.watcher.start(self.current_directory.path, {image.path.name for image in self.current_directory.images})
+		self.statusBar().showMessage(f"Loaded {count} images", 5000)
+		if self.journal_records:
+			self.replay_journal()
+
+	def on_tags_changed(self, images: list[Image], gained: dict, lost: dict):
+		"""Folds a batch of edits, undos or redos into every model at once."""
+		self.tag_index_model.apply_membership_changes(images, gained, lost)
+		self.directory_image_model.on_images_tags_modified(images)
+		self.image_tag_model.on_tags_changed(images)
+		self.update_dynamic_labels()
+
+	def on_tags_loaded(self, generation: int, results: list, stats: dict):
+		if generation != self.scan_generation:
+			return
+
+		# Tags are only up to date with the sidecars as read
+		self.watcher.acknowledge(stats)
+		self.tag_index_model.add_loaded_tags(results)
+		self.tag_loads_pending -= 1
+		if not self.tag_loads_pending and self.scan_task is None:
+			self.bulk_tags.set_indexing(False)
 		self.update_dynamic_labels()
 
 	def on_open_recent(self):
@@ -144,11 +496,33 @@ class MainWindow(QMainWindow):
 		if not path:
 			return
 
-		directory = Directory(path)
+		# Supersede any scan still in progress
+		if self.scan_task is not None:
+			self.scan_task.canceled = True
+		self.tag_pool.clear()
+		self.watcher.stop()
+		self.image_viewer.gfx_view.clear_cache()
+		# Saves of the old directory report to nobody once it's replaced, so let
+		# them finish and compact its journal first
+		self.directory_image_model.wait_for_save()
+		self.open_journal(Path(path))
+		TagHistory.instance().clear()
+		self.bulk_tags.cancel()
+		self.bulk_tags.set_indexing(True)
+		self.scan_generation += 1
+		self.scan_count = 0
+		self.tag_loads_pending = 0
+
+		directory = Directory(path, load=False)
 
 		self.directory_image_model.setDirectory(directory)
 		self.tag_index_model.load(directory)
 
+		self.scan_task = DirectoryScanTask(Path(path), self.scanner, self.scan_generation)
+		QThreadPool.globalInstance().start(self.scan_task, 2)
+		self.scan_progress.show()
+		self.statusBar().showMessage("Scanning...")
+
 		self.recent_menu.add_entry(path)
 
 		self.reset_views()
@@ -174,6 +548,18 @@ class MainWindow(QMainWindow):
 			prev_index = model.index(current_index.row() - 1, 0)
 			view.setCurrentIndex(prev_index)
 
+	def set_image_filter(self, text: str):
+		try:
+			query = TagQuery(text) if text.strip() else None
+		except ValueError as exception:
+			self.image_selector.set_filter_error(str(exception))
+			self.statusBar().showMessage(f"Invalid filter: {str(exception)}", 5000)
+			return
+
+		self.image_selector.set_filter_error(None)
+		self.image_filter_model.set_query(query)
+		self.update_dynamic_labels()
+
 	def toggle_unified_dock(self, unified: bool):
 		if unified:
 			selector_width = self.image_selector.width()
@@ -199,17 +585,14 @@ class MainWindow(QMainWindow):
 	def update_dynamic_labels(self):
 		if self.current_image:
 			image_viewer_title = self.current_image.path.name
-			tag_editor_title = "Image Tags ({})".format(len(self.current_image.tags))
-			unified_tag_title = "Tags ({}/{})".format(len(self.current_image.tags), len(self.tag_index_model.tag_map))
+			tag_editor_title = "Image Tags ({})".format(self.current_image.tag_count())
+			unified_tag_title = "Tags ({}/{})".format(self.current_image.tag_count(), self.tag_index_model.rowCount())
 			self.tag_editor.set_input_enabled(True)
 			self.unified_tagger.set_input_enabled(True)
 		else:
 			image_viewer_title = "Viewer"
 			tag_editor_title = "Image Tags"
 			unified_tag_title = "Tags"
-			self.image_selector.listview.selectionModel().clear()
-			self.image_viewer.gfx_view.scene().clear()
-			self.tag_editor.clear_input()
 			self.tag_editor.set_input_enabled(False)
 			self.unified_tagger.set_input_enabled(False)
 
@@ -218,12 +601,21 @@ class MainWindow(QMainWindow):
 		else:
 			window_title = None
 
+		if self.image_filter_model.is_filtered():
+			image_selector_title = "Image Selector ({}/{})".format(
+				self.image_filter_model.rowCount(),
+				self.directory_image_model.rowCount()
+			)
+		else:
+			image_selector_title = "Image Selector"
+
 		self.setWindowTitle(window_title)
+		self.image_selector.setWindowTitle(image_selector_title)
 		self.image_viewer.setWindowTitle(image_viewer_title)
 		self.tag_editor.setWindowTitle(tag_editor_title)
 		self.unified_tagger.setWindowTitle(unified_tag_title)
 
-		self.tag_index.setWindowTitle("Directory Tags ({})".format(len(self.tag_index_model.tag_map)))
+		self.tag_index.setWindowTitle("Directory Tags ({})".format(self.tag_index_model.rowCount()))
 
 	def closeEvent(self, event: QCloseEvent | None):
 		if Config.read(Setting.RestoreLayout):
@@ -231,4 +623,11 @@ class MainWindow(QMainWindow):
 			Config.write(Setting.LayoutState, self.saveState())
 			Config.write(Setting.UnifiedTagDock, self.unified_dock_action.isChecked())
 
-		ShortcutManager.instance().save_shortcuts()
\ No newline at end of file
+		ShortcutManager.instance().save_shortcuts()
+		self.directory_image_model.wait_for_save()
+		self.close_journal()
+		CompletionService.instance().close()
+		if self.directory_image_model.thumbnail_cache is not None:
+			self.directory_image_model.thumbnail_cache.close()
+		if self.tag_cache is not None:
+			self.tag_cache.close()
\ No newline at end of file
@@ -0,0 +1,46 @@
+from array import array
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal, pyqtSlot
+
+from models.image import Image
+from models.tag_vocabulary import TagVocabulary
+from util.sidecar_writer import format_tags, write_sidecars
+
+
+class TagSaver(QObject):
+	# generation, [(Image, saved tag IDs, (size, mtime_ns))], [(Image, error message)]
+	batch_saved = pyqtSignal(int, list, list)
+
+class SaveTask(QRunnable):
+	"""Writes the sidecars of a batch of images on a worker thread.
+
+	Works on copies of the tag IDs taken on the GUI thread, so edits made while
+	saving neither race the write nor get lost: the image just stays modified
+	if its tags no longer match what was written.
+	"""
+	def __init__(self, batch: list[tuple[Image, array]], saver: TagSaver, generation: int):
+		super().__init__()
+		self.batch = batch
+		self.saver = saver
+		self.generation = generation
+
+	@pyqtSlot()
+	def run(self):
+		files = [
+			(image.path.with_suffix(".txt"), format_tags(TagVocabulary.strings(tag_ids)))
+			for image, tag_ids in self.batch
+		]
+		try:
+			written, failed = write_sidecars(files)
+		except Exception as exception:
+			# Report every image as failed rather than leave the save hanging
+			written, failed = {}, {path: str(exception) for path, _ in files}
+
+		saved = []
+		errors = []
+		for (path, _), (image, tag_ids) in zip(files, self.batch):
+			if path in written:
+				saved.append((image, tag_ids, written[path]))
+			else:
+				errors.append((image, failed.get(path, "not written")))
+		self.saver.batch_saved.emit(self.generation, saved, errors)
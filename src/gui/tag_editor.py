@@ -3,20 +3,21 @@ from PyQt6.QtGui import QShortcut, QKeySequence, QTextOption
 from PyQt6.QtWidgets import QListView, QVBoxLayout, QLineEdit, QWidget, QCompleter, QAbstractScrollArea, QTableView, \
 	QAbstractItemView, QHeaderView
 
+from settings.config import Config, Setting
 from models.image_tag_model import ImageTagModel
-from models.tag_completer_model import TagCompleterModel
+from models.tag_completion_model import TagCompletionModel
+from gui.completion_service import CompletionService
 from gui.swap_dock import SwapDock
 
 
 class TagEditorWidget(QWidget):
 	data_changed = pyqtSignal()
-	_completion_model: TagCompleterModel = None
-	_alpha_completer: QCompleter = None
-	_count_completer: QCompleter = None
+	completion_limit = 50 # matches offered per keystroke
 
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
-		self.db_path = "data/danbooru.db"
+		self.completion_service = CompletionService.instance()
+		self.completion_serial = 0 # of the query whose results the popup should show
 
 		vbox = QVBoxLayout()
 		self.setLayout(vbox)
@@ -27,20 +28,16 @@ class TagEditorWidget(QWidget):
 		vbox.addWidget(self.line_edit)
 		vbox.addWidget(self.list_view)
 
-		model = self._completion_model_instance()
+		model = self.completion_service.model
 
+		# Matching is done by the completion service, the completer only shows its results
+		self.completion_matches = TagCompletionModel()
 		completer = QCompleter()
-		completer.setModel(model)
-		completer.setCompletionColumn(model.Column.NAME)
-		#completer.setModelSorting(QCompleter.ModelSorting.CaseInsensitivelySortedModel)
-		completer.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
-		completer.setCompletionMode(QCompleter.CompletionMode.PopupCompletion)
-		completer.setFilterMode(Qt.MatchFlag.MatchContains)
+		completer.setModel(self.completion_matches)
+		completer.setCompletionColumn(TagCompletionModel.Column.NAME)
+		completer.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
 		completer.setMaxVisibleItems(10)
 
-		# Once you completer.setModel(), you can model.sort() to get sorted completions
-		model.sort(model.Column.POST_COUNT, Qt.SortOrder.DescendingOrder)
-
 		table_view = QTableView()
 		completer.setPopup(table_view)
 		table_view.horizontalHeader().setVisible(False)
@@ -48,19 +45,12 @@ class TagEditorWidget(QWidget):
 		# table_view.setGridStyle(Qt.PenStyle.NoPen)
 		table_view.setSelectionBehavior(QAbstractItemView.SelectionBehavior.SelectRows)
 
-		metrics = table_view.fontMetrics()
-		tag_width = metrics.averageCharWidth() * model.get_top_percentile_tag_len(99)
-		count_width = metrics.averageCharWidth() * (model.get_max_count_len() + 1)
-
-		table_view.setFixedWidth(tag_width + count_width)
 		table_view.setWordWrap(False)
-		row_height = metrics.height()
+		row_height = table_view.fontMetrics().height()
 		table_view.verticalHeader().setMinimumSectionSize(row_height)
 		table_view.verticalHeader().setDefaultSectionSize(row_height)
 
 		table_view.verticalHeader().setSectionResizeMode(QHeaderView.ResizeMode.Fixed)
-		table_view.setColumnWidth(0, tag_width)
-		table_view.setColumnWidth(1, count_width)
 		table_view.horizontalHeader().setSectionResizeMode(0, QHeaderView.ResizeMode.Fixed)
 		table_view.horizontalHeader().setSectionResizeMode(1, QHeaderView.ResizeMode.Fixed)
 
@@ -71,19 +61,14 @@ class TagEditorWidget(QWidget):
 		# popup.setLayoutMode(QListView.LayoutMode.Batched) # greatly increases responsiveness, but flickers
 		# popup.setBatchSize(100)
 
-		def on_text_edited(text):
-			"""Intended to restrict matching to minimum number of characters, but performance is
-			very good regardless, so it's a matter of taste now."""
-			if len(text) >= 3:
-				if self.line_edit.completer() is None:
-					self.line_edit.setCompleter(completer)
-			else:
-				if self.line_edit.completer() is not None:
-					self.line_edit.setCompleter(None)
-
-		# self.line_edit.setCompleter(completer) # don't forget to do this if not using on_text_edited hack
+		self.line_edit.setCompleter(completer)
+		self.line_edit.textEdited.connect(self.on_text_edited)
 
-		self.line_edit.textEdited.connect(on_text_edited)
+		# Typing works right away, suggestions join in once the vocabulary has loaded
+		if model.is_loaded:
+			self.size_popup()
+		model.loaded.connect(self.on_vocabulary_loaded)
+		self.completion_service.completions_ready.connect(self.on_completions_ready)
 
 		self.line_edit.returnPressed.connect(self.add_tag)
 		delete_shortcut = QShortcut(QKeySequence.StandardKey.Delete, self.list_view)
@@ -115,6 +100,45 @@ class TagEditorWidget(QWidget):
 	def on_data_changed(self):
 		self.data_changed.emit()
 
+	def on_completions_ready(self, serial: int, matches: list[tuple[str, int]]):
+		if serial != self.completion_serial:
+			return # another widget's, or superseded
+		self.completion_matches.set_matches(matches)
+		completer = self.line_edit.completer()
+		if not matches:
+			completer.popup().hide()
+		elif self.line_edit.hasFocus():
+			completer.complete()
+
+	def on_vocabulary_loaded(self):
+		self.size_popup()
+		if self.line_edit.hasFocus() and self.line_edit.text():
+			self.on_text_edited(self.line_edit.text())
+
+	def size_popup(self):
+		"""Fits the popup's columns to the vocabulary's stored length stats."""
+		model = self.completion_service.model
+		table_view: QTableView = self.line_edit.completer().popup()
+		metrics = table_view.fontMetrics()
+		tag_width = metrics.averageCharWidth() * model.get_top_percentile_tag_len(99)
+		count_width = metrics.averageCharWidth() * (model.get_max_count_len() + 1)
+
+		table_view.setFixedWidth(tag_width + count_width)
+		table_view.setColumnWidth(0, tag_width)
+		table_view.setColumnWidth(1, count_width)
+
+	def on_text_edited(self, text: str):
+		"""Asks for completions in the background. Matching starts at three
+		characters, which is a matter of taste, since the index is fast either way."""
+		client = id(self)
+		if len(text) >= 3:
+			fuzzy = Config.read(Setting.FuzzyCompletion)
+			self.completion_serial = self.completion_service.request(client, text, TagEditorWidget.completion_limit, fuzzy)
+		else:
+			self.completion_service.cancel(client)
+			self.completion_serial = 0
+			self.completion_matches.set_matches([])
+
 	def set_model(self, model):
 		old_model = self.list_view.model()
 		if old_model is not None:
@@ -127,12 +151,6 @@ class TagEditorWidget(QWidget):
 		model.rowsInserted.connect(self.on_data_changed)
 		model.rowsRemoved.connect(self.on_data_changed)
 
-	def _completion_model_instance(self):
-		if TagEditorWidget._completion_model is None:
-			TagEditorWidget._completion_model = TagCompleterModel(self.db_path)
-
-		return TagEditorWidget._completion_model
-
 class TagEditor(SwapDock):
 	def __init__(self, *args, **kwargs):
 		super().__init__(*args, **kwargs)
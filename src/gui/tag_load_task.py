@@ -0,0 +1,77 @@
+import os
+from array import array
+from pathlib import Path
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal, pyqtSlot
+
+from models.image import Image
+from models.tag_vocabulary import TagVocabulary
+from util.tag_cache import TagCache
+
+
+class TagLoader(QObject):
+	# generation, list[tuple[Image, array]] of tag IDs, {sidecar Path: (size, mtime_ns) as read, None if missing}
+	tags_loaded = pyqtSignal(int, list, dict)
+
+class TagLoadTask(QRunnable):
+	"""Parses the sidecars of a batch of images on a worker thread.
+
+	Sidecars are stat'ed before they're read, and with a ``TagCache`` their
+	tags come from the cache unless the file changed. Parsed entries are handed
+	back with the stats rather than installed here, so the GUI thread stays the
+	only writer of image tag state.
+	"""
+	def __init__(self, images: list[Image], loader: TagLoader, generation: int, cache: TagCache | None = None):
+		super().__init__()
+		self.images = images
+		self.loader = loader
+		self.generation = generation
+		self.cache = cache
+
+	@pyqtSlot()
+	def run(self):
+		stats: dict[str, os.stat_result] = {}
+		for image in self.images:
+			tag_path = str(image.path.with_suffix(".txt"))
+			try:
+				stats[tag_path] = os.stat(tag_path)
+			except OSError:
+				continue
+
+		if self.cache is None:
+			results = [(image, self._parse(image)) for image in self.images]
+		else:
+			results = self._load_cached(stats)
+
+		read = {image.path.with_suffix(".txt"): None for image in self.images}
+		read.update((Path(tag_path), (stat.st_size, stat.st_mtime_ns)) for tag_path, stat in stats.items())
+		self.loader.tags_loaded.emit(self.generation, results, read)
+
+	# --- Private methods
+
+	def _load_cached(self, stats: dict[str, os.stat_result]) -> list[tuple[Image, array]]:
+		hits = self.cache.lookup(stats)
+
+		results = []
+		misses = []
+		for image in self.images:
+			tag_path = str(image.path.with_suffix(".txt"))
+			if tag_path not in stats:
+				results.append((image, array("I")))
+			elif tag_path in hits:
+				results.append((image, Image.parse_tag_text(hits[tag_path])))
+			else:
+				tag_ids = self._parse(image)
+				results.append((image, tag_ids))
+				misses.append((tag_path, stats[tag_path], ",".join(TagVocabulary.strings(tag_ids))))
+
+		self.cache.store(misses)
+		return results
+
+	@staticmethod
+	def _parse(image: Image) -> array:
+		try:
+			return Image.parse_tags(image.path)
+		except (OSError, UnicodeDecodeError) as exception:
+			print(f"Error reading tags for {image.path.name}: {str(exception)}")
+			return array("I")
@@ -0,0 +1,111 @@
+import heapq
+
+from PyQt6.QtCore import QObject, QThreadPool, pyqtSignal
+from PyQt6.QtGui import QImage
+
+from models.image import Image
+from gui.thumbnail_task import ThumbnailLoader, ThumbnailTask
+from util.image_decode import ThumbnailQuality
+from util.thumbnail_cache import ThumbnailCache
+
+
+class ThumbnailScheduler(QObject):
+	"""Decodes thumbnails on a dedicated, bounded pool, visible images first.
+
+	Requests are held in the scheduler's own queue and only a few at a time are
+	handed to the pool, so the order can still change after they're made. When
+	the visible range changes, queued requests that scrolled out of view are
+	dropped; views ask again if those rows are painted later. Requests for an
+	image that is already queued or decoding are merged.
+
+	Visible requests go first, the most recent first within each group. Each
+	group is a heap, so a dispatch doesn't look through the whole queue; a
+	request made again leaves its old heap entry behind, skipped when popped.
+	"""
+	thumbnail_ready = pyqtSignal(Image, QImage, QImage) # image, preview, thumbnail
+
+	def __init__(
+			self,
+			workers: int = 0,
+			cache: ThumbnailCache | None = None,
+			quality: ThumbnailQuality = ThumbnailQuality.BALANCED
+	):
+		super().__init__()
+		self.cache = cache
+		self.quality = quality
+
+		self.pool = QThreadPool()
+		if workers > 0:
+			self.pool.setMaxThreadCount(workers)
+
+		self.loader = ThumbnailLoader()
+		self.loader.thumbnail_ready.connect(self.on_thumbnail_ready)
+
+		self._queued: dict[Image, int] = {} # image -> request serial, higher is more recent
+		self._visible_heap: list[tuple[int, Image]] = [] # (-serial, image) of visible requests
+		self._other_heap: list[tuple[int, Image]] = [] # (-serial, image) of the rest
+		self._in_flight: set[Image] = set()
+		self._visible: set[Image] = set()
+		self._serial = 0
+
+	def clear(self):
+		"""Forgets every request, e.g. when another directory is opened.
+		Decodes already running finish, but their results are not announced."""
+		self._queued.clear()
+		self._visible_heap.clear()
+		self._other_heap.clear()
+		self._in_flight.clear()
+		self._visible.clear()
+		self.pool.clear()
+
+	def is_scheduled(self, image: Image) -> bool:
+		return image in self._queued or image in self._in_flight
+
+	def on_thumbnail_ready(self, image: Image, preview: QImage, thumbnail: QImage):
+		if image not in self._in_flight:
+			return # cleared while decoding
+		self._in_flight.discard(image)
+		self.thumbnail_ready.emit(image, preview, thumbnail)
+		self._dispatch()
+
+	def request(self, image: Image):
+		if image in self._in_flight:
+			return
+		self._serial += 1
+		self._queued[image] = self._serial
+		heapq.heappush(self._visible_heap if image in self._visible else self._other_heap, (-self._serial, image))
+		self._dispatch()
+
+	def set_visible(self, images: list[Image]):
+		"""Updates the images currently in the viewport. Queued requests for
+		anything else are dropped."""
+		self._visible = set(images)
+		for image in [image for image in self._queued if image not in self._visible]:
+			del self._queued[image]
+		# Everything still queued is visible now
+		self._visible_heap = [(-serial, image) for image, serial in self._queued.items()]
+		heapq.heapify(self._visible_heap)
+		self._other_heap = []
+
+	# --- Private methods
+
+	def _dispatch(self):
+		# Keep the pool just busy enough to never idle between completions
+		while self._queued and len(self._in_flight) < self.pool.maxThreadCount() * 2:
+			image = self._pop(self._visible_heap)
+			visible = image is not None
+			if not visible:
+				image = self._pop(self._other_heap)
+
+			del self._queued[image]
+			self._in_flight.add(image)
+			task = ThumbnailTask(image, self.loader, self.cache, self.quality)
+			self.pool.start(task, 1 if visible else 0)
+
+	def _pop(self, heap: list[tuple[int, Image]]) -> Image | None:
+		"""Returns the most recent request still queued in ``heap``."""
+		while heap:
+			serial, image = heapq.heappop(heap)
+			if self._queued.get(image) == -serial:
+				return image
+		return None
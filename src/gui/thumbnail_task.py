@@ -1,38 +1,63 @@
-from PyQt6.QtCore import QRunnable, QObject, pyqtSignal, pyqtSlot, Qt, QPoint, QRect, QSize
+from PyQt6.QtCore import QRunnable, QObject, pyqtSignal, pyqtSlot, QPoint, QRect, QSize
 from PyQt6.QtGui import QImage
 
 from models.image import Image
+from util.image_decode import ThumbnailQuality, decode_thumbnail
+from util.thumbnail_cache import ThumbnailCache
 
+THUMB_SIZE = 200
+
+
+def crop_thumbnail(qimage: QImage, thumb_size: int) -> QImage:
+	"""Crops the centered ``thumb_size`` square out of a scaled preview."""
+	top_left = QPoint(
+		(qimage.width() - thumb_size) // 2,
+		(qimage.height() - thumb_size) // 2
+	)
+	crop_rect = QRect(top_left, QSize(thumb_size, thumb_size))
+	return qimage.copy(crop_rect)
 
 class ThumbnailLoader(QObject):
-	thumbnail_ready = pyqtSignal(Image)
+	thumbnail_ready = pyqtSignal(Image, QImage, QImage) # image, preview, thumbnail
 
 class ThumbnailTask(QRunnable):
-	def __init__(self, image: Image, loader: ThumbnailLoader):
+	def __init__(
+			self,
+			image: Image,
+			loader: ThumbnailLoader,
+			cache: ThumbnailCache | None = None,
+			quality: ThumbnailQuality = ThumbnailQuality.BALANCED
+	):
 		super().__init__()
 		self.image = image
-		self.thumb_size = 200
+		self.thumb_size = THUMB_SIZE
 		self.loader = loader
+		self.cache = cache
+		self.quality = quality
 
 	@pyqtSlot()
 	def run(self):
+		# The on-disk cache is read on the pool as well, so painting a row never
+		# waits on its stat, query and decode
+		cached = self.cache.get(self.image.path, self.thumb_size, self.quality) if self.cache else None
+		if cached is not None:
+			qimage, self.image.size = cached
+		else:
+			qimage = self.decode()
+
+		# Results are handed to the GUI thread, which owns the shared pixmap cache
+		thumbnail = crop_thumbnail(qimage, self.thumb_size)
+		self.loader.thumbnail_ready.emit(self.image, qimage, thumbnail)
+
+	def decode(self) -> QImage:
+		"""Decodes the thumbnail and stores it in the on-disk cache."""
+		stat = ThumbnailCache.stat(self.image.path) if self.cache else None
+
 		# QPixmap uses the GUI thread, so load and scale with QImage
-		qimage = QImage(str(self.image.path))
+		qimage, size = decode_thumbnail(self.image.path, self.thumb_size, self.quality)
+		if size is not None:
+			self.image.size = size
 		if not qimage.isNull():
-			self.image.size = qimage.size()
-			qimage = qimage.scaled(
-				self.thumb_size,
-				self.thumb_size,
-				Qt.AspectRatioMode.KeepAspectRatioByExpanding,
-				Qt.TransformationMode.SmoothTransformation
-			)
-		self.image.preview = qimage
-
-		top_left = QPoint(
-			(qimage.width() - self.thumb_size) // 2,
-			(qimage.height() - self.thumb_size) // 2
-		)
-		crop_rect = QRect(top_left, QSize(self.thumb_size, self.thumb_size))
-
-		self.image.thumbnail = qimage.copy(crop_rect)
-		self.loader.thumbnail_ready.emit(self.image)
+			if stat is not None:
+				self.cache.put(self.image.path, self.thumb_size, self.quality, stat, qimage, self.image.size)
+		return qimage
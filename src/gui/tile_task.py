@@ -0,0 +1,42 @@
+from PyQt6.QtCore import QObject, QPoint, QRect, QRunnable, QSize, pyqtSignal, pyqtSlot
+from PyQt6.QtGui import QImage, QImageReader
+
+from models.image import Image
+from util.image_decode import oriented_size, stored_rect
+
+
+class TileLoader(QObject):
+	tile_ready = pyqtSignal(tuple, QImage) # (image, level, column, row), tile
+
+class TileTask(QRunnable):
+	"""Decodes one tile of a large image: ``source`` in full-resolution pixels
+	as displayed, scaled down to ``size``."""
+
+	def __init__(self, key: tuple[Image, int, int, int], source: QRect, size: QSize, loader: TileLoader):
+		super().__init__()
+		self.key = key
+		self.source = source
+		self.size = size
+		self.loader = loader
+		self.canceled = False
+
+	@pyqtSlot()
+	def run(self):
+		if self.canceled:
+			return
+
+		# Tiles are laid out as displayed; the reader clips and scales the
+		# stored pixels, then orients the result. A tile of the whole image, the
+		# top level, is only scaled, which JPEG does while decoding.
+		reader = QImageReader(str(self.key[0].path))
+		reader.setAutoTransform(True)
+		transformation = reader.transformation()
+		if self.source != QRect(QPoint(0, 0), oriented_size(reader.size(), transformation)):
+			reader.setClipRect(stored_rect(self.source, reader.size(), transformation))
+		reader.setScaledSize(oriented_size(self.size, transformation))
+		qimage = reader.read()
+		if qimage.isNull():
+			print(f"Error decoding tile of {self.key[0].path.name}: {reader.errorString()}")
+
+		if not self.canceled:
+			self.loader.tile_ready.emit(self.key, qimage)
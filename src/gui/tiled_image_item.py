@@ -0,0 +1,139 @@
+import math
+
+from PyQt6.QtCore import QRect, QRectF, QSize, QThreadPool
+from PyQt6.QtGui import QImage, QPainter, QPixmap
+from PyQt6.QtWidgets import QGraphicsItem, QStyleOptionGraphicsItem, QWidget
+
+from models.image import Image
+from gui.tile_task import TileLoader, TileTask
+from util.lru_cache import ByteLRUCache
+
+
+class TiledImageItem(QGraphicsItem):
+	"""Draws a very large image from tiles decoded on demand.
+
+	Tiles form a pyramid where level ``n`` holds the image at ``1 / 2**n`` scale,
+	down to a top level that fits into a single tile. Painting only decodes the
+	tiles that intersect the exposed area, from the level matching the current
+	zoom. Until they arrive, the nearest coarser tile already in the cache, or
+	else the preview, is stretched in their place. Tiles live in a shared byte-budgeted cache, so
+	memory stays bounded however far the image is panned and zoomed.
+
+	Only formats whose reader supports a clip rect (JPEG) are tiled. The rest
+	decode the whole image for every tile, so they are shown scaled down.
+	"""
+	tile_size = 512
+
+	def __init__(
+			self,
+			image: Image,
+			size: QSize,
+			cache: ByteLRUCache,
+			pool: QThreadPool,
+			loader: TileLoader,
+			preview: QPixmap | None = None
+	):
+		super().__init__()
+		self.image = image
+		self.image_size = size
+		self.preview = preview
+		self.cache = cache
+		self.pool = pool
+		self.loader = loader
+		self.pending: dict[tuple, TileTask] = {}
+
+		self.top_level = max(0, math.ceil(math.log2(max(size.width(), size.height()) / TiledImageItem.tile_size)))
+		self.setFlag(QGraphicsItem.GraphicsItemFlag.ItemUsesExtendedStyleOption)
+
+	def cancel(self):
+		"""Drops every tile decode that hasn't started yet."""
+		for task in self.pending.values():
+			task.canceled = True
+		self.pending.clear()
+
+	def on_tile_ready(self, key: tuple, qimage: QImage):
+		if self.pending.pop(key, None) is None or qimage.isNull():
+			return
+		self.cache.put(key, qimage, qimage.sizeInBytes())
+		self.update(QRectF(self._source_rect(*key[1:])))
+
+	# ---- Overrides
+
+	def boundingRect(self) -> QRectF:
+		return QRectF(0, 0, self.image_size.width(), self.image_size.height())
+
+	def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem, widget: QWidget | None = None):
+		lod = option.levelOfDetailFromTransform(painter.worldTransform())
+		level = min(max(0, math.floor(math.log2(1 / lod))) if lod > 0 else self.top_level, self.top_level)
+
+		# Always have the whole image at the coarsest level to fall back on
+		self._request(self.top_level, 0, 0, 2)
+
+		exposed = option.exposedRect.toAlignedRect().intersected(self.boundingRect().toAlignedRect())
+		span = TiledImageItem.tile_size << level
+		wanted = set()
+		for row in range(exposed.top() // span, exposed.bottom() // span + 1):
+			for column in range(exposed.left() // span, exposed.right() // span + 1):
+				key = (self.image, level, column, row)
+				wanted.add(key)
+				tile = self.cache.get(key)
+				if tile is not None:
+					painter.drawImage(QRectF(self._source_rect(level, column, row)), tile)
+				else:
+					self._draw_fallback(painter, level, column, row)
+					self._request(level, column, row, 1)
+
+		# Tiles scrolled away or from another zoom level are no longer worth decoding
+		for key in [key for key in self.pending if key not in wanted and key[1] != self.top_level]:
+			self.pending.pop(key).canceled = True
+
+	# --- Private methods
+
+	def _draw_fallback(self, painter: QPainter, level: int, column: int, row: int):
+		source = self._source_rect(level, column, row)
+		for coarse in range(level + 1, self.top_level + 1):
+			span = TiledImageItem.tile_size << coarse
+			key = (self.image, coarse, source.left() // span, source.top() // span)
+			tile = self.cache.peek(key)
+			if tile is None:
+				continue
+			coarse_source = self._source_rect(*key[1:])
+			scale = 1 << coarse
+			region = QRectF(
+				(source.left() - coarse_source.left()) / scale,
+				(source.top() - coarse_source.top()) / scale,
+				source.width() / scale,
+				source.height() / scale
+			)
+			painter.drawImage(QRectF(source), tile, region)
+			return
+
+		if self.preview is not None:
+			scale_x = self.preview.width() / self.image_size.width()
+			scale_y = self.preview.height() / self.image_size.height()
+			region = QRectF(
+				source.left() * scale_x,
+				source.top() * scale_y,
+				source.width() * scale_x,
+				source.height() * scale_y
+			)
+			painter.drawPixmap(QRectF(source), self.preview, region)
+
+	def _request(self, level: int, column: int, row: int, priority: int):
+		key = (self.image, level, column, row)
+		if key in self.pending or key in self.cache:
+			return
+
+		source = self._source_rect(level, column, row)
+		scale = 1 << level
+		size = QSize(max(1, math.ceil(source.width() / scale)), max(1, math.ceil(source.height() / scale)))
+		task = TileTask(key, source, size, self.loader)
+		self.pending[key] = task
+		self.pool.start(task, priority)
+
+	def _source_rect(self, level: int, column: int, row: int) -> QRect:
+		"""Returns the full-resolution pixels covered by a tile."""
+		span = TiledImageItem.tile_size << level
+		return QRect(column * span, row * span, span, span).intersected(
+			QRect(0, 0, self.image_size.width(), self.image_size.height())
+		)
@@ -0,0 +1,36 @@
+from os import PathLike
+
+from PyQt6.QtCore import QObject, QRunnable, pyqtSignal, pyqtSlot
+
+from util.completion_index import CompletionIndex
+from util.tag_columns import TagColumns
+from util.tag_database import read_vocabulary
+
+
+class VocabularyLoader(QObject):
+	vocabulary_loaded = pyqtSignal(TagColumns, dict, CompletionIndex) # columns, stats, index
+
+class VocabularyLoadTask(QRunnable):
+	"""Maps the tag vocabulary's columns off the GUI thread, building them from
+	the tag database first if it changed since they were saved."""
+
+	def __init__(self, db_path: str | PathLike, loader: VocabularyLoader):
+		super().__init__()
+		self.db_path = db_path
+		self.loader = loader
+
+	@pyqtSlot()
+	def run(self):
+		path = TagColumns.default_path(self.db_path)
+		columns = TagColumns.open(path, TagColumns.file_fingerprint(self.db_path))
+		if columns is not None:
+			stats = columns.stats()
+		else:
+			rows, stats = read_vocabulary(self.db_path)
+			# Fingerprint after reading, which may have stored stats in the database
+			fingerprint = TagColumns.file_fingerprint(self.db_path)
+			columns = TagColumns.from_rows(rows, fingerprint, stats)
+			if rows and columns.save(path):
+				columns = TagColumns.open(path, fingerprint) or columns
+
+		self.loader.vocabulary_loaded.emit(columns, stats, CompletionIndex(columns))
@@ -0,0 +1,285 @@
+from array import array
+from enum import Enum
+from typing import Callable
+
+from PyQt6.QtCore import QObject, QThreadPool, pyqtSignal
+
+from models.image import Image
+from models.tag_history import TagDelta, TagHistory, TagPermutation, TagSubstitution
+from models.tag_vocabulary import TagVocabulary
+from gui.bulk_tag_task import BulkTagPlanner, BulkTagTask
+from gui.completion_service import CompletionService
+from util.tag_arrays import find_tag, holding, tag_bytes
+
+# Images and their tag ID arrays, as they were when the operation started.
+# Two lists rather than a list of pairs, which would be as many more objects
+# for the garbage collector to track.
+Snapshot = tuple[list[Image], list[array]]
+
+
+class TagOrder(Enum):
+	POST_COUNT = "post_count" # most used on danbooru first, unknown tags last
+	ALPHABETICAL = "alphabetical"
+
+def plan_deduplicate(snapshot: Snapshot) -> list:
+	"""Removes every occurrence of a tag after its first."""
+	removal = TagDelta(False)
+	for image, tags in zip(*snapshot):
+		if len(set(tags)) == len(tags):
+			continue
+		seen = set()
+		for position, tag_id in enumerate(tags):
+			if tag_id in seen:
+				removal.add(image, position, tag_id)
+			seen.add(tag_id)
+	return [removal]
+
+def plan_insert(snapshot: Snapshot, tag_id: int, position: int) -> list:
+	"""Inserts ``tag_id`` at ``position`` in every image that lacks it.
+	Negative positions count from the end, so -1 appends."""
+	insertion = TagDelta(True)
+	images, arrays = snapshot
+	for image, tags, has in zip(images, arrays, holding(arrays, tag_id)):
+		if has:
+			continue
+		count = len(tags)
+		index = position if position >= 0 else count + 1 + position
+		insertion.add(image, min(max(index, 0), count), tag_id)
+	return [insertion]
+
+def plan_remove(snapshot: Snapshot, tag_ids: set[int]) -> list:
+	removal = TagDelta(False)
+	patterns = [tag_bytes(tag_id) for tag_id in tag_ids]
+	for image, tags in zip(*snapshot):
+		for position in _positions(tags.tobytes(), patterns):
+			removal.add(image, position, tags[position])
+	return [removal]
+
+def plan_reorder(snapshot: Snapshot, key: Callable[[int], object]) -> list:
+	"""Stably sorts each image's tags by ``key`` of their IDs, which is called
+	once per distinct tag."""
+	keys = {}
+	permutation = TagPermutation()
+	for image, tags in zip(*snapshot):
+		for tag_id in tags:
+			if tag_id not in keys:
+				keys[tag_id] = key(tag_id)
+		order = sorted(range(len(tags)), key=lambda position: keys[tags[position]])
+		if any(position != previous for position, previous in enumerate(order)):
+			permutation.add(image, order)
+	return [permutation]
+
+def plan_replace(snapshot: Snapshot, sources: set[int], replacement: list[int]) -> list:
+	"""Replaces the first occurrence of any of ``sources`` in each image with
+	``replacement`` and removes the other occurrences. Replacement tags the
+	image already has elsewhere are left where they are rather than duplicated.
+
+	Renaming, replacing a tag with several and merging tags are all this.
+	"""
+	substitution = TagSubstitution()
+	removal = TagDelta(False)
+	insertion = TagDelta(True)
+	patterns = [tag_bytes(tag_id) for tag_id in sources]
+	targets = [(tag_id, tag_bytes(tag_id)) for tag_id in dict.fromkeys(replacement)]
+	# Renaming a tag that occurs once into one the image lacks is by far the
+	# commonest case, and is told apart with searches that run in C
+	renamed = next(iter(sources)) if len(sources) == 1 and len(targets) == 1 else None
+	for image, tags in zip(*snapshot):
+		data = tags.tobytes()
+		if renamed is not None:
+			position = find_tag(data, patterns[0])
+			if position >= 0 and data.count(patterns[0]) == 1 and targets[0][1] not in data:
+				substitution.add(image, position, renamed, targets[0][0])
+				continue
+
+		positions = _positions(data, patterns)
+		if not positions:
+			continue
+
+		additions = [tag_id for tag_id, pattern in targets if tag_id in sources or find_tag(data, pattern) < 0]
+		first = positions[0]
+		if additions:
+			if tags[first] != additions[0]:
+				substitution.add(image, first, tags[first], additions[0])
+			removed = positions[1:]
+		else:
+			removed = positions
+
+		for position in removed:
+			removal.add(image, position, tags[position])
+		# Every removed position is after the first, so the rest go right behind it
+		for offset, tag_id in enumerate(additions[1:], 1):
+			insertion.add(image, first + offset, tag_id)
+
+	return [substitution, removal, insertion]
+
+def _positions(data: bytes, patterns: list[bytes]) -> list[int]:
+	"""Returns the ascending positions of the tags stored as ``patterns`` in
+	``data``, the bytes of a tag array."""
+	positions = []
+	for pattern in patterns:
+		position = find_tag(data, pattern)
+		while position >= 0:
+			positions.append(position)
+			position = find_tag(data, pattern, position + 1)
+	if len(patterns) > 1:
+		positions.sort()
+	return positions
+
+class BulkTagEngine(QObject):
+	"""Runs tag operations across the whole directory as single undoable steps.
+
+	Only the images the inverted index says contain the affected tags are
+	touched. For large sets the operation is planned on a worker, reading the
+	images' tag arrays; if any image's tags were edited or reloaded meanwhile,
+	the plan is thrown away and made again. The resulting deltas are pushed to
+	``TagHistory``, which applies them and announces the whole operation as one
+	batch of model changes.
+
+	Operations requested while one is being planned run after it, so each one
+	plans against the result of the previous. While the directory's tags are
+	still being indexed they wait for that too, see ``set_indexing``.
+	"""
+	started = pyqtSignal(str) # undo text, when the operation waits or is planned in the background
+	finished = pyqtSignal(str, int) # undo text, images changed
+
+	background_threshold = 2000 # images
+
+	def __init__(self, tag_index_model: "TagIndexModel"):
+		super().__init__()
+		self.tag_index_model = tag_index_model
+		self.history = TagHistory.instance()
+		self.serial = 0
+		self._running: tuple[int, Callable[[], None]] | None = None # Image.tags_revision and operation being planned
+		self._queue: list[Callable[[], None]] = []
+		self._indexing = False
+
+		self.planner = BulkTagPlanner()
+		self.planner.planned.connect(self.on_planned)
+
+	def cancel(self):
+		"""Drops queued operations and the result of a running one, e.g. when
+		another directory is opened."""
+		self.serial += 1
+		self._running = None
+		self._queue.clear()
+
+	def deduplicate(self):
+		self._submit("Remove duplicate tags", self._loaded_images, plan_deduplicate)
+
+	def insert(self, tag: str, position: int):
+		tag_id = TagVocabulary.intern(tag)
+		self._submit(
+			f"Insert \"{tag}\"",
+			lambda: self.tag_index_model.images_without(tag_id),
+			lambda snapshot: plan_insert(snapshot, tag_id, position)
+		)
+
+	def is_busy(self) -> bool:
+		return self._running is not None
+
+	def merge(self, tags: list[str], target: str):
+		sources = self._ids(tags)
+		target_id = TagVocabulary.intern(target)
+		self._submit(
+			f"Merge {len(tags)} tags into \"{target}\"",
+			lambda: self._images_with(sources),
+			lambda snapshot: plan_replace(snapshot, sources, [target_id])
+		)
+
+	def on_planned(self, serial: int, text: str, deltas: list):
+		if serial != self.serial:
+			return # canceled
+		revision, operation = self._running
+		self._running = None
+		if self._indexing:
+			self._queue.insert(0, operation) # images were added while planning
+			return
+		if revision != Image.tags_revision:
+			operation() # tags were edited or reloaded while planning
+			return
+		self._finish(text, deltas)
+
+	def remove(self, tags: list[str]):
+		tag_ids = self._ids(tags)
+		text = f"Remove \"{tags[0]}\"" if len(tags) == 1 else f"Remove {len(tags)} tags"
+		self._submit(text, lambda: self._images_with(tag_ids), lambda snapshot: plan_remove(snapshot, tag_ids))
+
+	def rename(self, tag: str, new_tag: str):
+		self.replace(tag, [new_tag], f"Rename \"{tag}\" to \"{new_tag}\"")
+
+	def reorder(self, order: TagOrder):
+		if order == TagOrder.POST_COUNT:
+			columns = CompletionService.instance().model.columns
+			if columns is None:
+				print("Error sorting tags by post count: the vocabulary isn't loaded")
+				return
+
+			def key(tag_id: int) -> int:
+				row = columns.find(TagVocabulary.string(tag_id))
+				return -columns.count(row) if row is not None else 1
+			text = "Sort tags by post count"
+		else:
+			key = TagVocabulary.string
+			text = "Sort tags alphabetically"
+		self._submit(text, self._loaded_images, lambda snapshot: plan_reorder(snapshot, key))
+
+	def replace(self, tag: str, new_tags: list[str], text: str | None = None):
+		sources = self._ids([tag])
+		replacement = list(TagVocabulary.intern_many(new_tags))
+		self._submit(
+			text or f"Replace \"{tag}\" with \"{', '.join(new_tags)}\"",
+			lambda: self._images_with(sources),
+			lambda snapshot: plan_replace(snapshot, sources, replacement)
+		)
+
+	def set_indexing(self, indexing: bool):
+		"""Holds operations while tags are loaded into the index, as a plan made
+		meanwhile would miss the images not indexed yet. Held operations run once
+		indexing finishes."""
+		self._indexing = indexing
+		if not indexing and self._queue and not self.is_busy():
+			self._queue.pop(0)()
+
+	# --- Private methods
+
+	def _finish(self, text: str, deltas: list):
+		self.history.push(text, deltas)
+		changed = {image for delta in deltas for image in delta.images}
+		self.finished.emit(text, len(changed))
+
+		if self._queue and not self.is_busy() and not self._indexing:
+			self._queue.pop(0)()
+
+	@staticmethod
+	def _ids(tags: list[str]) -> set[int]:
+		return {tag_id for tag_id in map(TagVocabulary.get, tags) if tag_id is not None}
+
+	def _images_with(self, tag_ids: set[int]) -> list[Image]:
+		"""Returns the images containing any of ``tag_ids``, from the inverted index."""
+		return self.tag_index_model.images_with(tag_ids)
+
+	def _loaded_images(self) -> list[Image]:
+		directory = self.tag_index_model.directory
+		return [image for image in directory.images if image.is_tags_loaded()] if directory else []
+
+	def _run(self, text: str, images: Callable[[], list[Image]], plan: Callable[[Snapshot], list]):
+		chosen = images()
+		snapshot = (chosen, list(map(Image.load_tags, chosen)))
+		if len(chosen) < BulkTagEngine.background_threshold:
+			self._finish(text, plan(snapshot))
+			return
+
+		self._running = (Image.tags_revision, lambda: self._run(text, images, plan))
+		self.started.emit(text)
+		QThreadPool.globalInstance().start(BulkTagTask(lambda: plan(snapshot), self.planner, self.serial, text))
+
+	def _submit(self, text: str, images: Callable[[], list[Image]], plan: Callable[[Snapshot], list]):
+		"""Runs the operation now, or after the one being planned and indexing."""
+		operation = lambda: self._run(text, images, plan)
+		if self.is_busy() or self._indexing:
+			self._queue.append(operation)
+			if not self.is_busy():
+				self.started.emit(text)
+		else:
+			operation()
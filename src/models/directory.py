@@ -1,4 +1,6 @@
+import os
 from pathlib import Path
+from typing import Iterator
 
 from models.image import Image
 
@@ -13,24 +15,33 @@ class Directory:
 		".tiff",
 	}
 
-	def __init__(self, directory: Path):
-		self.path: Path = directory
+	def __init__(self, directory: Path | str, load: bool = True):
+		self.path: Path = Path(directory)
 		self.images: list[Image] = []
 
-		self.load()
+		if load:
+			self.load()
+
+	@staticmethod
+	def scan(path: Path | str) -> Iterator[Path]:
+		"""Yields image paths in directory order. Uses ``os.scandir`` so file type
+		checks come from the directory entries rather than a stat per file."""
+		with os.scandir(path) as entries:
+			for entry in entries:
+				if os.path.splitext(entry.name)[1].lower() in Directory.image_extensions and entry.is_file():
+					yield Path(entry.path)
 
 	def load(self):
-		images: list[Image] = []
-		for path in Path(self.path).iterdir():
-			if path.is_file() and path.suffix.lower() in Directory.image_extensions:
-				images.append(Image(path))
+		images = [Image(path) for path in Directory.scan(self.path)]
 
 		images.sort()
 
 		self.images = images
 
-	def save(self):
-		for image in self.images:
-			if image.is_modified():
-				image.save_tags()
+	def modified_images(self) -> list[Image]:
+		return [image for image in self.images if image.is_modified()]
 
+	def save(self):
+		"""Saves every modified image on the calling thread."""
+		for image in self.modified_images():
+			image.save_tags()
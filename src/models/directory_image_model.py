@@ -1,22 +1,59 @@
-from PyQt6.QtCore import QAbstractListModel, Qt, QModelIndex, QThreadPool
-from PyQt6.QtGui import QColor, QFont, QIcon
+from array import array
+from bisect import bisect_right
+from pathlib import Path
+
+from PyQt6.QtCore import QAbstractListModel, QCoreApplication, Qt, QModelIndex, QThreadPool, QTimer, pyqtSignal
+from PyQt6.QtGui import QColor, QFont, QIcon, QImage
 
 from settings.config import Config, Setting
 from models.image import Image
 from models.directory import Directory
-from gui.thumbnail_task import ThumbnailLoader, ThumbnailTask
+from gui.save_task import SaveTask, TagSaver
+from gui.thumbnail_scheduler import ThumbnailScheduler
+from util.image_decode import ThumbnailQuality
+from util.thumbnail_cache import ThumbnailCache
 
 
 class DirectoryImageModel(QAbstractListModel):
+	save_progress = pyqtSignal(int, int) # images done, total
+	save_finished = pyqtSignal(int, list) # images saved, [(Image, error message)]
+	images_saved = pyqtSignal(list) # [(Image, (size, mtime_ns) of its sidecar)], per batch
+	save_batch_size = 256
+
 	def __init__(self, directory: Directory | None = None):
 		super().__init__()
 		self.directory: Directory | None = None
 		self.changed_background = QColor(Config.read(Setting.ModifiedColor))
 		self.changed_font = QFont(None, -1, -1, True)
 		self.loading_icon = QIcon.fromTheme(QIcon.ThemeIcon.ImageLoading)
+		self._rows: dict[Image, int] | None = None # image -> row, rebuilt lazily after rows move
+		self._ready: set[Image] = set() # finished thumbnails not yet announced to views
+
+		# Thumbnail completions are announced at most once per frame
+		self._ready_timer = QTimer()
+		self._ready_timer.setSingleShot(True)
+		self._ready_timer.setInterval(16)
+		self._ready_timer.timeout.connect(self.flush_ready_thumbnails)
+
+		self.thumbnail_cache = ThumbnailCache.instance() if Config.read(Setting.ThumbnailCacheEnabled) else None
+		try:
+			thumbnail_quality = ThumbnailQuality(Config.read(Setting.ThumbnailQuality))
+		except ValueError:
+			thumbnail_quality = ThumbnailQuality.BALANCED
 
-		self.loader = ThumbnailLoader()
-		self.loader.thumbnail_ready.connect(self.on_thumbnail_ready)
+		self.scheduler = ThumbnailScheduler(Config.read(Setting.ThumbnailWorkers), self.thumbnail_cache, thumbnail_quality)
+		self.scheduler.thumbnail_ready.connect(self.on_thumbnail_ready)
+
+		self.save_pool = QThreadPool()
+		self.save_pool.setMaxThreadCount(max(1, Config.read(Setting.SaveWorkers)))
+		self.saver = TagSaver()
+		self.saver.batch_saved.connect(self.on_batch_saved)
+		self.save_generation = 0
+		self._save_total = 0
+		self._save_done = 0
+		self._save_count = 0
+		self._save_errors: list[tuple[Image, str]] = []
+		self._save_pending = False
 
 		self.setDirectory(directory)
 
@@ -32,6 +69,8 @@ class DirectoryImageModel(QAbstractListModel):
 				return image.path.name
 			case Qt.ItemDataRole.FontRole:
 				return self.changed_font if image.is_modified() else None
+			case Qt.ItemDataRole.ToolTipRole:
+				return "Tags changed on disk while this image had unsaved edits" if image.sidecar_conflict else None
 			#case Qt.ItemDataRole.SizeHintRole:
 			#	return QSize(200, 200)
 			case Qt.ItemDataRole.UserRole:
@@ -42,31 +81,218 @@ class DirectoryImageModel(QAbstractListModel):
 	def rowCount(self, parent: QModelIndex = QModelIndex()):
 		return len(self.directory.images) if self.directory else 0
 
+	def insert_images(self, images: list[Image]):
+		"""Merges ``images`` into the directory in path order, inserting each
+		contiguous run of new rows with its own ``beginInsertRows``."""
+		if self.directory is None or not images:
+			return
+
+		current = self.directory.images
+		runs: list[tuple[int, list[Image]]] = []
+		position = 0
+		for image in sorted(images):
+			position = bisect_right(current, image, position)
+			if runs and runs[-1][0] == position:
+				runs[-1][1].append(image)
+			else:
+				runs.append((position, [image]))
+
+		# Appending keeps existing rows in place, so the row index can be extended
+		appending = len(runs) == 1 and runs[0][0] == len(current)
+
+		offset = 0
+		for position, run in runs:
+			row = position + offset
+			self.beginInsertRows(QModelIndex(), row, row + len(run) - 1)
+			current[row:row] = run
+			if appending and self._rows is not None:
+				self._rows.update(zip(run, range(row, row + len(run))))
+			else:
+				self._rows = None
+			self.endInsertRows()
+			offset += len(run)
+
+	def images_by_path(self) -> dict[Path, Image]:
+		return {image.path: image for image in self.directory.images} if self.directory else {}
+
+	def remove_images(self, images: list[Image]):
+		"""Removes ``images``, one ``beginRemoveRows`` per contiguous run of rows."""
+		if self.directory is None or not images:
+			return
+
+		doomed = set(images)
+		rows = sorted(row for row in map(self.row_of, doomed) if row is not None)
+
+		# Walk runs from the end so earlier row numbers stay valid
+		end = len(rows) - 1
+		while end >= 0:
+			start = end
+			while start > 0 and rows[start - 1] == rows[start] - 1:
+				start -= 1
+			first, last = rows[start], rows[end]
+			self.beginRemoveRows(QModelIndex(), first, last)
+			del self.directory.images[first:last + 1]
+			self._rows = None
+			self.endRemoveRows()
+			end = start - 1
+
+		for image in doomed:
+			self._ready.discard(image)
+			image.thumbnail = None
+			image.preview = None
+
+	def flush_ready_thumbnails(self):
+		"""Announces finished thumbnails as one ``dataChanged`` per contiguous run of rows."""
+		rows = sorted(row for row in map(self.row_of, self._ready) if row is not None)
+		self._ready.clear()
+		self._emit_rows_changed(rows, [Qt.ItemDataRole.DecorationRole])
+
+	def is_saving(self) -> bool:
+		return self._save_total > 0
+
 	def load_async_thumbnail(self, image: Image):
-		if image.thumbnail is None:
-			image.thumbnail = self.loading_icon
-			task = ThumbnailTask(image, self.loader)
-			QThreadPool.globalInstance().start(task, 0)
-		return image.thumbnail
+		"""Returns the thumbnail if it is in memory, otherwise the loading icon
+		while it is (re)loaded, from the on-disk cache if possible. Evicted
+		thumbnails come back through here."""
+		thumbnail = image.thumbnail
+		if thumbnail is not None:
+			return thumbnail
 
-	def on_thumbnail_ready(self, image: Image):
-		row = self.directory.images.index(image)
-		index = self.index(row, 0)
-		self.dataChanged.emit(index, index, [Qt.ItemDataRole.DecorationRole])
+		if not self.scheduler.is_scheduled(image):
+			self.scheduler.request(image)
+		return self.loading_icon
+
+	def on_thumbnail_ready(self, image: Image, preview: QImage, thumbnail: QImage):
+		if self.row_of(image) is None:
+			return # removed since it was requested
+		image.preview = preview
+		image.thumbnail = thumbnail
+
+		self._ready.add(image)
+		if not self._ready_timer.isActive():
+			self._ready_timer.start()
+
+	def on_batch_saved(self, generation: int, saved: list, errors: list):
+		for image, tag_ids, _ in saved:
+			image.mark_saved(tag_ids)
+		if generation != self.save_generation:
+			return # from before another directory was opened
+
+		self._save_done += len(saved) + len(errors)
+		self._save_count += len(saved)
+		self._save_errors += errors
+
+		rows = sorted(row for row in (self.row_of(image) for image, _, _ in saved) if row is not None)
+		self._emit_rows_changed(rows, [
+			Qt.ItemDataRole.BackgroundRole,
+			Qt.ItemDataRole.FontRole,
+			Qt.ItemDataRole.ToolTipRole
+		])
+		self.images_saved.emit([(image, stat) for image, _, stat in saved])
+		self.save_progress.emit(self._save_done, self._save_total)
+
+		if self._save_done >= self._save_total:
+			count, errors = self._save_count, self._save_errors
+			self._reset_save()
+			self.save_finished.emit(count, errors)
+			if self._save_pending:
+				self._save_pending = False
+				self.save()
 
 	def on_image_tags_modified(self, image: Image):
 		"""
 		Handles tag modification signal from tag editor to ensure immediate
 		updates on the selector view.
 		"""
-		row = self.directory.images.index(image)
+		row = self.row_of(image)
+		if row is None:
+			return
 		index = self.index(row)
 		self.dataChanged.emit(index, index)
 
+	def on_images_tags_modified(self, images: list[Image]):
+		"""Repaints the rows of ``images`` after a batch of tag edits."""
+		if self.directory is None:
+			return
+		rows = sorted(row for row in map(self._image_rows().get, images) if row is not None)
+		self._emit_rows_changed(rows, [
+			Qt.ItemDataRole.BackgroundRole,
+			Qt.ItemDataRole.FontRole,
+			Qt.ItemDataRole.ToolTipRole
+		])
+
+	def set_visible_images(self, images: list[Image]):
+		"""Tells the thumbnail scheduler which images are on screen."""
+		self.scheduler.set_visible(images)
+
+	def row_of(self, image: Image) -> int | None:
+		if self.directory is None:
+			return None
+		return self._image_rows().get(image)
+
 	def save(self):
-		self.directory.save()
+		"""Saves every modified image on the save pool, reporting through
+		``save_progress`` and ``save_finished``. Saving again while a save is
+		running queues another pass for whatever was edited meanwhile."""
+		if self.directory is None:
+			return
+		if self.is_saving():
+			self._save_pending = True
+			return
+
+		images = self.directory.modified_images()
+		if not images:
+			self.save_finished.emit(0, [])
+			return
+
+		self.save_pool.waitForDone() # stragglers from a previous directory, which may be this one again
+		self._save_total = len(images)
+		size = DirectoryImageModel.save_batch_size
+		for start in range(0, len(images), size):
+			batch = [(image, array("I", image.tag_ids)) for image in images[start:start + size]]
+			self.save_pool.start(SaveTask(batch, self.saver, self.save_generation))
+		self.save_progress.emit(0, self._save_total)
+
+	def wait_for_save(self):
+		"""Blocks until running saves, and any queued behind them, have finished
+		writing and their results were handled, e.g. before quitting."""
+		self.save_pool.waitForDone()
+		QCoreApplication.sendPostedEvents()
+		while self.is_saving():
+			self.save_pool.waitForDone()
+			QCoreApplication.sendPostedEvents()
 
 	def setDirectory(self, directory: Directory):
-		self.layoutAboutToBeChanged.emit()
+		self.beginResetModel()
+		self.scheduler.clear()
+		self._ready.clear()
+		self._rows = None
+		Image.pixmap_cache.clear()
+		self.save_generation += 1 # running saves finish, but report to nobody
+		self._reset_save()
+		self._save_pending = False
 		self.directory = directory
-		self.layoutChanged.emit()
+		self.endResetModel()
+
+	# --- Private methods
+
+	def _emit_rows_changed(self, rows: list[int], roles: list[Qt.ItemDataRole]):
+		"""Emits one ``dataChanged`` per contiguous run of sorted ``rows``."""
+		start = 0
+		while start < len(rows):
+			end = start
+			while end + 1 < len(rows) and rows[end + 1] == rows[end] + 1:
+				end += 1
+			self.dataChanged.emit(self.index(rows[start]), self.index(rows[end]), roles)
+			start = end + 1
+
+	def _image_rows(self) -> dict[Image, int]:
+		if self._rows is None:
+			self._rows = {image: row for row, image in enumerate(self.directory.images)}
+		return self._rows
+
+	def _reset_save(self):
+		self._save_total = 0
+		self._save_done = 0
+		self._save_count = 0
+		self._save_errors = []
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+from array import array
+from collections import Counter
+from pathlib import Path
+
+from PyQt6.QtCore import QObject, QRunnable, QStandardPaths, QThreadPool, QTimer, pyqtSlot
+
+from models.image import Image
+from models.tag_vocabulary import TagVocabulary
+from settings.config import APP_NAME
+
+
+class EditJournal(QObject):
+	"""Append-only log of the tag edits made in one directory since it was last
+	saved, so they survive a crash without rewriting any sidecars.
+
+	Mutators of ``Image`` record each insertion, removal and reorder into a
+	buffer, which is appended to a JSON-lines file on a single background
+	thread shortly after editing stops. Saving compacts the log: edits that reached the sidecars are
+	dropped and images that are still modified are kept as one snapshot each.
+
+	Records are ``{"op": "insert" | "remove", "image": name, "index": i, "tag": text}``
+	or ``{"op": "set", "image": name, "tags": [text, ...]}``.
+	"""
+	flush_delay = 1000 # ms after the last edit
+
+	def __init__(self, directory: Path, path: Path | None = None):
+		super().__init__()
+		self.directory = Path(directory)
+		self.path = path or EditJournal.default_path(self.directory)
+		# (op, image, index, tag ID or IDs), or ("replace", images, positions, (sources, targets))
+		# for a bulk replacement, not yet handed to the writer
+		self._buffer: list[tuple] = []
+		self._has_records = self.path.exists()
+
+		self._writer = QThreadPool() # one thread keeps appends and rewrites in order
+		self._writer.setMaxThreadCount(1)
+
+		self._flush_timer = QTimer()
+		self._flush_timer.setSingleShot(True)
+		self._flush_timer.setInterval(EditJournal.flush_delay)
+		self._flush_timer.timeout.connect(self.flush)
+
+	@staticmethod
+	def default_path(directory: Path) -> Path:
+		"""Returns where the journal of ``directory`` is kept."""
+		data_dir = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.GenericDataLocation)
+		key = hashlib.sha1(os.fsencode(os.path.abspath(directory))).hexdigest()[:16]
+		return Path(data_dir) / APP_NAME / "journals" / f"{key}.jsonl"
+
+	def close(self):
+		"""Writes out everything recorded and waits for the writer."""
+		self.flush()
+		self._writer.waitForDone()
+
+	def compact(self, modified: list[tuple[str, array]]):
+		"""Replaces the journal with one snapshot per image that is still modified,
+		after everything else was saved.
+		:param modified: Image names with copies of their tag IDs.
+		"""
+		self._flush_timer.stop()
+		self._buffer = []
+		self._has_records = bool(modified)
+		self._writer.start(_CompactTask(self.path, self.directory, modified))
+
+	def discard(self):
+		"""Forgets every recorded edit, e.g. when recovery was declined."""
+		self.compact([])
+
+	def flush(self):
+		self._flush_timer.stop()
+		if not self._buffer:
+			return
+		records, self._buffer = self._buffer, []
+		self._writer.start(_AppendTask(self.path, self.directory, records, not self._has_records))
+		self._has_records = True
+
+	def has_records(self) -> bool:
+		return self._has_records or bool(self._buffer)
+
+	def read(self) -> list[dict]:
+		"""Returns the recorded edits in order. A record cut short by a crash ends the list."""
+		self._writer.waitForDone()
+		records = []
+		try:
+			with open(self.path, encoding="utf-8") as file:
+				for line in file:
+					try:
+						record = json.loads(line)
+					except json.JSONDecodeError:
+						break
+					if "op" in record:
+						records.append(record)
+		except FileNotFoundError:
+			pass
+		except (OSError, UnicodeDecodeError) as exception:
+			print(f"Error reading edit journal: {str(exception)}")
+		return records
+
+	@staticmethod
+	def replay(records: list[dict], images: dict[str, Image]) -> list[tuple[Image, Counter[int], Counter[int]]]:
+		"""Applies ``records`` to the named ``images``. Removals whose tag is no
+		longer at the recorded index fall back to its first occurrence, and
+		records for missing images or tags are skipped.
+		:returns: ``(image, old_tags, new_tags)`` per changed image, for ``TagIndexModel.apply_tag_changes``.
+		"""
+		old_tags: dict[Image, Counter[int]] = {}
+		for record in records:
+			image = images.get(record.get("image"))
+			if image is None:
+				continue
+			if image not in old_tags:
+				old_tags[image] = Counter(image.tag_counts)
+
+			try:
+				match record["op"]:
+					case "set":
+						image.restore_tags(TagVocabulary.intern_many(record["tags"]))
+					case "insert":
+						image.insert_tag(record["tag"], min(max(int(record["index"]), 0), image.tag_count()))
+					case "remove":
+						tag_id = TagVocabulary.get(record["tag"])
+						tag_ids = image.tag_ids
+						index = int(record["index"])
+						if not (0 <= index < len(tag_ids) and tag_ids[index] == tag_id):
+							if tag_id is None or tag_id not in tag_ids:
+								continue
+							index = tag_ids.index(tag_id)
+						image.remove_tag_at(index)
+			except (KeyError, TypeError, ValueError):
+				continue # malformed record
+
+		return [(image, tags, Counter(image.tag_counts)) for image, tags in old_tags.items()]
+
+	def record(self, op: str, image: Image, index: int, tag_id: int | array):
+		"""Buffers one edit, called by the ``Image`` mutators.
+		:param tag_id: The tag inserted or removed, or the whole list for ``"set"``.
+		"""
+		self._buffer.append((op, image, index, tag_id))
+		if not self._flush_timer.isActive():
+			self._flush_timer.start()
+
+	def record_replacements(self, images: list[Image], positions: array, sources: array, targets: array):
+		"""Buffers the tags replaced in place by ``Image.replace_tags_at`` as one
+		entry, written out as a removal and an insertion per image."""
+		if not images:
+			return
+		self._buffer.append(("replace", images, positions, (sources, targets)))
+		if not self._flush_timer.isActive():
+			self._flush_timer.start()
+
+class _AppendTask(QRunnable):
+	def __init__(self, path: Path, directory: Path, records: list[tuple], new_file: bool):
+		super().__init__()
+		self.path = path
+		self.directory = directory
+		self.records = records
+		self.new_file = new_file
+		self._tags: dict[int, str] = {} # JSON of each tag written, bulk edits write many records for a few tags
+
+	@pyqtSlot()
+	def run(self):
+		lines = []
+		if self.new_file:
+			lines.append(json.dumps({"directory": str(self.directory)}) + "\n")
+		for op, image, index, tag in self.records:
+			if op == "set":
+				lines.append(json.dumps({"op": op, "image": image.path.name, "tags": TagVocabulary.strings(tag)}) + "\n")
+			elif op == "replace":
+				tag_json = self._tag_json
+				for replaced, position, source, target in zip(image, index, *tag):
+					name = json.dumps(replaced.path.name)
+					lines.append(
+						f'{{"op": "remove", "image": {name}, "index": {position}, "tag": {tag_json(source)}}}\n'
+						f'{{"op": "insert", "image": {name}, "index": {position}, "tag": {tag_json(target)}}}\n'
+					)
+			else:
+				lines.append(self._line(op, image, index, tag))
+		try:
+			self.path.parent.mkdir(parents=True, exist_ok=True)
+			with open(self.path, "a", encoding="utf-8") as file:
+				file.writelines(lines)
+				file.flush()
+				os.fsync(file.fileno())
+		except OSError as exception:
+			print(f"Error writing edit journal: {str(exception)}")
+
+	def _line(self, op: str, image: Image, index: int, tag_id: int) -> str:
+		"""Formats an insertion or removal as ``json.dumps`` would."""
+		return f'{{"op": "{op}", "image": {json.dumps(image.path.name)}, "index": {index}, "tag": {self._tag_json(tag_id)}}}\n'
+
+	def _tag_json(self, tag_id: int) -> str:
+		tag = self._tags.get(tag_id)
+		if tag is None:
+			tag = self._tags[tag_id] = json.dumps(TagVocabulary.string(tag_id))
+		return tag
+
+class _CompactTask(QRunnable):
+	def __init__(self, path: Path, directory: Path, modified: list[tuple[str, array]]):
+		super().__init__()
+		self.path = path
+		self.directory = directory
+		self.modified = modified
+
+	@pyqtSlot()
+	def run(self):
+		try:
+			if not self.modified:
+				self.path.unlink(missing_ok=True)
+				return
+
+			temp_path = self.path.with_name(self.path.name + ".tmp")
+			with open(temp_path, "w", encoding="utf-8") as file:
+				file.write(json.dumps({"directory": str(self.directory)}) + "\n")
+				for name, tag_ids in self.modified:
+					file.write(json.dumps({"op": "set", "image": name, "tags": TagVocabulary.strings(tag_ids)}) + "\n")
+				file.flush()
+				os.fsync(file.fileno())
+			os.replace(temp_path, self.path)
+		except OSError as exception:
+			print(f"Error compacting edit journal: {str(exception)}")
@@ -1,12 +1,22 @@
-import csv
 import time
+from array import array
+from collections import Counter
 from pathlib import Path
 
 from PyQt6.QtCore import QSize
 from PyQt6.QtGui import QIcon, QImage, QPixmap
 
+from models.tag_vocabulary import TagVocabulary
+from settings.config import Config, Setting
+from util.lru_cache import ByteLRUCache
+from util.sidecar_writer import format_tags, write_sidecars
+
 
 class TagEntry:
+	"""Lightweight view of one tag of an image. Images store tags as IDs; these
+	are only built on request."""
+	__slots__ = ("text", "position", "modified")
+
 	def __init__(self, text: str = "", position: int = 0, modified: bool = False):
 		self.text = text
 		self.position = position
@@ -17,75 +27,277 @@ class TagEntry:
 
 
 class Image:
+	"""An image and its tags.
+
+	Tags are kept as a compact array of ``TagVocabulary`` IDs, with per-tag
+	modified flags packed into the bits of a single integer.
+	"""
+	__slots__ = (
+		"path",
+		"thumb_size",
+		"size",
+		"sidecar_conflict",
+		"_tag_ids",
+		"_tag_counts",
+		"_modified_mask",
+		"_modified",
+		"_mtime",
+	)
+
+	# Thumbnails and previews live in one shared byte-budgeted cache rather than
+	# on the instances, so memory stays flat however many images are scrolled past.
+	pixmap_cache = ByteLRUCache(Config.read(Setting.ImageCacheSize) * 1024 * 1024)
+	journal: "EditJournal | None" = None # records tag edits of the open directory
+	tags_revision = 0 # counts changes to any image's tags, so work planned from older tags can be spotted
+	_PREVIEW = 0
+	_THUMBNAIL = 1
+
 	def __init__(self, path: Path):
 		self.path = path
-		self._thumbnail: QIcon | QImage | None = None
-		self._preview: QIcon | QImage | None = None
 		self.thumb_size: int = 0
 		self.size: QSize | None = None
-		self._tag_entries: list[TagEntry] | None = None # don't hold external references to _tag_entries
+		self.sidecar_conflict: bool = False # sidecar changed on disk while this had unsaved edits
+		self._tag_ids: array | None = None # don't hold external references to _tag_ids
+		self._tag_counts: Counter[int] | None = None # occurrences per tag ID, built on first use
+		self._modified_mask: int = 0 # bit i set if the tag at position i was modified
 		self._modified: bool = False
 		self._mtime: float = time.monotonic()
-		self.test: TagEntry
 
 	def __lt__(self, other):
 		return self.path < other.path
 
 	def append_tag(self, tag: str):
-		self.insert_tag(tag, len(self._tag_entries))
+		self.insert_tag(tag, len(self.load_tags()))
 
 	def insert_tag(self, tag: str, index: int):
-		self._tag_entries.insert(index, TagEntry(tag, index, True))
+		self.insert_tag_id(TagVocabulary.intern(tag), index)
+
+	def insert_tag_id(self, tag_id: int, index: int):
+		tag_ids = self.load_tags()
+		tag_ids.insert(index, tag_id)
+		Image.tags_revision += 1
+		if self._tag_counts is not None:
+			self._tag_counts[tag_id] += 1
+		mask = self._modified_mask
+		low = mask & ((1 << index) - 1)
+		self._modified_mask = low | ((mask >> index) << (index + 1)) | (1 << index)
 		self.set_modified()
+		if Image.journal is not None:
+			Image.journal.record("insert", self, index, tag_id)
+
+	def has_tag(self, tag_id: int) -> bool:
+		return tag_id in self.tag_counts
 
 	def is_modified(self) -> bool:
 		return self._modified
 
-	def load_tags(self) -> list[TagEntry]:
-		if self._tag_entries is not None:
-			return self._tag_entries
+	def is_tag_modified(self, index: int) -> bool:
+		return bool(self._modified_mask >> index & 1)
+
+	def load_tags(self) -> array:
+		if self._tag_ids is not None:
+			return self._tag_ids
+
+		self._tag_ids = Image.parse_tags(self.path)
+		Image.tags_revision += 1
 
-		tag_path = self.path.with_suffix(".txt")
-		if tag_path.exists():
+		return self._tag_ids
+
+	@staticmethod
+	def parse_tags(path: Path) -> array:
+		"""Reads the sidecar of the image at ``path``. Safe to call from worker threads."""
+		tag_path = path.with_suffix(".txt")
+		try:
 			with tag_path.open(newline="") as file:
-				self._tag_entries = [
-					TagEntry(tag.strip(), index)
-					for index, tag
-					in enumerate(file.read().split(","))
-				]
-		else:
-			self._tag_entries = []
+				return Image.parse_tag_text(file.read())
+		except FileNotFoundError:
+			return array("I")
 
-		return self._tag_entries
+	@staticmethod
+	def parse_tag_text(text: str) -> array:
+		return TagVocabulary.intern_many([tag.strip() for tag in text.split(",")])
 
 	def remove_tag(self, tag: str):
 		""" Removes **all** instances of ``tag``.
 		"""
-		# Create new list without removed tag
-		self._tag_entries: list[TagEntry] = [s for s in self._tag_entries if s.text != tag]
+		tag_id = TagVocabulary.get(tag)
+		tag_ids = self.load_tags()
+		if tag_id is None or tag_id not in tag_ids:
+			return
+
+		# Create new array and mask without removed tag
+		mask = self._modified_mask
+		kept = array("I")
+		kept_mask = 0
+		removed = []
+		for index, existing in enumerate(tag_ids):
+			if existing != tag_id:
+				if mask >> index & 1:
+					kept_mask |= 1 << len(kept)
+				kept.append(existing)
+			else:
+				removed.append(index)
+		self._tag_ids = kept
+		self._modified_mask = kept_mask
+		Image.tags_revision += 1
+		if self._tag_counts is not None:
+			del self._tag_counts[tag_id]
 		self.set_modified()
+		if Image.journal is not None:
+			for index in reversed(removed): # replayable one at a time
+				Image.journal.record("remove", self, index, tag_id)
 
 	def remove_tag_at(self, index: int) -> str:
 		"""Removes tag at ``index``
 		:param index: Index of tag to remove.
 		:returns: The tag that was removed.
 		"""
-		tag_entry: TagEntry = self._tag_entries[index]
-		del self._tag_entries[index]
+		tag_ids = self.load_tags()
+		tag_id = tag_ids.pop(index)
+		Image.tags_revision += 1
+		if self._tag_counts is not None:
+			self._tag_counts[tag_id] -= 1
+			if not self._tag_counts[tag_id]:
+				del self._tag_counts[tag_id]
+		mask = self._modified_mask
+		self._modified_mask = (mask & ((1 << index) - 1)) | ((mask >> (index + 1)) << index)
+		self.set_modified()
+		if Image.journal is not None:
+			Image.journal.record("remove", self, index, tag_id)
+		return TagVocabulary.string(tag_id)
+
+	def restore_tags(self, tag_ids: array):
+		"""Replaces tags with recovered unsaved ones, marking the tags that aren't
+		in the current list as modified."""
+		previous = self.tag_counts
+		self._tag_ids = tag_ids
+		self._tag_counts = None
+		Image.tags_revision += 1
+		self._modified_mask = 0
+		for index, tag_id in enumerate(tag_ids):
+			if tag_id not in previous:
+				self._modified_mask |= 1 << index
+		self.set_modified()
+
+	def permute_tags(self, order: list[int] | array):
+		"""Reorders tags so that the tag at ``i`` is the one previously at
+		``order[i]``. Tags that moved are marked modified."""
+		tag_ids = self.load_tags()
+		mask = self._modified_mask
+		new_mask = 0
+		for index, previous in enumerate(order):
+			if index != previous or mask >> previous & 1:
+				new_mask |= 1 << index
+		self._tag_ids = array("I", [tag_ids[previous] for previous in order])
+		self._modified_mask = new_mask
+		Image.tags_revision += 1
+		self.set_modified()
+		if Image.journal is not None:
+			Image.journal.record("set", self, 0, array("I", self._tag_ids))
+
+	def replace_tag_at(self, index: int, tag_id: int) -> int:
+		"""Replaces the tag at ``index`` with ``tag_id`` in place.
+		:returns: The ID of the tag that was replaced.
+		"""
+		tag_ids = self.load_tags()
+		previous = tag_ids[index]
+		tag_ids[index] = tag_id
+		Image.tags_revision += 1
+		if self._tag_counts is not None:
+			self._tag_counts[previous] -= 1
+			if not self._tag_counts[previous]:
+				del self._tag_counts[previous]
+			self._tag_counts[tag_id] += 1
+		self._modified_mask |= 1 << index
 		self.set_modified()
-		return tag_entry.text
-
-	def save_tags(self):
-		tag_path = self.path.with_suffix(".txt")
-		with open(tag_path, "w", newline="") as file:
-			writer = csv.writer(file)
-			writer.writerow(self.tags)
-		""" TODO mark all saved objects as unmodified
-		could just lean on the load routines, but
-		- might be a bit riskier than setting items unmodified again? could break out those functions.
-		vs
-		- less likely to introduce future bugs
+		if Image.journal is not None:
+			Image.journal.record("remove", self, index, previous)
+			Image.journal.record("insert", self, index, tag_id)
+		return previous
+
+	@staticmethod
+	def replace_tags_at(images: list["Image"], positions: array, sources: array, targets: array):
+		"""Replaces ``sources[i]`` at ``positions[i]`` in ``images[i]`` with
+		``targets[i]``, like ``replace_tag_at`` on each image but in one pass, for
+		bulk edits. A source that moved since is replaced where it first occurs
+		now, and one that is gone is skipped."""
+		now = time.monotonic()
+		replaced = []
+		replaced_positions, replaced_sources, replaced_targets = array("I"), array("I"), array("I")
+		for image, position, source, target in zip(images, positions, sources, targets):
+			tag_ids = image.load_tags()
+			if position >= len(tag_ids) or tag_ids[position] != source:
+				if source not in tag_ids:
+					continue
+				position = tag_ids.index(source)
+			tag_ids[position] = target
+			counts = image._tag_counts
+			if counts is not None:
+				counts[source] -= 1
+				if not counts[source]:
+					del counts[source]
+				counts[target] += 1
+			image._modified_mask |= 1 << position
+			image._modified = True
+			image._mtime = now
+			replaced.append(image)
+			replaced_positions.append(position)
+			replaced_sources.append(source)
+			replaced_targets.append(target)
+
+		Image.tags_revision += 1
+		if Image.journal is not None:
+			Image.journal.record_replacements(replaced, replaced_positions, replaced_sources, replaced_targets)
+
+	def replace_tags(self, tag_ids: array):
+		"""Replaces tags with ones reloaded from disk, leaving the image unmodified."""
+		self._tag_ids = tag_ids
+		self._tag_counts = None
+		Image.tags_revision += 1
+		self._modified_mask = 0
+		self.sidecar_conflict = False
+		self.set_modified(False)
+
+	def save_tags(self) -> bool:
+		"""Writes the sidecar on the calling thread. ``DirectoryImageModel.save``
+		does this for many images in the background instead."""
+		tag_ids = array("I", self.load_tags())
+		path = self.path.with_suffix(".txt")
+		written, failed = write_sidecars([(path, format_tags(TagVocabulary.strings(tag_ids)))])
+		if path in failed:
+			print(f"Error saving tags for {self.path.name}: {failed[path]}")
+			return False
+		self.mark_saved(tag_ids)
+		return True
+
+	def mark_saved(self, tag_ids: array):
+		"""Clears the modified state after ``tag_ids`` were written, unless the
+		tags were edited again since."""
+		if self.load_tags() != tag_ids:
+			return
+		self._modified_mask = 0
+		self.sidecar_conflict = False
+		self.set_modified(False)
+
+	def tag_count(self) -> int:
+		return len(self.load_tags())
+
+	def tag_text(self, index: int) -> str:
+		return TagVocabulary.string(self.load_tags()[index])
+
+	def is_tags_loaded(self) -> bool:
+		return self._tag_ids is not None
+
+	def set_loaded_tags(self, tag_ids: array) -> bool:
+		"""Installs tags parsed in the background, unless they were already loaded
+		lazily in the meantime.
+		:returns: True if ``tag_ids`` was used.
 		"""
+		if self._tag_ids is not None:
+			return False
+		self._tag_ids = tag_ids
+		Image.tags_revision += 1
+		return True
 
 	def set_modified(self, is_modified: bool = True):
 		"""Marks object as modified and records the time for sorting."""
@@ -94,24 +306,62 @@ class Image:
 
 	@property
 	def preview(self) -> QIcon | None:
-		if type(self._preview) == QImage:
-			self._preview = QIcon(QPixmap.fromImage(self._preview))
-		return self._preview
+		"""Un-cropped scaled image, or None if not loaded yet or evicted."""
+		return self._cached_icon(Image._PREVIEW)
 
 	@preview.setter
 	def preview(self, value: QIcon | QImage | None):
-		self._preview = value
+		self._cache_put(Image._PREVIEW, value)
+
+	@property
+	def tag_counts(self) -> Counter[int]:
+		"""Occurrences of each tag ID, kept up to date by the tag mutators.
+		Copy it before holding on to it."""
+		if self._tag_counts is None:
+			self._tag_counts = Counter(self.load_tags())
+		return self._tag_counts
 
 	@property
-	def tags(self):
+	def tag_ids(self) -> array:
 		return self.load_tags()
 
+	@property
+	def tags(self) -> list[TagEntry]:
+		"""Builds entry views of all tags. Prefer ``tag_ids`` in hot paths."""
+		mask = self._modified_mask
+		return [
+			TagEntry(TagVocabulary.string(tag_id), index, bool(mask >> index & 1))
+			for index, tag_id
+			in enumerate(self.load_tags())
+		]
+
 	@property
 	def thumbnail(self) -> QIcon | None:
-		if type(self._thumbnail) == QImage:
-			self._thumbnail = QIcon(QPixmap.fromImage(self._thumbnail))
-		return self._thumbnail
+		"""Square thumbnail, or None if not loaded yet or evicted."""
+		return self._cached_icon(Image._THUMBNAIL)
 
 	@thumbnail.setter
 	def thumbnail(self, value: QIcon | QImage | None):
-		self._thumbnail = value
\ No newline at end of file
+		self._cache_put(Image._THUMBNAIL, value)
+
+	# --- Private methods
+
+	def _cache_put(self, role: int, value: QIcon | QImage | None):
+		"""Must be called from the GUI thread, since eviction may destroy pixmaps."""
+		key = (self, role)
+		if value is None:
+			Image.pixmap_cache.pop(key)
+		elif isinstance(value, QImage):
+			Image.pixmap_cache.put(key, value, value.sizeInBytes())
+		else:
+			size = max((s.width() * s.height() * 4 for s in value.availableSizes()), default=0)
+			Image.pixmap_cache.put(key, value, size)
+
+	def _cached_icon(self, role: int) -> QIcon | None:
+		key = (self, role)
+		value = Image.pixmap_cache.get(key)
+		if type(value) == QImage:
+			size = value.sizeInBytes()
+			value = QIcon(QPixmap.fromImage(value))
+			Image.pixmap_cache.put(key, value, size)
+		return value
\ No newline at end of file
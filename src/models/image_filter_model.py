@@ -0,0 +1,207 @@
+from bisect import bisect_left
+
+from PyQt6.QtCore import QAbstractListModel, QModelIndex, Qt
+
+from models.directory_image_model import DirectoryImageModel
+from models.image import Image
+from models.tag_index_model import TagIndexModel
+from models.tag_query import TagQuery
+
+
+class ImageFilterModel(QAbstractListModel):
+	"""The rows of a ``DirectoryImageModel`` whose images match a ``TagQuery``,
+	in directory order. Without a query every row is passed through as is.
+
+	A new query is evaluated against the tag index as bitmap operations, and
+	the matches are kept as a list of images. After that, images the tag index
+	reports as changed are tested one at a time and moved in or out of the
+	list. Images only take part once their tags are indexed.
+
+	The pinned image, the one being edited, stays listed while its edits stop
+	it matching, so the selection doesn't jump away mid-edit. It is tested
+	again once another image is pinned.
+	"""
+	# Updates moving more images than this reset the model instead of
+	# inserting and removing rows one at a time
+	reset_threshold = 64
+
+	def __init__(self, source: DirectoryImageModel, tag_index_model: TagIndexModel):
+		super().__init__()
+		self.source = source
+		self.tag_index_model = tag_index_model
+		self.query: TagQuery | None = None
+		self.pinned: Image | None = None
+		self._images: list[Image] = [] # matching images, while filtered
+		self._rows: dict[Image, int] | None = None # image -> row in _images, rebuilt lazily after rows move
+
+		source.rowsAboutToBeInserted.connect(self.on_source_rows_about_to_be_inserted)
+		source.rowsInserted.connect(self.on_source_rows_inserted)
+		source.rowsAboutToBeRemoved.connect(self.on_source_rows_about_to_be_removed)
+		source.rowsRemoved.connect(self.on_source_rows_removed)
+		source.modelAboutToBeReset.connect(self.beginResetModel)
+		source.modelReset.connect(self.on_source_reset)
+		source.dataChanged.connect(self.on_source_data_changed)
+		tag_index_model.images_changed.connect(self.on_images_changed)
+
+	def data(self, index: QModelIndex = QModelIndex(), role: int = Qt.ItemDataRole.DisplayRole):
+		if self.query is None:
+			return self.source.data(self.source.index(index.row()), role)
+
+		image = self._images[index.row()]
+		if role == Qt.ItemDataRole.UserRole:
+			return image
+		return self.source.data(self.source.index(self.source.row_of(image)), role)
+
+	def rowCount(self, parent: QModelIndex = QModelIndex()):
+		return self.source.rowCount() if self.query is None else len(self._images)
+
+	def image_at(self, row: int) -> Image | None:
+		if not 0 <= row < self.rowCount():
+			return None
+		return self.source.directory.images[row] if self.query is None else self._images[row]
+
+	def is_filtered(self) -> bool:
+		return self.query is not None
+
+	def on_images_changed(self, images: list[Image]):
+		"""Moves ``images`` in or out of the matches after their tags changed.
+		Images not indexed yet are skipped, testing them would read their tags
+		here rather than in the background; they are reported again once indexed."""
+		if self.query is None:
+			return
+
+		rows = self._row_map()
+		matches = self.query.matches
+		is_indexed = self.tag_index_model.is_indexed
+		added = []
+		removed = []
+		for image in images:
+			matched = image in rows
+			if matched and image is self.pinned or not is_indexed(image):
+				continue
+			if matches(image) and self.source.row_of(image) is not None:
+				if not matched:
+					added.append(image)
+			elif matched:
+				removed.append(image)
+		if not added and not removed:
+			return
+
+		if len(added) + len(removed) > ImageFilterModel.reset_threshold:
+			self.beginResetModel()
+			kept = set(self._images).difference(removed)
+			kept.update(added)
+			self._images = [image for image in self.source.directory.images if image in kept]
+			self._rows = None
+			self.endResetModel()
+			return
+
+		self._remove_rows(sorted(rows[image] for image in removed))
+		for image in sorted(added):
+			row = bisect_left(self._images, image)
+			self.beginInsertRows(QModelIndex(), row, row)
+			self._images.insert(row, image)
+			self._rows = None
+			self.endInsertRows()
+
+	def on_source_data_changed(self, top_left: QModelIndex, bottom_right: QModelIndex, roles: list[int] = ()):
+		if self.query is None:
+			self.dataChanged.emit(self.index(top_left.row()), self.index(bottom_right.row()), roles)
+			return
+
+		rows = self._row_map()
+		images = self.source.directory.images[top_left.row():bottom_right.row() + 1]
+		self._emit_rows_changed(sorted(rows[image] for image in images if image in rows), roles)
+
+	def on_source_reset(self):
+		self._evaluate()
+		self.endResetModel()
+
+	def on_source_rows_about_to_be_inserted(self, parent: QModelIndex, first: int, last: int):
+		if self.query is None:
+			self.beginInsertRows(QModelIndex(), first, last)
+
+	def on_source_rows_inserted(self, parent: QModelIndex, first: int, last: int):
+		if self.query is None:
+			self.endInsertRows()
+		else:
+			self.on_images_changed(self.source.directory.images[first:last + 1])
+
+	def on_source_rows_about_to_be_removed(self, parent: QModelIndex, first: int, last: int):
+		if self.query is None:
+			self.beginRemoveRows(QModelIndex(), first, last)
+			return
+
+		rows = self._row_map()
+		images = self.source.directory.images[first:last + 1]
+		self._remove_rows(sorted(rows[image] for image in images if image in rows))
+
+	def on_source_rows_removed(self, parent: QModelIndex, first: int, last: int):
+		if self.query is None:
+			self.endRemoveRows()
+
+	def row_of(self, image: Image) -> int | None:
+		if self.query is None:
+			return self.source.row_of(image)
+		return self._row_map().get(image)
+
+	def set_pinned(self, image: Image | None):
+		previous, self.pinned = self.pinned, image
+		if previous is not None and previous is not image:
+			self.on_images_changed([previous])
+
+	def set_query(self, query: TagQuery | None):
+		"""Shows only the images matching ``query``, or all of them for None."""
+		self.beginResetModel()
+		self.query = query
+		self._evaluate()
+		self.endResetModel()
+
+	def set_visible_rows(self, first: int, last: int):
+		"""Tells the source which images are on screen."""
+		if self.source.directory is None:
+			return
+		images = self.source.directory.images if self.query is None else self._images
+		self.source.set_visible_images(images[max(first, 0):last + 1])
+
+	# --- Private methods
+
+	def _emit_rows_changed(self, rows: list[int], roles: list[int]):
+		"""Emits one ``dataChanged`` per contiguous run of sorted ``rows``."""
+		start = 0
+		while start < len(rows):
+			end = start
+			while end + 1 < len(rows) and rows[end + 1] == rows[end] + 1:
+				end += 1
+			self.dataChanged.emit(self.index(rows[start]), self.index(rows[end]), roles)
+			start = end + 1
+
+	def _evaluate(self):
+		"""Finds every match from the tag index, in directory order."""
+		self._rows = None
+		directory = self.source.directory
+		if self.query is None or directory is None:
+			self._images = []
+			return
+
+		matches = set(self.tag_index_model.images_of(self.query.evaluate(self.tag_index_model)))
+		self._images = [image for image in directory.images if image in matches]
+
+	def _remove_rows(self, rows: list[int]):
+		"""Removes sorted ``rows``, one ``beginRemoveRows`` per contiguous run."""
+		end = len(rows) - 1
+		while end >= 0:
+			start = end
+			while start > 0 and rows[start - 1] == rows[start] - 1:
+				start -= 1
+			first, last = rows[start], rows[end]
+			self.beginRemoveRows(QModelIndex(), first, last)
+			del self._images[first:last + 1]
+			self._rows = None
+			self.endRemoveRows()
+			end = start - 1
+
+	def _row_map(self) -> dict[Image, int]:
+		if self._rows is None:
+			self._rows = {image: row for row, image in enumerate(self._images)}
+		return self._rows
@@ -1,14 +1,14 @@
 from collections import Counter
 
-from PyQt6.QtCore import QAbstractListModel, Qt, QModelIndex, pyqtSignal
+from PyQt6.QtCore import QAbstractListModel, Qt, QModelIndex
 from PyQt6.QtGui import QBrush, QColor
 
 from settings.config import Config, Setting
 from models.image import Image
+from models.tag_history import TagDelta, TagHistory
+from models.tag_vocabulary import TagVocabulary
 
 class ImageTagModel(QAbstractListModel):
-	image_tags_modified = pyqtSignal(Image, Counter, Counter)
-
 	# name data loader set_data_source
 
 	def __init__(self, image: Image | None = None):
@@ -16,6 +16,8 @@ class ImageTagModel(QAbstractListModel):
 		self.image = image
 		self.changed_background = QBrush(QColor(128, 0, 0, 50))
 		self.changed_color = QColor(Config.read(Setting.ModifiedColor))
+		self.history = TagHistory.instance()
+		self._editing = False # rows are being signalled by our own edit
 
 	def append_tag(self, tag: str):
 		"""Adds ``tag`` to end of the list."""
@@ -28,50 +30,50 @@ class ImageTagModel(QAbstractListModel):
 
 	def insert_tag(self, tag: str, index: int | None = None):
 		if index is None:
-			index = len(self.image.tags)
-		old_tags = Counter(list(map(str, self.image.tags))) # TODO cache a list in the Image class
+			index = self.image.tag_count()
 		self.beginInsertRows(QModelIndex(), index, index)
-		self.image.insert_tag(tag, index)
+		self._editing = True
+		try:
+			self.history.push(f"Add \"{tag}\"", [TagDelta(True, [(self.image, index, TagVocabulary.intern(tag))])])
+		finally:
+			self._editing = False
 		self.endInsertRows()
-		new_tags = Counter(list(map(str, self.image.tags))) # TODO cache a list in the Image class
-		self.image_tags_modified.emit(self.image, old_tags, new_tags)
+
+	def on_tags_changed(self, images: list[Image]):
+		"""Rebuilds the list when an undo, redo or bulk edit changed the image."""
+		if self._editing or self.image is None:
+			return
+		if self.image in images:
+			self.beginResetModel()
+			self.endResetModel()
 
 	def remove_tag(self, tag: str):
 		""" Removes **all** instances of ``tag``.
 		"""
-		# Rebuilds whole layout, but simpler than calculating
-		self.layoutAboutToBeChanged.emit()
-		self.image.remove_tag(tag)
-		self.layoutChanged.emit()
-		self.tagsModified.emit(self.image)
-		# # doesn't require rebuilding the whole layout
-		# indices = sorted(i for i, s in enumerate(self.tag_image.tags) if s == tag)
-		# spans = []
-		# start = prev = None
-		# for i in indices:
-		# 	if start is None:
-		# 		start = prev = i
-		# 	elif i == prev + 1:
-		# 		prev = i
-		# 	else:
-		# 		spans.append((start, prev))
-		# 		start = prev = i
-		# if start is not None:
-		# 	spans.append((start, prev))
-		#
-		# for start, end in reversed(spans):  # remove from end to preserve earlier indices
-		# 	self.beginRemoveRows(QModelIndex(), start, end)
-		# 	del self.tag_image.tags[start:end + 1]
-		# 	self.tag_image.modified = True
-		# 	self.endRemoveRows()
+		tag_id = TagVocabulary.get(tag)
+		if tag_id is None or not self.image.has_tag(tag_id):
+			return
+		positions = [index for index, existing in enumerate(self.image.tag_ids) if existing == tag_id]
+		# Rebuilds whole layout through on_tags_changed, but simpler than calculating
+		self.history.push(f"Remove \"{tag}\"", [TagDelta(False, [(self.image, index, tag_id) for index in positions])])
+
+	def refresh_modified(self):
+		"""Repaints the per-tag modified colors, e.g. after the image was saved."""
+		if self.image is not None and self.image.tag_count():
+			self.dataChanged.emit(self.index(0), self.index(self.image.tag_count() - 1), [Qt.ItemDataRole.ForegroundRole])
 
 	def remove_tag_at(self, index: int):
-		old_tags = Counter(list(map(str, self.image.tags))) # TODO cache a list in the Image class
+		tag_id = self.image.tag_ids[index]
 		self.beginRemoveRows(QModelIndex(), index, index)
-		self.image.remove_tag_at(index)
+		self._editing = True
+		try:
+			self.history.push(
+				f"Remove \"{TagVocabulary.string(tag_id)}\"",
+				[TagDelta(False, [(self.image, index, tag_id)])]
+			)
+		finally:
+			self._editing = False
 		self.endRemoveRows()
-		new_tags = Counter(list(map(str, self.image.tags))) # TODO cache a list in the Image class
-		self.image_tags_modified.emit(self.image, old_tags, new_tags)
 
 	def set_image(self, image: Image):
 		self.beginResetModel()
@@ -85,7 +87,7 @@ class ImageTagModel(QAbstractListModel):
 		if self.image is None:
 			return None
 
-		tag = self.image.tags[index.row()]
+		row = index.row()
 
 		q = Qt.ItemDataRole
 		match role:
@@ -94,11 +96,11 @@ class ImageTagModel(QAbstractListModel):
 			# case Qt.ItemDataRole.DecorationRole:
 			# 	return tag_image.thumbnail
 			case q.DisplayRole:
-				return tag.text
+				return self.image.tag_text(row)
 			case q.EditRole:
-				return tag.text
+				return self.image.tag_text(row)
 			case q.ForegroundRole:
-				return self.changed_color if tag.modified else None
+				return self.changed_color if self.image.is_tag_modified(row) else None
 			case _:
 				return None
 
@@ -114,7 +116,7 @@ class ImageTagModel(QAbstractListModel):
 		if self.image is None:
 			return 0
 		else:
-			return len(self.image.tags)
+			return self.image.tag_count()
 
 	def setData(self, index, value, role=...):
 		return super().setData(index, value, role)
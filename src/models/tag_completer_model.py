@@ -1,73 +1,94 @@
-import os.path
-import sqlite3
-import sys
-from enum import StrEnum, auto, Enum, IntEnum
-from operator import itemgetter
+from enum import IntEnum
 from os import PathLike
-from sqlite3 import Connection
 
-from PyQt6.QtCore import QModelIndex, Qt, QAbstractTableModel
+from PyQt6.QtCore import QModelIndex, Qt, QAbstractTableModel, QThreadPool, pyqtSignal
+
+from gui.vocabulary_load_task import VocabularyLoader, VocabularyLoadTask
+from util.completion_index import CompletionIndex
+from util.tag_columns import TagColumns
+from util.tag_database import compute_stats
 
 
 class TagCompleterModel(QAbstractTableModel):
+	"""Every tag in the danbooru database with its post count.
+
+	Starts out empty and fills in once a background load finishes, so
+	constructing it never blocks. ``loaded`` is emitted at that point. Rows are
+	read straight from ``TagColumns``, and sorting only swaps which of its
+	precomputed orderings is used.
+	"""
+	loaded = pyqtSignal()
+
 	class Column(IntEnum):
 		NAME = 0
 		POST_COUNT = 1
 
 	def __init__(self, db_path: str | PathLike):
 		super().__init__()
-		self._data: list[tuple[str, str]] = []
+		self.columns: TagColumns | None = None
+		self._order: memoryview | None = None # row permutation, None for name order
+		self._reversed = False
 		self._db_path = db_path
-		self._connection: Connection | None = None
-		self._load_data()
+		self._stats: dict[str, int] = {}
+		self.completion_index = CompletionIndex()
+		self.is_loaded = False
+
+		self.loader = VocabularyLoader()
+		self.loader.vocabulary_loaded.connect(self.on_vocabulary_loaded)
+		QThreadPool.globalInstance().start(VocabularyLoadTask(db_path, self.loader))
 
 	def get_max_count_len(self):
-		value = max(data[1] for data in self._data)
-		return len(str(value))
+		return self._stat("max_count_len")
 
 	def get_top_percentile_tag_len(self, percentile: int):
-		tag_lengths = sorted(len(a) for a, _ in self._data)
-		k_index = int(percentile / 100 * (len(tag_lengths) - 1))
-		k = tag_lengths[k_index]
-		return k
+		return self._stat(f"name_length_p{percentile}", percentile)
+
+	def on_vocabulary_loaded(self, columns: TagColumns, stats: dict[str, int], index: CompletionIndex):
+		self.beginResetModel()
+		self.columns = columns
+		if self._order is not None:
+			self._order = columns.by_count
+		self._stats = stats
+		self.completion_index = index
+		self.is_loaded = True
+		self.endResetModel()
+		self.loaded.emit()
 
 	def sort(self, column: int, order: Qt.SortOrder = Qt.SortOrder.AscendingOrder):
 		"""Can pass TagCompleterModel.Column enum values for the column parameter."""
 		self.layoutAboutToBeChanged.emit()
 
-		option = True if order == Qt.SortOrder.DescendingOrder else False
-		self._data.sort(key=itemgetter(column), reverse=option)
+		descending = order == Qt.SortOrder.DescendingOrder
+		if column == TagCompleterModel.Column.POST_COUNT:
+			self._order = self.columns.by_count if self.columns else memoryview(b"").cast("I")
+			self._reversed = not descending # by_count runs from most to fewest posts
+		else:
+			self._order = None
+			self._reversed = descending
 
 		self.layoutChanged.emit()
 
-	def _connect_database(self):
-		if not os.path.exists(self._db_path):
-			print ("Error: database not found")
-			return False
-
-		try:
-			self._connection = sqlite3.connect(self._db_path)
-			self._connection.row_factory = sqlite3.Row
-			return True
-		except sqlite3.Error as exception:
-			print(f"Error connecting to database: {str(exception)}")
-			return False
-
-	def _load_data(self):
-		if not self._connect_database():
-			return
-
-		try:
-			cursor = self._connection.cursor()
+	# --- Private methods
 
-			cursor.execute("SELECT REPLACE(name, '_', ' ') AS name, post_count FROM tags ORDER BY name ASC")
-			self._data = [(row["name"], row["post_count"]) for row in cursor.fetchall()]
+	def _stat(self, key: str, percentile: int = 99) -> int:
+		"""Returns a stat stored with the database, computing it from the rows
+		if it isn't one of the stored ones."""
+		if key in self._stats:
+			return self._stats[key]
 
-		except sqlite3.Error as exception:
-			print(f"Error querying database: {str(exception)}")
+		rows = [(self.columns.name(row), self.columns.count(row)) for row in range(len(self.columns))] if self.columns else []
+		if key.startswith("name_length_p"):
+			lengths = sorted(len(name) for name, _ in rows)
+			self._stats[key] = lengths[int(percentile / 100 * (len(lengths) - 1))] if lengths else 0
+		else:
+			self._stats.update(compute_stats(rows))
+		return self._stats.get(key, 0)
 
-		self._connection.close()
-		self._connection = None
+	def _row(self, row: int) -> int:
+		"""Maps a model row to a row of the columns."""
+		if self._reversed:
+			row = len(self.columns) - 1 - row
+		return row if self._order is None else self._order[row]
 
 	# Overrides
 
@@ -76,7 +97,10 @@ class TagCompleterModel(QAbstractTableModel):
 
 	def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
 		if role == Qt.ItemDataRole.DisplayRole or role == Qt.ItemDataRole.EditRole:
-			return self._data[index.row()][index.column()]
+			row = self._row(index.row())
+			if index.column() == TagCompleterModel.Column.NAME:
+				return self.columns.name(row)
+			return self.columns.count(row)
 
 		if role == Qt.ItemDataRole.TextAlignmentRole and index.column() == 0:
 			return Qt.AlignmentFlag.AlignLeft
@@ -110,4 +134,4 @@ class TagCompleterModel(QAbstractTableModel):
 		return None
 
 	def rowCount(self, parent: QModelIndex):
-		return len(self._data)
+		return len(self.columns) if self.columns else 0
@@ -0,0 +1,40 @@
+from PyQt6.QtCore import QAbstractTableModel, QModelIndex, Qt
+
+from models.tag_completer_model import TagCompleterModel
+
+
+class TagCompletionModel(QAbstractTableModel):
+	"""The handful of matches for the text being typed, as shown in the
+	completion popup. Columns match ``TagCompleterModel``."""
+	Column = TagCompleterModel.Column
+
+	def __init__(self):
+		super().__init__()
+		self._matches: list[tuple[str, int]] = []
+
+	def set_matches(self, matches: list[tuple[str, int]]):
+		if not matches and not self._matches:
+			return
+		self.beginResetModel()
+		self._matches = matches
+		self.endResetModel()
+
+	# Overrides
+
+	def columnCount(self, parent: QModelIndex = QModelIndex()):
+		return 2
+
+	def data(self, index: QModelIndex, role: int = Qt.ItemDataRole.DisplayRole):
+		if role == Qt.ItemDataRole.DisplayRole or role == Qt.ItemDataRole.EditRole:
+			return self._matches[index.row()][index.column()]
+
+		if role == Qt.ItemDataRole.TextAlignmentRole and index.column() == 0:
+			return Qt.AlignmentFlag.AlignLeft
+
+		if role == Qt.ItemDataRole.TextAlignmentRole and index.column() == 1:
+			return Qt.AlignmentFlag.AlignRight
+
+		return None
+
+	def rowCount(self, parent: QModelIndex = QModelIndex()):
+		return len(self._matches)
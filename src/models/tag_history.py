@@ -0,0 +1,228 @@
+from array import array
+from itertools import compress
+from typing import Iterable
+
+from PyQt6.QtCore import QObject, pyqtSignal
+from PyQt6.QtGui import QUndoCommand, QUndoStack
+
+from models.image import Image
+from settings.config import Config, Setting
+from util.tag_arrays import holding, tag_bytes
+
+# Images an edit changes, and the images each tag it inserts, removes or replaces is edited on
+Touched = tuple[dict[Image, None], dict[int, dict[Image, None]]]
+
+def _touch_tags(tags: dict[int, dict[Image, None]], images: list[Image], tag_ids: array):
+	"""Adds each of ``images`` to the images of the tag ID beside it. Bulk edits
+	mostly use a few tags on many images, which are picked out a tag at a time
+	in C."""
+	distinct = set(tag_ids)
+	if len(distinct) <= 8:
+		for tag_id in distinct:
+			tags.setdefault(tag_id, {}).update(dict.fromkeys(compress(images, map(tag_id.__eq__, tag_ids))))
+		return
+
+	for image, tag_id in zip(images, tag_ids):
+		tag_images = tags.get(tag_id)
+		if tag_images is None:
+			tag_images = tags[tag_id] = {}
+		tag_images[image] = None
+
+
+class TagDelta:
+	"""Insertions or removals of tags across any number of images, kept as
+	parallel arrays of tag IDs and positions rather than copies of tag lists.
+
+	Entries are grouped by image with ascending positions. Removal positions
+	are those before removing, insertion positions those after inserting, so
+	removing walks the entries backwards and inserting walks them forwards,
+	and either one exactly undoes the other.
+	"""
+	__slots__ = ("insertion", "images", "positions", "tag_ids")
+
+	def __init__(self, insertion: bool, entries: Iterable[tuple[Image, int, int]] = ()):
+		self.insertion = insertion
+		self.images: list[Image] = []
+		self.positions = array("I")
+		self.tag_ids = array("I")
+		for image, position, tag_id in entries:
+			self.add(image, position, tag_id)
+
+	def __len__(self) -> int:
+		return len(self.tag_ids)
+
+	def add(self, image: Image, position: int, tag_id: int):
+		self.images.append(image)
+		self.positions.append(position)
+		self.tag_ids.append(tag_id)
+
+	def touch(self, touched: Touched):
+		touched[0].update(dict.fromkeys(self.images))
+		_touch_tags(touched[1], self.images, self.tag_ids)
+
+	def apply(self, undo: bool = False):
+		if self.insertion != undo:
+			for image, position, tag_id in zip(self.images, self.positions, self.tag_ids):
+				image.insert_tag_id(tag_id, min(position, image.tag_count()))
+			return
+
+		for i in range(len(self.tag_ids) - 1, -1, -1):
+			image, position, tag_id = self.images[i], self.positions[i], self.tag_ids[i]
+			tag_ids = image.tag_ids
+			if position >= len(tag_ids) or tag_ids[position] != tag_id:
+				# The sidecar was reloaded from disk since, find the tag again if it's still there
+				if tag_id not in tag_ids:
+					continue
+				position = tag_ids.index(tag_id)
+			image.remove_tag_at(position)
+
+class TagSubstitution:
+	"""Tags replaced in place, one ``(image, position, old, new)`` entry each."""
+	__slots__ = ("images", "positions", "old_ids", "new_ids")
+
+	def __init__(self):
+		self.images: list[Image] = []
+		self.positions = array("I")
+		self.old_ids = array("I")
+		self.new_ids = array("I")
+
+	def __len__(self) -> int:
+		return len(self.new_ids)
+
+	def add(self, image: Image, position: int, old_id: int, new_id: int):
+		self.images.append(image)
+		self.positions.append(position)
+		self.old_ids.append(old_id)
+		self.new_ids.append(new_id)
+
+	def apply(self, undo: bool = False):
+		sources, targets = (self.new_ids, self.old_ids) if undo else (self.old_ids, self.new_ids)
+		Image.replace_tags_at(self.images, self.positions, sources, targets)
+
+	def touch(self, touched: Touched):
+		touched[0].update(dict.fromkeys(self.images))
+		_touch_tags(touched[1], self.images, self.old_ids)
+		_touch_tags(touched[1], self.images, self.new_ids)
+
+class TagPermutation:
+	"""Tags reordered within images. Each image's new order is stored as the
+	previous positions of its tags, all in one flat array."""
+	__slots__ = ("images", "offsets", "orders")
+
+	def __init__(self):
+		self.images: list[Image] = []
+		self.offsets = array("I", [0])
+		self.orders = array("I")
+
+	def __len__(self) -> int:
+		return len(self.images)
+
+	def add(self, image: Image, order: list[int]):
+		self.images.append(image)
+		self.orders.extend(order)
+		self.offsets.append(len(self.orders))
+
+	def apply(self, undo: bool = False):
+		offsets = self.offsets
+		for i, image in enumerate(self.images):
+			order = self.orders[offsets[i]:offsets[i + 1]]
+			if len(order) != image.tag_count():
+				continue # the sidecar was reloaded from disk since
+			if undo:
+				inverse = array("I", bytes(4 * len(order)))
+				for index, previous in enumerate(order):
+					inverse[previous] = index
+				order = inverse
+			image.permute_tags(order)
+
+	def touch(self, touched: Touched):
+		touched[0].update(dict.fromkeys(self.images)) # changed, but has the same tags
+
+class TagEditCommand(QUndoCommand):
+	def __init__(self, history: "TagHistory", text: str, deltas: list):
+		super().__init__(text)
+		self.history = history
+		self.deltas = deltas
+
+	def redo(self):
+		self.history.apply(self.deltas)
+
+	def undo(self):
+		self.history.apply(self.deltas, undo=True)
+
+class TagHistory(QObject):
+	"""Undo stack of the tag edits in the open directory.
+
+	Every edit, from one tag in the editor to a tag renamed across the whole
+	directory, is pushed as a command of delta steps (``TagDelta``,
+	``TagSubstitution`` or ``TagPermutation``) and applied through ``apply``.
+	Each application is announced as one ``tags_changed`` batch, which models
+	fold into a single update. The batch lists which images gained and lost
+	each tag rather than each image's tags before and after, so the edit is
+	checked tag by tag, in one pass over that tag's images.
+	"""
+	# [Image] changed, {tag ID: [Image] that gained it}, {tag ID: [Image] that lost it}.
+	# An object rather than a list, which would be copied item by item into a QVariantList.
+	tags_changed = pyqtSignal(object, dict, dict)
+
+	_instance = None
+
+	def __init__(self):
+		super().__init__()
+		self.stack = QUndoStack()
+		self.stack.setUndoLimit(Config.read(Setting.UndoLimit))
+
+	@classmethod
+	def instance(cls):
+		if cls._instance is None:
+			cls._instance = cls()
+		return cls._instance
+
+	def apply(self, deltas: list, undo: bool = False):
+		"""Applies ``deltas`` in order, or undoes them in reverse."""
+		images, tags = touched = ({}, {})
+		for delta in deltas:
+			delta.touch(touched)
+		held = TagHistory._holding(images, tags)
+
+		for delta in (reversed(deltas) if undo else deltas):
+			delta.apply(undo)
+
+		gained: dict[int, list[Image]] = {}
+		lost: dict[int, list[Image]] = {}
+		for (tag_id, tag_images), had, has in zip(tags.items(), held, TagHistory._holding(images, tags)):
+			if has == had:
+				continue
+			added = [image for image, before, now in zip(tag_images, had, has) if now and not before]
+			if added:
+				gained[tag_id] = added
+			removed = [image for image, before, now in zip(tag_images, had, has) if before and not now]
+			if removed:
+				lost[tag_id] = removed
+
+		self.tags_changed.emit(list(images), gained, lost)
+
+	def clear(self):
+		"""Forgets all history, e.g. when another directory is opened."""
+		self.stack.clear()
+
+	def push(self, text: str, deltas: list):
+		"""Applies ``deltas`` as one undoable step named ``text``."""
+		deltas = [delta for delta in deltas if len(delta)]
+		if deltas:
+			self.stack.push(TagEditCommand(self, text, deltas))
+
+	# --- Private methods
+
+	@staticmethod
+	def _holding(images: dict[Image, None], tags: dict[int, dict[Image, None]]) -> list[list[bool]]:
+		"""Returns whether each tag's images have it. Searches the tag arrays,
+		which is quicker than building ``tag_counts`` for every image of a bulk
+		edit. Bulk edits mostly leave a tag on none of the images, or find it on
+		none, which one search of all the arrays at once tells."""
+		arrays = dict(zip(images, map(Image.load_tags, images)))
+		data = b"".join(map(array.tobytes, arrays.values()))
+		return [
+			holding(list(map(arrays.__getitem__, tag_images)), tag_id) if tag_bytes(tag_id) in data else [False] * len(tag_images)
+			for tag_id, tag_images in tags.items()
+		]
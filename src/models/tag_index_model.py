@@ -1,117 +1,303 @@
+import heapq
+from array import array
+from bisect import bisect_left
 from collections import Counter
+from operator import itemgetter
 
-from PyQt6.QtCore import QAbstractListModel, QModelIndex, Qt
+from PyQt6.QtCore import QAbstractListModel, QModelIndex, Qt, pyqtSignal
 from PyQt6.QtGui import QColor, QFont
 
 from settings.config import Config, Setting
-from models.image_tag_model import ImageTagModel
 from models.image import Image
 from models.directory import Directory
+from models.tag_vocabulary import TagVocabulary
+from util.tag_bitmaps import TagBitmaps, bits_to_rows, rows_to_bits
 
 
 class TagIndexModel(QAbstractListModel):
+	"""Every tag in the directory with the number of images holding it.
+
+	The inverted index behind it is a ``TagBitmaps`` over image slots: each
+	indexed image gets a small integer that stays put while rows of the
+	directory move, and is handed to the next image once it is removed.
+	"""
+	images_changed = pyqtSignal(object) # [Image] indexed whose tags were just applied
+
+	# Batches adding more new tags than this reset the model instead of
+	# inserting rows one at a time
+	bulk_insert_threshold = 64
+
 	def __init__(self, directory: Directory | None = None):
 		super().__init__()
 		self.directory = None
 		self.current_image: Image | None = None
-		self.tag_map: dict[str, list[Image]] = {} # inverted index of tags to TagImages
-		self.__view_cache: list[str] = [] # cached sorted tags (with values) from tag_map
+		self.tag_bitmaps = TagBitmaps() # inverted index of tag IDs to image slots
+		self.__view_cache: list[int] = [] # tag IDs from tag_bitmaps, kept sorted by tag string
+		self._slots: dict[Image, int] = {} # slot of each image whose tags are indexed
+		self._images: list[Image | None] = [] # image in each slot, None once freed
+		self._free: list[int] = [] # freed slots
+		self._highlighted: set[int] = set() # tag IDs of current_image as last painted
 		self.match_color = QColor(Config.read(Setting.IndexMatchColor))
+		self.match_font = QFont()
+		self.match_font.setBold(True)
+		self.normal_font = QFont()
 		self.load(directory)
 
 	def load(self, directory: Directory):
 		if directory is None:
 			return
 
-		self.layoutAboutToBeChanged.emit()
+		self.beginResetModel()
 		self.directory = directory
-		self._build_tag_map()
-		self.layoutChanged.emit()
+		self.current_image = None
+		self._highlighted = set()
+		self._build_index()
+		self.endResetModel()
 
-	def on_image_loaded(self, image: Image):
-		self.current_image = image
-		self.dataChanged.emit(QModelIndex(), QModelIndex(), [Qt.ItemDataRole.ForegroundRole])
-
-	def on_image_tags_modified(self, image: Image, old_tags: Counter[str], new_tags: Counter[str]):
-		added = new_tags - old_tags
-		removed = old_tags - new_tags
-
-		for tag in added:
-			self.tag_map.setdefault(tag, []).append(image)
-
-		for tag in removed:
-			images = self.tag_map.get(tag)
-			if images:
-				images.remove(image)
-				if not images:
-					index = self.__view_cache.index(tag)
-					self.beginRemoveRows(QModelIndex(), index, index)
-					del self.tag_map[tag]
-					self.endRemoveRows()
-
-		# could optimize a bit, but rebuilding the whole mostly-sorted cache is fine
-		# TODO determine correct specific row to update, or specific insert/remove row update
-		self._build_tag_cache()
-		self.dataChanged.emit(QModelIndex(), QModelIndex(), [Qt.ItemDataRole.DisplayRole])
-
-	def on_tag_removed(self, tag: str):
-		image_tag_model: ImageTagModel = self.sender()
-		images: list[Image] = self.tag_map[tag]
-		images.remove(image_tag_model.image)
-		self.dataChanged.emit(self.index(0, 0), self.index(0, 0), [Qt.ItemDataRole.DisplayRole])
-
-	def remove_tag(self, tag: str):
-		"""Removes all instances of ``tag`` from all ``TagImage`` instances."""
-		images = self.tag_map.pop(tag, None)
-		if not images:
+	def add_loaded_tags(self, results: list[tuple[Image, array]]):
+		"""Installs tags parsed by background loaders and adds them to the index."""
+		changes = []
+		for image, tag_ids in results:
+			if image in self._slots:
+				continue
+			image.set_loaded_tags(tag_ids)
+			self._add_slot(image)
+			changes.append((image, Counter(), Counter(image.tag_ids)))
+		self.apply_tag_changes(changes)
+
+	def apply_membership_changes(self, images: list[Image], gained: dict[int, list[Image]], lost: dict[int, list[Image]]):
+		"""Applies a batch of edits to ``images``, given as the images that
+		gained and lost each tag. Images that aren't indexed are skipped.
+
+		Only the affected rows are signalled: inserted and removed tags get their
+		own row insertions and removals, and count changes are reported as
+		``dataChanged`` over contiguous row ranges.
+		"""
+		indexed = self._slots
+		images = [image for image in images if image in indexed]
+		added = TagIndexModel._slots_by_tag(indexed, gained)
+		removed = TagIndexModel._slots_by_tag(indexed, lost)
+
+		new_tags = [tag_id for tag_id in added if tag_id not in self.tag_bitmaps]
+		if len(new_tags) > TagIndexModel.bulk_insert_threshold:
+			self.beginResetModel()
+			for tag_id, slots in added.items():
+				self.tag_bitmaps.add(tag_id, slots)
+			for tag_id, slots in removed.items():
+				self.tag_bitmaps.discard(tag_id, slots)
+			if self.current_image is not None:
+				self._highlighted = set(self.current_image.tag_counts)
+			self._build_tag_cache()
+			self.endResetModel()
+			self.images_changed.emit(images)
 			return
+
+		changed: set[int] = set()
+		if self.current_image is not None:
+			highlighted = set(self.current_image.tag_counts)
+			changed = highlighted ^ self._highlighted
+			self._highlighted = highlighted
+
+		for tag_id, slots in added.items():
+			if tag_id in self.tag_bitmaps:
+				self.tag_bitmaps.add(tag_id, slots)
+				changed.add(tag_id)
+			else:
+				self._insert_row(tag_id, slots)
+
+		for tag_id, slots in removed.items():
+			if self.tag_bitmaps.discard(tag_id, slots):
+				changed.add(tag_id)
+			else:
+				self._remove_row(tag_id)
+				changed.discard(tag_id)
+
+		self._emit_rows_changed(changed, [
+			Qt.ItemDataRole.DisplayRole,
+			Qt.ItemDataRole.FontRole,
+			Qt.ItemDataRole.ForegroundRole
+		])
+		if images:
+			self.images_changed.emit(images)
+
+	def apply_tag_changes(self, changes: list[tuple[Image, Counter[int], Counter[int]]]):
+		"""Applies a batch of ``(image, old_tags, new_tags)`` deltas."""
+		gained: dict[int, list[Image]] = {}
+		lost: dict[int, list[Image]] = {}
+		for image, old_tags, new_tags in changes:
+			for tag_id in new_tags.keys() - old_tags.keys():
+				gained.setdefault(tag_id, []).append(image)
+			for tag_id in old_tags.keys() - new_tags.keys():
+				lost.setdefault(tag_id, []).append(image)
+		self.apply_membership_changes([image for image, _, _ in changes], gained, lost)
+
+	def bits_of(self, images: list[Image]) -> int:
+		"""Returns the slots of the indexed ``images`` as a bitmap."""
+		slots = self._slots
+		return rows_to_bits([slots[image] for image in images if image in slots])
+
+	def co_occurring(self, tag_id: int, limit: int | None = None) -> list[tuple[int, int]]:
+		"""Returns the tags sharing images with ``tag_id`` and the number of
+		images they share, most first. For a tag on few images it is quicker to
+		count those images' tags than to walk the other tags' bitmaps."""
+		if self.tag_bitmaps.is_dense(tag_id):
+			return self.tag_bitmaps.co_occurrence(tag_id, limit)
+
+		counts = Counter()
+		for slot in self.tag_bitmaps.rows(tag_id):
+			counts.update(set(self._images[slot].tag_ids))
+		counts.pop(tag_id, None)
+		if limit is None:
+			return sorted(counts.items(), key=itemgetter(1), reverse=True)
+		return heapq.nlargest(limit, counts.items(), key=itemgetter(1))
+
+	def count(self, tag_id: int) -> int:
+		"""Returns the number of images holding ``tag_id``."""
+		return self.tag_bitmaps.count(tag_id)
+
+	def images_of(self, bits: int) -> list[Image]:
+		"""Returns the images in the slots set in ``bits``, in slot order."""
+		images = self._images
+		return [images[slot] for slot in bits_to_rows(bits)]
+
+	def images_with(self, tag_ids: set[int]) -> list[Image]:
+		"""Returns the images holding any of ``tag_ids``, in slot order."""
+		if len(tag_ids) == 1:
+			images = self._images
+			return [images[slot] for slot in self.tag_bitmaps.rows(next(iter(tag_ids)))]
+		return self.images_of(self.tag_bitmaps.union(tag_ids))
+
+	def images_without(self, tag_id: int) -> list[Image]:
+		"""Returns the indexed images lacking ``tag_id``, in slot order."""
+		return self.images_of(self.indexed_bits() & ~self.tag_bitmaps.bits(tag_id))
+
+	def indexed_bits(self) -> int:
+		"""Returns the slots of all indexed images as a bitmap."""
+		return ((1 << len(self._images)) - 1) & ~rows_to_bits(self._free)
+
+	def is_indexed(self, image: Image) -> bool:
+		return image in self._slots
+
+	def remove_images(self, images: list[Image]):
+		"""Drops deleted images from the index, freeing their slots."""
+		self.apply_tag_changes([
+			(image, Counter(image.tag_ids), Counter())
+			for image in images
+			if image in self._slots
+		])
 		for image in images:
-			image.remove_tag(tag)
-			# TODO data should inform their views of change here
-		# TODO inform this model's views of data change
+			slot = self._slots.pop(image, None)
+			if slot is not None:
+				self._images[slot] = None
+				self._free.append(slot)
+
+	def on_image_loaded(self, image: Image):
+		"""Repaints only the rows whose highlight differs between the old and new image."""
+		self.current_image = image
+		highlighted = set(image.tag_counts) if image is not None else set()
+		changed = highlighted ^ self._highlighted
+		self._highlighted = highlighted
+		self._emit_rows_changed(changed, [Qt.ItemDataRole.FontRole, Qt.ItemDataRole.ForegroundRole])
+
+	def row_of(self, tag_id: int) -> int | None:
+		"""Returns the row of ``tag_id``, found by binary search."""
+		if tag_id not in self.tag_bitmaps:
+			return None
+		return bisect_left(self.__view_cache, TagVocabulary.string(tag_id), key=TagVocabulary.string)
 
 	# ---- Overrides
 
 	def data(self, index: QModelIndex, role: int):
-		tag = self.__view_cache[index.row()]
+		tag_id = self.__view_cache[index.row()]
 
 		q = Qt.ItemDataRole
 
 		if role == q.DisplayRole:
-			tag_count = len(self.tag_map[tag])
-			display_string = f"{tag} ({tag_count})"
+			tag_count = self.tag_bitmaps.count(tag_id)
+			display_string = f"{TagVocabulary.string(tag_id)} ({tag_count})"
 			return display_string
 		if role == q.EditRole:
-			return tag
+			return TagVocabulary.string(tag_id)
 
 		if self.current_image is None:
 			return None
 
 		if role == q.FontRole:
-			testfont = QFont()
-			testfont.setBold(True)
-			return testfont if tag in list(map(str, self.current_image.tags)) else QFont() # TODO cache a list in the Image class
+			return self.match_font if self.current_image.has_tag(tag_id) else self.normal_font
 		if role == q.ForegroundRole:
-			return self.match_color if tag in list(map(str, self.current_image.tags)) else None # TODO cache a list in the Image class
+			return self.match_color if self.current_image.has_tag(tag_id) else None
 
 		return None
 
-	def rowCount(self, index: QModelIndex):
-		return len(self.tag_map)
+	def rowCount(self, index: QModelIndex = QModelIndex()):
+		return len(self.tag_bitmaps)
 
 	# --- Private methods
 
-	def _build_tag_cache(self):
-		self.tag_map = dict(sorted(self.tag_map.items()))
-		self.__view_cache = list(self.tag_map)
+	def _add_slot(self, image: Image) -> int:
+		if self._free:
+			slot = self._free.pop()
+			self._images[slot] = image
+		else:
+			slot = len(self._images)
+			self._images.append(image)
+		self._slots[image] = slot
+		return slot
 
-	def _build_tag_map(self):
+	def _build_index(self):
 		if self.directory is None:
 			return
 
-		self.tag_map.clear()
+		self.tag_bitmaps.clear()
+		self._slots.clear()
+		self._images = []
+		self._free = []
+		slots: dict[int, list[int]] = {}
 		for image in self.directory.images:
-			for tag in image.tags:
-				self.tag_map.setdefault(str(tag), []).append(image)
+			slot = self._add_slot(image)
+			for tag_id in image.tag_ids:
+				slots.setdefault(tag_id, []).append(slot)
+		for tag_id, tag_slots in slots.items():
+			self.tag_bitmaps.add(tag_id, tag_slots)
 
 		self._build_tag_cache()
+
+	def _build_tag_cache(self):
+		self.__view_cache = sorted(self.tag_bitmaps, key=TagVocabulary.string)
+
+	def _emit_rows_changed(self, tag_ids: set[int], roles: list[int]):
+		"""Emits ``dataChanged`` once per contiguous run of affected rows."""
+		rows = sorted(row for row in map(self.row_of, tag_ids) if row is not None)
+		start = 0
+		while start < len(rows):
+			end = start
+			while end + 1 < len(rows) and rows[end + 1] == rows[end] + 1:
+				end += 1
+			self.dataChanged.emit(self.index(rows[start]), self.index(rows[end]), roles)
+			start = end + 1
+
+	def _insert_row(self, tag_id: int, slots: list[int]):
+		row = bisect_left(self.__view_cache, TagVocabulary.string(tag_id), key=TagVocabulary.string)
+		self.beginInsertRows(QModelIndex(), row, row)
+		self.__view_cache.insert(row, tag_id)
+		self.tag_bitmaps.add(tag_id, slots)
+		self.endInsertRows()
+
+	def _remove_row(self, tag_id: int):
+		"""Removes the row of a tag already dropped from ``tag_bitmaps``."""
+		row = bisect_left(self.__view_cache, TagVocabulary.string(tag_id), key=TagVocabulary.string)
+		if row == len(self.__view_cache) or self.__view_cache[row] != tag_id:
+			return
+		self.beginRemoveRows(QModelIndex(), row, row)
+		del self.__view_cache[row]
+		self.endRemoveRows()
+
+	@staticmethod
+	def _slots_by_tag(indexed: dict[Image, int], images_by_tag: dict[int, list[Image]]) -> dict[int, list[int]]:
+		"""Maps each tag's images to their slots, leaving out tags on no indexed image."""
+		slots_by_tag = {}
+		for tag_id, images in images_by_tag.items():
+			slots = [slot for slot in map(indexed.get, images) if slot is not None]
+			if slots:
+				slots_by_tag[tag_id] = slots
+		return slots_by_tag
@@ -0,0 +1,247 @@
+import operator
+import re
+from fnmatch import translate
+from typing import Callable
+
+from models.image import Image
+from models.tag_vocabulary import TagVocabulary
+
+
+class TagQuery:
+	"""An image filter such as ``1girl AND NOT solo`` or ``tags < 5 OR file:*.png``.
+
+	Terms are combined with ``AND``, ``OR`` and ``NOT`` (upper case, binding in
+	the reverse of that order) and grouped with parentheses:
+
+	- A tag is written as is, spaces included. Parentheses that follow a word
+	  belong to the tag, as in ``ganyu (genshin impact)``. Tags that collide
+	  with the syntax can be quoted: ``"NOT"``.
+	- ``tags < 5`` compares the number of tags, with ``<``, ``<=``, ``>``,
+	  ``>=``, ``=`` or ``!=``.
+	- ``file:*_crop.png`` matches file names, ignoring case.
+
+	``evaluate`` resolves a whole query against the bitmaps of the tag index,
+	and ``matches`` checks a single image, for keeping results up to date.
+	:raises ValueError: If ``text`` isn't a valid query.
+	"""
+	def __init__(self, text: str):
+		self.text = text
+		self.root = _Parser(text).parse()
+
+	def evaluate(self, index: "TagIndexModel") -> int:
+		"""Returns the slots of the matching images in ``index`` as a bitmap."""
+		return self.root.evaluate(index, index.indexed_bits())
+
+	def matches(self, image: Image) -> bool:
+		return self.root.matches(image)
+
+class _Tag:
+	indexed = True # evaluates from the index without visiting every image
+
+	def __init__(self, tag: str):
+		self.tag = tag
+		self._tag_id: int | None = None
+
+	def evaluate(self, index: "TagIndexModel", universe: int) -> int:
+		tag_id = self.tag_id()
+		return index.tag_bitmaps.bits(tag_id) if tag_id is not None else 0
+
+	def matches(self, image: Image) -> bool:
+		tag_id = self.tag_id()
+		return tag_id is not None and tag_id in image.tag_ids
+
+	def tag_id(self) -> int | None:
+		# IDs are never reassigned, but the tag may only be interned later
+		if self._tag_id is None:
+			self._tag_id = TagVocabulary.get(self.tag)
+		return self._tag_id
+
+class _Predicate:
+	"""A test of single images, which has to visit every candidate."""
+	indexed = False
+
+	def __init__(self, test: Callable[[Image], bool]):
+		self.test = test
+
+	def evaluate(self, index: "TagIndexModel", universe: int) -> int:
+		test = self.test
+		return index.bits_of([image for image in index.images_of(universe) if test(image)])
+
+	def matches(self, image: Image) -> bool:
+		return self.test(image)
+
+class _Not:
+	indexed = False
+
+	def __init__(self, operand):
+		self.operand = operand
+
+	def evaluate(self, index: "TagIndexModel", universe: int) -> int:
+		return universe & ~self.operand.evaluate(index, universe)
+
+	def matches(self, image: Image) -> bool:
+		return not self.operand.matches(image)
+
+class _And:
+	def __init__(self, operands: list):
+		self.operands = operands
+		self.indexed = any(operand.indexed for operand in operands)
+
+	def evaluate(self, index: "TagIndexModel", universe: int) -> int:
+		"""Intersects the indexed operands, masks out negated indexed operands
+		and only then tests the rest on the images left."""
+		result = universe
+		tests = []
+		for operand in self.operands:
+			if operand.indexed:
+				result &= operand.evaluate(index, universe)
+			elif isinstance(operand, _Not) and operand.operand.indexed:
+				result &= ~operand.operand.evaluate(index, universe)
+			else:
+				tests.append(operand)
+
+		if tests and result:
+			images = [image for image in index.images_of(result) if all(operand.matches(image) for operand in tests)]
+			result = index.bits_of(images)
+		return result
+
+	def matches(self, image: Image) -> bool:
+		return all(operand.matches(image) for operand in self.operands)
+
+class _Or:
+	def __init__(self, operands: list):
+		self.operands = operands
+		self.indexed = all(operand.indexed for operand in operands)
+
+	def evaluate(self, index: "TagIndexModel", universe: int) -> int:
+		result = 0
+		for operand in self.operands:
+			result |= operand.evaluate(index, universe)
+		return result
+
+	def matches(self, image: Image) -> bool:
+		return any(operand.matches(image) for operand in self.operands)
+
+_COMPARISONS = {
+	"<": operator.lt,
+	"<=": operator.le,
+	">": operator.gt,
+	">=": operator.ge,
+	"=": operator.eq,
+	"==": operator.eq,
+	"!=": operator.ne,
+}
+_COUNT = re.compile(r"tags\s*(<=|>=|!=|==|=|<|>)\s*(\d+)")
+_KEYWORDS = ("AND", "OR", "NOT")
+_TOKEN = re.compile(r"\s*(?:\"((?:[^\"\\]|\\.)*)\"|([()])|([^\s()\"]+))")
+
+class _Parser:
+	"""Recursive descent over tokens of ``(start, end, kind, value)``, where kind
+	is ``"("``, ``")"``, ``"quoted"``, ``"word"`` or a keyword."""
+	def __init__(self, text: str):
+		self.text = text
+		self.tokens = _Parser.tokenize(text)
+		self.position = 0
+
+	@staticmethod
+	def tokenize(text: str) -> list[tuple[int, int, str, str]]:
+		tokens = []
+		position = 0
+		while position < len(text):
+			match = _TOKEN.match(text, position)
+			if match is None:
+				if text[position:].strip():
+					raise ValueError(f"Unclosed quote at {position + 1}")
+				break
+			quoted, paren, word = match.groups()
+			if quoted is not None:
+				tokens.append((match.start(1) - 1, match.end(), "quoted", re.sub(r"\\(.)", r"\1", quoted)))
+			elif paren is not None:
+				tokens.append((match.start(2), match.end(), paren, paren))
+			else:
+				tokens.append((match.start(3), match.end(), word if word in _KEYWORDS else "word", word))
+			position = match.end()
+		return tokens
+
+	def parse(self):
+		node = self.parse_or()
+		if self.position < len(self.tokens):
+			self.fail("Unexpected")
+		return node
+
+	def parse_or(self):
+		operands = [self.parse_and()]
+		while self.peek() == "OR":
+			self.position += 1
+			operands.append(self.parse_and())
+		return _Or(operands) if len(operands) > 1 else operands[0]
+
+	def parse_and(self):
+		operands = [self.parse_not()]
+		while self.peek() == "AND":
+			self.position += 1
+			operands.append(self.parse_not())
+		return _And(operands) if len(operands) > 1 else operands[0]
+
+	def parse_not(self):
+		if self.peek() == "NOT":
+			self.position += 1
+			return _Not(self.parse_not())
+		return self.parse_term()
+
+	def parse_term(self):
+		match self.peek():
+			case "(":
+				self.position += 1
+				node = self.parse_or()
+				if self.peek() != ")":
+					self.fail("Expected \")\" instead of")
+				self.position += 1
+				return node
+			case "quoted":
+				self.position += 1
+				return _Tag(self.tokens[self.position - 1][3])
+			case "word":
+				return self.parse_phrase()
+			case _:
+				self.fail("Expected a tag instead of")
+
+	def parse_phrase(self):
+		"""Reads words up to the next keyword or unbalanced parenthesis as one
+		term, which is a tag unless it is a count or file name test."""
+		start = self.tokens[self.position][0]
+		end = start
+		depth = 0
+		while self.position < len(self.tokens):
+			_, token_end, kind, _ = self.tokens[self.position]
+			if kind == "(":
+				depth += 1
+			elif kind == ")":
+				if depth == 0:
+					break
+				depth -= 1
+			elif kind != "word" and depth == 0:
+				break
+			end = token_end
+			self.position += 1
+		if depth:
+			raise ValueError(f"Unclosed \"(\" in \"{self.text[start:end]}\"")
+
+		phrase = " ".join(self.text[start:end].split())
+		count = _COUNT.fullmatch(phrase)
+		if count is not None:
+			compare, limit = _COMPARISONS[count.group(1)], int(count.group(2))
+			return _Predicate(lambda image: compare(image.tag_count(), limit))
+		if phrase.startswith("file:"):
+			pattern = re.compile(translate(phrase[5:].strip()), re.IGNORECASE)
+			return _Predicate(lambda image: pattern.match(image.path.name) is not None)
+		return _Tag(phrase)
+
+	def peek(self) -> str | None:
+		return self.tokens[self.position][2] if self.position < len(self.tokens) else None
+
+	def fail(self, message: str):
+		if self.position >= len(self.tokens):
+			raise ValueError(f"{message} end of query")
+		start, end, _, _ = self.tokens[self.position]
+		raise ValueError(f"{message} \"{self.text[start:end]}\" at {start + 1}")
@@ -0,0 +1,76 @@
+import threading
+from array import array
+from typing import Iterable
+
+
+class TagVocabulary:
+	"""Process-wide interning of tag strings to dense integer IDs.
+
+	IDs are never reused or reassigned, so they can be stored anywhere in place
+	of the string. Interning is thread-safe; lookups of already-interned tags
+	are lock-free.
+	"""
+	_ids: dict[str, int] = {}
+	_strings: list[str] = []
+	_lock = threading.Lock()
+
+	@classmethod
+	def get(cls, tag: str) -> int | None:
+		"""Returns the ID of ``tag`` without interning it."""
+		return cls._ids.get(tag)
+
+	@classmethod
+	def intern(cls, tag: str) -> int:
+		tag_id = cls._ids.get(tag)
+		if tag_id is not None:
+			return tag_id
+
+		with cls._lock:
+			tag_id = cls._ids.get(tag)
+			if tag_id is None:
+				tag_id = len(cls._strings)
+				cls._strings.append(tag)
+				cls._ids[tag] = tag_id
+			return tag_id
+
+	@classmethod
+	def intern_many(cls, tags: Iterable[str]) -> array:
+		"""Interns ``tags`` in order, taking the lock at most once."""
+		if not isinstance(tags, (list, tuple)):
+			tags = list(tags)
+
+		ids = cls._ids
+		result = array("I")
+		missing = False
+		for tag in tags:
+			tag_id = ids.get(tag)
+			if tag_id is None:
+				missing = True
+				break
+			result.append(tag_id)
+
+		if missing:
+			with cls._lock:
+				result = array("I")
+				for tag in tags:
+					tag_id = ids.get(tag)
+					if tag_id is None:
+						tag_id = len(cls._strings)
+						cls._strings.append(tag)
+						ids[tag] = tag_id
+					result.append(tag_id)
+
+		return result
+
+	@classmethod
+	def size(cls) -> int:
+		return len(cls._strings)
+
+	@classmethod
+	def string(cls, tag_id: int) -> str:
+		return cls._strings[tag_id]
+
+	@classmethod
+	def strings(cls, tag_ids: Iterable[int]) -> list[str]:
+		strings = cls._strings
+		return [strings[tag_id] for tag_id in tag_ids]
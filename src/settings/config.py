@@ -23,6 +23,24 @@ class Setting(Enum):
 	ModifiedColor = Entry("Colors/modified_color", "#CC3333")
 	IndexMatchColor = Entry("Colors/index_match_color", "#33CC33")
 
+	ThumbnailCacheEnabled = Entry("ThumbnailCache/enabled", True)
+	ThumbnailCacheSize = Entry("ThumbnailCache/size_mb", 512)
+	ImageCacheSize = Entry("ImageCache/size_mb", 256)
+	ThumbnailQuality = Entry("Thumbnails/quality", "balanced") # fast, balanced or quality
+	TagCacheEnabled = Entry("TagCache/enabled", True)
+	UndoLimit = Entry("History/undo_limit", 100) # 0 keeps every step
+	JournalEnabled = Entry("Journal/enabled", True) # log unsaved edits for recovery after a crash
+	FuzzyCompletion = Entry("Completion/fuzzy", True) # suggest near misses when few tags contain the text
+	WatchPollInterval = Entry("Watcher/poll_interval_s", 15) # 0 disables polling for in-place sidecar rewrites
+
+	ThumbnailWorkers = Entry("Performance/thumbnail_workers", 0) # 0 uses one per core
+	SaveWorkers = Entry("Performance/save_workers", 2) # sidecar writes are mostly waiting on fsync
+	ImageWorkers = Entry("Performance/image_workers", 2) # full-size decodes for the viewer
+	ViewerCacheSize = Entry("Performance/viewer_cache_mb", 512)
+	ViewerDebounce = Entry("Performance/viewer_debounce_ms", 80) # wait for navigation to settle before decoding
+	PrefetchDepth = Entry("Performance/prefetch_depth", 2) # images decoded ahead in the direction of travel
+	TiledImageThreshold = Entry("Performance/tiled_threshold_mp", 40) # larger JPEGs are drawn from tiles, other formats scaled down
+
 class Config:
 	_manager = QSettings(APP_NAME, APP_NAME)
 
@@ -44,6 +62,8 @@ class Config:
 			type_of = type(entry.value.default)
 			if type_of is bool:
 				return Config.str_to_bool(value)
+			if type_of is int:
+				return int(value)
 		else:
 			value = Config._manager.value(entry, None)
 			type_of = str
@@ -55,7 +75,10 @@ class Config:
 		Config._manager.remove(entry.value.key)
 
 	@staticmethod
-	def str_to_bool(string: str):
+	def str_to_bool(string: str | bool):
+		if isinstance(string, bool):
+			return string
+
 		mapping = {
 			"true": True,
 			"false": False,
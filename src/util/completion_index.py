@@ -0,0 +1,126 @@
+import heapq
+import math
+from collections import Counter
+from typing import Callable
+
+from util.tag_columns import TagColumns
+
+
+class CompletionIndex:
+	"""Case-insensitive substring search over tag names, most posts first.
+
+	Works on the rank-ordered side of ``TagColumns``: each trigram of a
+	lowercased name maps to the ascending ranks of the tags containing it.
+	A query walks the shortest posting list among its trigrams and verifies
+	each candidate, so results come out already in rank order and the walk
+	stops as soon as ``k`` of them are found. Queries shorter than a trigram
+	search the rank-ordered name buffer directly, which stops just as early for
+	anything common enough to be worth suggesting.
+
+	The same postings answer fuzzy queries: a typo only breaks the few trigrams
+	around it, so tags sharing enough trigrams with the query are found by
+	counting how many of its posting lists each tag appears in.
+	"""
+	popularity_weight = 0.25 # how much post_count can lift a fuzzy match over a closer one
+
+	def __init__(self, columns: TagColumns | None = None):
+		self.columns = columns
+		max_count = columns.count(columns.by_count[0]) if columns else 0
+		self._log_max_count = math.log1p(max_count)
+
+	def __len__(self) -> int:
+		return len(self.columns) if self.columns else 0
+
+	def complete(
+			self,
+			text: str,
+			k: int,
+			fuzzy: bool = False,
+			canceled: Callable[[], bool] | None = None
+	) -> list[tuple[str, int]]:
+		"""Returns substring matches, topped up with fuzzy matches when there
+		are fewer than ``k`` of them and ``fuzzy`` is set.
+		:param canceled: Polled between stages, returns nothing once it's true.
+		"""
+		ranks = self.top_k(text, k)
+		if fuzzy and len(ranks) < k and not (canceled and canceled()):
+			found = set(ranks)
+			ranks += [rank for rank in self.fuzzy_top_k(text, k, canceled=canceled) if rank not in found][:k - len(ranks)]
+		if canceled and canceled():
+			return []
+		return self._entries(ranks)
+
+	def fuzzy_top_k(
+			self,
+			text: str,
+			k: int,
+			min_similarity: float = 0.45,
+			canceled: Callable[[], bool] | None = None
+	) -> list[int]:
+		"""Returns the ranks of up to ``k`` tags similar to ``text``, best first.
+
+		Similarity is the Dice coefficient of the trigram sets, and is mixed
+		with ``post_count`` on a log scale for ranking.
+		"""
+		columns = self.columns
+		grams = TagColumns.grams(text.lower())
+		n = len(grams)
+		if columns is None or n < 2 or k <= 0:
+			return [] # one trigram can only match exactly
+
+		# Dice >= s needs at least s * n / (2 - s) trigrams in common
+		needed = max(1, math.ceil(min_similarity * n / (2 - min_similarity)))
+		shared = Counter()
+		for gram in grams:
+			if canceled and canceled():
+				return []
+			posting = columns.posting(gram)
+			if posting is not None:
+				shared.update(posting)
+
+		by_count = columns.by_count
+		weight = CompletionIndex.popularity_weight / self._log_max_count if self._log_max_count else 0.0
+		scored = []
+		for rank, common in shared.items():
+			if common < needed:
+				continue
+			similarity = 2 * common / (n + columns.gram_count(rank))
+			if similarity >= min_similarity:
+				scored.append((similarity + weight * math.log1p(columns.count(by_count[rank])), -rank))
+		return [-rank for _, rank in heapq.nlargest(k, scored)]
+
+	def matches(self, text: str, k: int) -> list[tuple[str, int]]:
+		"""Returns up to ``k`` ``(name, post_count)`` pairs whose name contains ``text``."""
+		return self._entries(self.top_k(text, k))
+
+	def top_k(self, text: str, k: int) -> list[int]:
+		"""Returns the ranks of the ``k`` most used tags containing ``text``."""
+		columns = self.columns
+		folded = text.lower()
+		if columns is None or not folded or k <= 0:
+			return []
+		query = folded.encode()
+
+		results = []
+		if len(folded) < TagColumns.gram_length:
+			rank = columns.find_folded(query)
+			while rank is not None and len(results) < k:
+				results.append(rank)
+				rank = columns.find_folded(query, rank + 1)
+			return results
+
+		postings = []
+		for gram in TagColumns.grams(folded):
+			posting = columns.posting(gram)
+			if posting is None:
+				return [] # no tag contains this trigram
+			postings.append(posting)
+
+		return columns.filter_folded(min(postings, key=len), query, k)
+
+	# --- Private methods
+
+	def _entries(self, ranks: list[int]) -> list[tuple[str, int]]:
+		columns = self.columns
+		rows = [columns.by_count[rank] for rank in ranks]
+		return [(columns.name(row), columns.count(row)) for row in rows]
@@ -0,0 +1,192 @@
+import math
+import struct
+from enum import StrEnum
+from pathlib import Path
+
+from PyQt6.QtCore import QRect, QSize, Qt
+from PyQt6.QtGui import QImage, QImageIOHandler, QImageReader, QTransform
+
+
+class ThumbnailQuality(StrEnum):
+	FAST = "fast" # embedded EXIF thumbnails when big enough, reduced-size decode, fast scaling
+	BALANCED = "balanced" # reduced-size decode at twice the target, smooth scaling
+	QUALITY = "quality" # full decode, smooth scaling
+
+
+def read_size(path: Path | str) -> QSize | None:
+	"""Reads image dimensions as displayed, after any EXIF orientation, from
+	the file header without decoding pixels."""
+	reader = QImageReader(str(path))
+	size = reader.size()
+	return oriented_size(size, reader.transformation()) if size.isValid() else None
+
+def supports_clip_rect(path: Path | str) -> bool:
+	"""Returns whether the file's format can decode part of an image without
+	decoding all of it, which only JPEG does among the common formats."""
+	return QImageReader(str(path)).supportsOption(QImageIOHandler.ImageOption.ClipRect)
+
+def oriented_size(size: QSize, transformation: QImageIOHandler.Transformation) -> QSize:
+	"""Returns ``size`` after ``transformation``, which swaps the sides of quarter turns.
+	Applying it twice gives the original size back."""
+	return size.transposed() if transformation & QImageIOHandler.Transformation.TransformationRotate90 else size
+
+def stored_rect(rect: QRect, size: QSize, transformation: QImageIOHandler.Transformation) -> QRect:
+	"""Maps ``rect`` of an image as displayed after ``transformation`` back to
+	the pixels stored in the file, which is ``size`` large."""
+	x, y, width, height = rect.x(), rect.y(), rect.width(), rect.height()
+	# Readers mirror and flip first, then turn a quarter clockwise, so undo in reverse
+	if transformation & QImageIOHandler.Transformation.TransformationRotate90:
+		x, y, width, height = y, size.height() - x - width, height, width
+	if transformation & QImageIOHandler.Transformation.TransformationMirror:
+		x = size.width() - x - width
+	if transformation & QImageIOHandler.Transformation.TransformationFlip:
+		y = size.height() - y - height
+	return QRect(x, y, width, height)
+
+def exif_thumbnail(path: Path | str) -> QImage | None:
+	"""Returns the JPEG thumbnail embedded in a file's EXIF block, if there is one.
+
+	Only the first 64 KiB are read, which is the maximum size of an APP1 segment.
+	"""
+	try:
+		with open(path, "rb") as file:
+			data = file.read(65536)
+	except OSError:
+		return None
+
+	if data[:2] != b"\xff\xd8":
+		return None
+
+	# Walk JPEG segments looking for APP1/Exif
+	offset = 2
+	while offset + 4 <= len(data) and data[offset] == 0xFF:
+		marker = data[offset + 1]
+		length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+		if marker == 0xE1 and data[offset + 4:offset + 10] == b"Exif\x00\x00":
+			return _exif_ifd1_thumbnail(data[offset + 10:offset + 2 + length])
+		if marker == 0xDA: # start of scan, no more metadata
+			return None
+		offset += 2 + length
+
+	return None
+
+def decode_thumbnail(
+		path: Path | str,
+		thumb_size: int,
+		quality: ThumbnailQuality = ThumbnailQuality.BALANCED
+) -> tuple[QImage, QSize | None]:
+	"""Decodes ``path`` scaled so its shorter side is ``thumb_size``.
+
+	Decoding is done at reduced resolution where the format allows it (JPEG
+	decodes in the DCT domain at 1/2, 1/4 or 1/8 scale), so a camera-sized
+	image never gets fully decompressed for a thumbnail. EXIF orientation is
+	applied, embedded thumbnails included, as the viewer does.
+
+	:returns: The scaled image and the original image size as displayed.
+	"""
+	reader = QImageReader(str(path))
+	reader.setAutoTransform(True)
+	transformation = reader.transformation()
+	stored = reader.size()
+	size = oriented_size(stored, transformation) if stored.isValid() else None
+
+	smooth = Qt.TransformationMode.SmoothTransformation
+	if quality == ThumbnailQuality.FAST:
+		transform = Qt.TransformationMode.FastTransformation
+
+		if reader.format() in (b"jpeg", b"jpg") and size is not None:
+			embedded = exif_thumbnail(path)
+			if embedded is not None and _can_substitute(embedded.size(), stored, thumb_size):
+				return _scale_to_fill(_transformed(embedded, transformation), thumb_size, smooth), size
+	else:
+		transform = smooth
+
+	# The scaled size is in stored pixels, the reader orients after scaling
+	if size is not None and quality != ThumbnailQuality.QUALITY:
+		oversample = 1 if quality == ThumbnailQuality.FAST else 2
+		scale = thumb_size * oversample / min(stored.width(), stored.height())
+		if scale < 1.0:
+			reader.setScaledSize(QSize(
+				max(1, math.ceil(stored.width() * scale)),
+				max(1, math.ceil(stored.height() * scale))
+			))
+
+	qimage = reader.read()
+	if qimage.isNull():
+		return qimage, size
+
+	if size is None:
+		size = qimage.size()
+
+	return _scale_to_fill(qimage, thumb_size, transform), size
+
+# --- Private functions
+
+def _can_substitute(embedded: QSize, original: QSize, thumb_size: int) -> bool:
+	"""Embedded thumbnails are usable if they're big enough and not letterboxed."""
+	if min(embedded.width(), embedded.height()) < thumb_size:
+		return False
+	embedded_aspect = embedded.width() / embedded.height()
+	original_aspect = original.width() / original.height()
+	return abs(embedded_aspect - original_aspect) / original_aspect < 0.02
+
+def _exif_ifd1_thumbnail(tiff: bytes) -> QImage | None:
+	"""Extracts the JPEGInterchangeFormat thumbnail from IFD1 of a TIFF/EXIF block."""
+	if len(tiff) < 8:
+		return None
+
+	match tiff[:2]:
+		case b"II":
+			endian = "<"
+		case b"MM":
+			endian = ">"
+		case _:
+			return None
+
+	def ifd_entries(ifd_offset: int):
+		if ifd_offset + 2 > len(tiff):
+			return {}, 0
+		count = struct.unpack(endian + "H", tiff[ifd_offset:ifd_offset + 2])[0]
+		entries = {}
+		for i in range(count):
+			start = ifd_offset + 2 + i * 12
+			if start + 12 > len(tiff):
+				break
+			tag, _, _, value = struct.unpack(endian + "HHII", tiff[start:start + 12])
+			entries[tag] = value
+		next_start = ifd_offset + 2 + count * 12
+		if next_start + 4 > len(tiff):
+			return entries, 0
+		return entries, struct.unpack(endian + "I", tiff[next_start:next_start + 4])[0]
+
+	ifd0_offset = struct.unpack(endian + "I", tiff[4:8])[0]
+	_, ifd1_offset = ifd_entries(ifd0_offset)
+	if not ifd1_offset:
+		return None
+
+	entries, _ = ifd_entries(ifd1_offset)
+	start = entries.get(0x0201) # JPEGInterchangeFormat
+	length = entries.get(0x0202) # JPEGInterchangeFormatLength
+	if not start or not length or start + length > len(tiff):
+		return None
+
+	qimage = QImage.fromData(tiff[start:start + length], "JPG")
+	return None if qimage.isNull() else qimage
+
+def _transformed(qimage: QImage, transformation: QImageIOHandler.Transformation) -> QImage:
+	"""Applies an EXIF orientation the way ``QImageReader.setAutoTransform`` does."""
+	horizontal = bool(transformation & QImageIOHandler.Transformation.TransformationMirror)
+	vertical = bool(transformation & QImageIOHandler.Transformation.TransformationFlip)
+	if horizontal or vertical:
+		qimage = qimage.mirrored(horizontal, vertical)
+	if transformation & QImageIOHandler.Transformation.TransformationRotate90:
+		qimage = qimage.transformed(QTransform().rotate(90))
+	return qimage
+
+def _scale_to_fill(qimage: QImage, thumb_size: int, transform: Qt.TransformationMode) -> QImage:
+	return qimage.scaled(
+		thumb_size,
+		thumb_size,
+		Qt.AspectRatioMode.KeepAspectRatioByExpanding,
+		transform
+	)
@@ -0,0 +1,88 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable
+
+
+class ByteLRUCache:
+	"""Thread-safe least recently used mapping bounded by a byte budget.
+
+	Callers supply each value's size on insertion. Inserting past the budget
+	evicts the least recently used entries first. A single entry larger than
+	the whole budget is not stored at all.
+	"""
+
+	def __init__(self, capacity: int):
+		self.capacity = capacity
+		self.hits = 0
+		self.misses = 0
+		self._entries: OrderedDict[Hashable, tuple[object, int]] = OrderedDict()
+		self._total_bytes = 0
+		self._lock = threading.Lock()
+
+	def __contains__(self, key: Hashable) -> bool:
+		with self._lock:
+			return key in self._entries
+
+	def __len__(self) -> int:
+		return len(self._entries)
+
+	@property
+	def total_bytes(self) -> int:
+		return self._total_bytes
+
+	def clear(self):
+		with self._lock:
+			self._entries.clear()
+			self._total_bytes = 0
+
+	def get(self, key: Hashable, default=None):
+		"""Returns the value for ``key`` and marks it most recently used."""
+		with self._lock:
+			entry = self._entries.get(key)
+			if entry is None:
+				self.misses += 1
+				return default
+			self._entries.move_to_end(key)
+			self.hits += 1
+			return entry[0]
+
+	def peek(self, key: Hashable, default=None):
+		"""Returns the value for ``key`` without touching recency or counters."""
+		with self._lock:
+			entry = self._entries.get(key)
+			return default if entry is None else entry[0]
+
+	def pop(self, key: Hashable, default=None):
+		with self._lock:
+			entry = self._entries.pop(key, None)
+			if entry is None:
+				return default
+			self._total_bytes -= entry[1]
+			return entry[0]
+
+	def put(self, key: Hashable, value, size: int):
+		with self._lock:
+			old = self._entries.pop(key, None)
+			if old is not None:
+				self._total_bytes -= old[1]
+			if size > self.capacity:
+				return
+			self._entries[key] = (value, size)
+			self._total_bytes += size
+			self._evict(self.capacity)
+
+	def reset_stats(self):
+		self.hits = 0
+		self.misses = 0
+
+	def set_capacity(self, capacity: int):
+		with self._lock:
+			self.capacity = capacity
+			self._evict(capacity)
+
+	# --- Private methods
+
+	def _evict(self, target: int):
+		while self._total_bytes > target and self._entries:
+			_, (_, size) = self._entries.popitem(last=False)
+			self._total_bytes -= size
@@ -0,0 +1,105 @@
+import csv
+import io
+import os
+import stat
+from pathlib import Path
+
+
+def format_tags(tags: list[str]) -> str:
+	"""Returns the sidecar text for ``tags``, as one CSV row."""
+	buffer = io.StringIO(newline="")
+	csv.writer(buffer).writerow(tags)
+	return buffer.getvalue()
+
+def write_sidecars(files: list[tuple[Path, str]]) -> tuple[dict[Path, tuple[int, int]], dict[Path, str]]:
+	"""Replaces each file with its text atomically, so a crash leaves either the
+	old or the new contents, never a truncated file.
+
+	Every file is first written next to its target under a temporary name. The
+	temporary files are then fsync'ed together, which lets the filesystem commit
+	them in as few journal flushes as it can, renamed over their targets, and
+	each directory involved is fsync'ed once to make the renames durable.
+
+	:param files: ``(path, text)`` pairs, with at most one pair per path.
+	:returns: ``(size, mtime_ns)`` of each written path, and an error message per failed path.
+	"""
+	written: dict[Path, tuple[int, int]] = {}
+	failed: dict[Path, str] = {}
+
+	staged: list[tuple[Path, Path, int]] = [] # path, temp path, open descriptor
+	for path, text in files:
+		temp_path = path.with_name(f".{path.name}.tmp")
+		try:
+			fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), _file_mode(path))
+		except OSError as exception:
+			failed[path] = str(exception)
+			continue
+		try:
+			data = text.encode()
+			view = memoryview(data)
+			while view:
+				view = view[os.write(fd, view):]
+		except OSError as exception:
+			_discard(fd, temp_path)
+			failed[path] = str(exception)
+			continue
+		staged.append((path, temp_path, fd))
+
+	renamed = []
+	for path, temp_path, fd in staged:
+		try:
+			os.fsync(fd)
+			os.close(fd)
+		except OSError as exception:
+			_discard(fd, temp_path)
+			failed[path] = str(exception)
+			continue
+
+		try:
+			os.replace(temp_path, path)
+			result = os.stat(path)
+		except OSError as exception:
+			_discard(None, temp_path)
+			failed[path] = str(exception)
+			continue
+		written[path] = (result.st_size, result.st_mtime_ns)
+		renamed.append(path)
+
+	for directory in {path.parent for path in renamed}:
+		_sync_directory(directory)
+
+	return written, failed
+
+# --- Private functions
+
+def _discard(fd: int | None, temp_path: Path):
+	if fd is not None:
+		try:
+			os.close(fd)
+		except OSError:
+			pass
+	try:
+		os.unlink(temp_path)
+	except OSError:
+		pass
+
+def _file_mode(path: Path) -> int:
+	"""Keeps the permissions of the file being replaced."""
+	try:
+		return stat.S_IMODE(os.stat(path).st_mode)
+	except OSError:
+		return 0o666 # subject to the umask, like a plain open()
+
+def _sync_directory(directory: Path):
+	if os.name == "nt":
+		return # directories can't be opened for fsync, and renames are journaled anyway
+	try:
+		fd = os.open(directory, os.O_RDONLY)
+	except OSError:
+		return
+	try:
+		os.fsync(fd)
+	except OSError as exception:
+		print(f"Error syncing directory {directory}: {str(exception)}")
+	finally:
+		os.close(fd)
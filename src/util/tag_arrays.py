@@ -0,0 +1,27 @@
+from array import array
+from itertools import repeat
+
+
+def tag_bytes(tag_id: int) -> bytes:
+	"""Returns ``tag_id`` as it is stored in a ``uint32`` tag array."""
+	return array("I", [tag_id]).tobytes()
+
+def find_tag(data: bytes, pattern: bytes, start: int = 0) -> int:
+	"""Returns the position of the first tag stored as ``pattern`` at or after
+	``start`` in ``data``, the bytes of a tag array, or -1 if there is none.
+
+	Searching the bytes runs in C, while ``in`` and ``index`` on the array box
+	every element they compare. Matches straddling two tags are skipped.
+	"""
+	offset = data.find(pattern, start * 4)
+	while offset > 0 and offset & 3:
+		offset = data.find(pattern, offset + 1)
+	return offset >> 2 # -1 stays -1
+
+def holding(arrays: list[array], tag_id: int) -> list[bool]:
+	"""Returns whether each of ``arrays`` holds ``tag_id``, searching their bytes
+	like ``find_tag``. Only the rare array where a match straddles two tags is
+	searched again with ``in``."""
+	pattern = tag_bytes(tag_id)
+	found = map(bytes.find, map(array.tobytes, arrays), repeat(pattern))
+	return [offset >= 0 and (not offset & 3 or tag_id in tags) for offset, tags in zip(found, arrays)]
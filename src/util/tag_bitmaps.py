@@ -0,0 +1,272 @@
+import heapq
+import sys
+from array import array
+from bisect import bisect_left
+from itertools import compress
+from operator import itemgetter
+from typing import Iterable
+
+_BINARY_DIGITS = bytes.maketrans(b"01", b"\x00\x01")
+
+
+def rows_to_bits(rows: Iterable[int]) -> int:
+	"""Returns a bitmap with the bits of ``rows`` set."""
+	if not isinstance(rows, (array, list, range)):
+		rows = list(rows)
+	if not rows:
+		return 0
+	buffer = bytearray((max(rows) >> 3) + 1)
+	for row in rows:
+		buffer[row >> 3] |= 1 << (row & 7)
+	return int.from_bytes(buffer, "little")
+
+def bits_to_flags(bits: int, size: int = 0) -> bytes:
+	"""Returns one byte per row, 1 where the bit is set, at least ``size`` long.
+	Formatting a bitmap as binary runs in C, unlike testing bits one by one."""
+	flags = bin(bits)[:1:-1].encode("ascii").translate(_BINARY_DIGITS)
+	return flags + bytes(size - len(flags)) if len(flags) < size else flags
+
+def bits_to_rows(bits: int) -> array:
+	"""Returns the set bits of ``bits`` in ascending order."""
+	flags = bits_to_flags(bits)
+	return array("I", compress(range(len(flags)), flags))
+
+class TagBitmaps:
+	"""Inverted index of tag IDs to the rows holding them, each tag compressed
+	as whichever of two containers is smaller.
+
+	Rows are small integers handed out by the owner, kept dense so bitmaps stay
+	short. Tags on fewer than one in 32 rows keep a sorted ``uint32`` array of
+	their rows; commoner tags keep a bitmap as a Python ``int``, whose ``&``,
+	``|`` and ``bit_count`` run in C over machine words. A tag switches back to
+	an array once it falls below one in 64 rows, so edits near the threshold
+	don't convert it back and forth.
+
+	Updates come in batches of rows per tag, so a bitmap is rebuilt once per
+	batch rather than once per row.
+	"""
+	def __init__(self):
+		self.size = 0 # one past the highest row ever added
+		self._rows: dict[int, array] = {} # sparse tags
+		self._bits: dict[int, int] = {} # dense tags
+		self._counts: dict[int, int] = {} # rows of each dense tag
+		self._by_count: list[int] | None = None # tag IDs from most rows to fewest, rebuilt lazily after updates
+
+	def __contains__(self, tag_id: int) -> bool:
+		return tag_id in self._rows or tag_id in self._bits
+
+	def __iter__(self):
+		yield from self._rows
+		yield from self._bits
+
+	def __len__(self) -> int:
+		return len(self._rows) + len(self._bits)
+
+	def add(self, tag_id: int, rows: list[int]):
+		"""Adds ``rows`` to the tag's rows, creating the tag if needed."""
+		if not rows:
+			return
+		self.size = max(self.size, max(rows) + 1)
+		self._by_count = None
+
+		bits = self._bits.get(tag_id)
+		if bits is not None:
+			self._set_bits(tag_id, bits | rows_to_bits(rows))
+			return
+
+		current = self._rows.get(tag_id)
+		if current is None:
+			merged = array("I", sorted(set(rows)))
+		elif len(rows) * 8 < len(current):
+			merged = current
+			for row in rows:
+				position = bisect_left(merged, row)
+				if position == len(merged) or merged[position] != row:
+					merged.insert(position, row)
+		else:
+			merged = array("I", sorted(set(current).union(rows)))
+
+		if len(merged) * 32 > self.size:
+			self._rows.pop(tag_id, None)
+			self._set_bits(tag_id, rows_to_bits(merged))
+		else:
+			self._rows[tag_id] = merged
+
+	def bits(self, tag_id: int) -> int:
+		"""Returns the tag's rows as a bitmap."""
+		bits = self._bits.get(tag_id)
+		if bits is not None:
+			return bits
+		return rows_to_bits(self._rows.get(tag_id, ()))
+
+	def clear(self):
+		self.size = 0
+		self._rows.clear()
+		self._bits.clear()
+		self._counts.clear()
+		self._by_count = None
+
+	def co_occurrence(self, tag_id: int, limit: int | None = None) -> list[tuple[int, int]]:
+		"""Returns the other tags sharing rows with ``tag_id`` and how many, most
+		first. Dense tags are intersected as bitmaps, sparse ones counted by
+		looking their rows up in a byte per row.
+
+		Tags are visited from most rows to fewest, so with a ``limit`` the walk
+		stops at the first tag too small to make the top, usually long before
+		the sparse tags that hold most of the rows.
+		"""
+		bits = self.bits(tag_id)
+		if not bits:
+			return []
+
+		flags = None
+		top: list[tuple[int, int]] = [] # (count, tag ID), a min-heap while limited
+		for other in self._ordered():
+			if limit is not None and len(top) == limit and self.count(other) <= top[0][0]:
+				break
+			if other == tag_id:
+				continue
+
+			other_bits = self._bits.get(other)
+			if other_bits is not None:
+				count = (other_bits & bits).bit_count()
+			else:
+				if flags is None:
+					flags = bits_to_flags(bits, self.size)
+				rows = self._rows[other]
+				# itemgetter fetches every row in C, but returns a lone row unwrapped
+				count = sum(itemgetter(*rows)(flags)) if len(rows) > 1 else flags[rows[0]]
+
+			if not count:
+				continue
+			if limit is None:
+				top.append((count, other))
+			elif len(top) < limit:
+				heapq.heappush(top, (count, other))
+			elif count > top[0][0]:
+				heapq.heapreplace(top, (count, other))
+
+		top.sort(reverse=True)
+		return [(other, count) for count, other in top]
+
+	def count(self, tag_id: int) -> int:
+		"""Returns the number of rows holding ``tag_id``."""
+		count = self._counts.get(tag_id)
+		if count is not None:
+			return count
+		rows = self._rows.get(tag_id)
+		return len(rows) if rows is not None else 0
+
+	def difference_count(self, tag_id: int, others: Iterable[int]) -> int:
+		"""Returns the number of rows holding ``tag_id`` but none of ``others``."""
+		others = list(others)
+		if self._all_sparse([tag_id, *others]):
+			return len(set(self._rows.get(tag_id, ())).difference(*(self._rows.get(other, ()) for other in others)))
+		return (self.bits(tag_id) & ~self.union(others)).bit_count()
+
+	def discard(self, tag_id: int, rows: list[int]) -> int:
+		"""Removes ``rows`` from the tag's rows, dropping the tag once it has none.
+		:returns: The number of rows left.
+		"""
+		self._by_count = None
+		bits = self._bits.get(tag_id)
+		if bits is not None:
+			bits &= ~rows_to_bits(rows)
+			count = bits.bit_count()
+			if count * 64 < self.size:
+				del self._bits[tag_id]
+				del self._counts[tag_id]
+				if count:
+					self._rows[tag_id] = bits_to_rows(bits)
+			else:
+				self._bits[tag_id] = bits
+				self._counts[tag_id] = count
+			return count
+
+		current = self._rows.get(tag_id)
+		if current is None:
+			return 0
+		if len(rows) * 8 < len(current):
+			for row in rows:
+				position = bisect_left(current, row)
+				if position < len(current) and current[position] == row:
+					del current[position]
+		else:
+			doomed = set(rows)
+			current = array("I", [row for row in current if row not in doomed])
+			self._rows[tag_id] = current
+
+		if not current:
+			del self._rows[tag_id]
+		return len(current)
+
+	def intersection(self, tag_ids: Iterable[int]) -> int:
+		"""Returns the rows holding every one of ``tag_ids`` as a bitmap."""
+		tag_ids = sorted(tag_ids, key=self.count)
+		if not tag_ids:
+			return 0
+		bits = self.bits(tag_ids[0])
+		for tag_id in tag_ids[1:]:
+			if not bits:
+				break
+			bits &= self.bits(tag_id)
+		return bits
+
+	def intersection_count(self, tag_ids: Iterable[int]) -> int:
+		"""Returns the number of rows holding every one of ``tag_ids``."""
+		tag_ids = list(tag_ids)
+		if self._all_sparse(tag_ids):
+			sets = sorted((self._rows.get(tag_id, ()) for tag_id in tag_ids), key=len)
+			return len(set(sets[0]).intersection(*sets[1:])) if sets else 0
+		return self.intersection(tag_ids).bit_count()
+
+	def is_dense(self, tag_id: int) -> bool:
+		return tag_id in self._bits
+
+	def memory_size(self) -> int:
+		"""Returns roughly how many bytes the containers take."""
+		return (
+			sys.getsizeof(self._rows) + sum(map(sys.getsizeof, self._rows.values()))
+			+ sys.getsizeof(self._bits) + sum(map(sys.getsizeof, self._bits.values()))
+			+ sys.getsizeof(self._counts)
+		)
+
+	def rows(self, tag_id: int) -> array:
+		"""Returns the tag's rows in ascending order. Don't modify them."""
+		rows = self._rows.get(tag_id)
+		if rows is not None:
+			return rows
+		bits = self._bits.get(tag_id)
+		return bits_to_rows(bits) if bits is not None else array("I")
+
+	def union(self, tag_ids: Iterable[int]) -> int:
+		"""Returns the rows holding any of ``tag_ids`` as a bitmap."""
+		bits = 0
+		for tag_id in tag_ids:
+			bits |= self.bits(tag_id)
+		return bits
+
+	def union_count(self, tag_ids: Iterable[int]) -> int:
+		"""Returns the number of rows holding any of ``tag_ids``."""
+		tag_ids = list(tag_ids)
+		if self._all_sparse(tag_ids):
+			return len(set().union(*(self._rows.get(tag_id, ()) for tag_id in tag_ids)))
+		return self.union(tag_ids).bit_count()
+
+	# --- Private methods
+
+	def _all_sparse(self, tag_ids: list[int]) -> bool:
+		"""Sparse tags are cheaper to combine as sets of rows than as bitmaps,
+		which cost a pass over every row."""
+		return not any(tag_id in self._bits for tag_id in tag_ids)
+
+	def _ordered(self) -> list[int]:
+		if self._by_count is None:
+			counts = {tag_id: len(rows) for tag_id, rows in self._rows.items()}
+			counts.update(self._counts)
+			self._by_count = sorted(counts, key=counts.__getitem__, reverse=True)
+		return self._by_count
+
+	def _set_bits(self, tag_id: int, bits: int):
+		self._bits[tag_id] = bits
+		self._counts[tag_id] = bits.bit_count()
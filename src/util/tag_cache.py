@@ -0,0 +1,131 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from PyQt6.QtCore import QStandardPaths
+
+from settings.config import APP_NAME
+
+
+class TagCache:
+	"""Persistent store of parsed sidecar contents.
+
+	Each row records a sidecar's size, mtime, inode and ctime alongside its tag
+	text. Rows are only used while all of them still match the file on disk, so
+	a sidecar that changed since it was cached is parsed again.
+
+	Some filesystems (FAT, some SMB mounts) keep mtimes to the second or
+	coarser, so an edit of the same length right after the row was written can
+	leave every field unchanged. Rows written within ``racy_window_ns`` of the
+	sidecar's mtime aren't trusted; the sidecar is parsed and cached again
+	until it is older than that.
+	"""
+	_instance = None
+	# Bumped when the table changes, which empties older caches. 1: inode,
+	# ctime and the time each row was written are stored.
+	version = 1
+	racy_window_ns = 2_000_000_000 # FAT's mtime granularity
+
+	def __init__(self, db_path: Path | None = None):
+		if db_path is None:
+			config_dir = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.GenericConfigLocation)
+			db_path = Path(config_dir) / APP_NAME / "tag_cache.db"
+
+		self.db_path = Path(db_path)
+		self._lock = threading.Lock()
+		self._connection: sqlite3.Connection | None = None
+		self._open()
+
+	@classmethod
+	def instance(cls):
+		if cls._instance is None:
+			cls._instance = cls()
+		return cls._instance
+
+	def clear(self):
+		with self._lock:
+			if self._connection is None:
+				return
+			self._connection.execute("DELETE FROM sidecars")
+			self._connection.commit()
+			self._connection.execute("VACUUM")
+
+	def close(self):
+		with self._lock:
+			if self._connection is None:
+				return
+			self._connection.close()
+			self._connection = None
+
+	def lookup(self, stats: dict[str, os.stat_result]) -> dict[str, str]:
+		"""Returns cached tag text for each sidecar path whose stat in ``stats``
+		matches the cached row."""
+		hits = {}
+		paths = list(stats)
+		with self._lock:
+			if self._connection is None:
+				return hits
+			for start in range(0, len(paths), 500):
+				chunk = paths[start:start + 500]
+				rows = self._connection.execute(
+					f"SELECT path, size, mtime_ns, inode, ctime_ns, cached_ns, tags FROM sidecars"
+					f" WHERE path IN ({','.join('?' * len(chunk))})",
+					chunk
+				)
+				for path, size, mtime_ns, inode, ctime_ns, cached_ns, tags in rows:
+					stat = stats[path]
+					if (
+						TagCache._signature(stat) == (size, mtime_ns, inode, ctime_ns)
+						and stat.st_mtime_ns < cached_ns - TagCache.racy_window_ns
+					):
+						hits[path] = tags
+		return hits
+
+	def store(self, rows: list[tuple[str, os.stat_result, str]]):
+		"""Stores ``(path, stat, tag_text)`` rows, replacing older ones. ``stat``
+		should be taken before the sidecar was read."""
+		if not rows:
+			return
+		now = time.time_ns()
+		with self._lock:
+			if self._connection is None:
+				return
+			self._connection.executemany(
+				"INSERT OR REPLACE INTO sidecars (path, size, mtime_ns, inode, ctime_ns, cached_ns, tags)"
+				" VALUES (?, ?, ?, ?, ?, ?, ?)",
+				[(path, *TagCache._signature(stat), now, tags) for path, stat, tags in rows]
+			)
+			self._connection.commit()
+
+	# --- Private methods
+
+	def _open(self):
+		try:
+			self.db_path.parent.mkdir(parents=True, exist_ok=True)
+			self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+			self._connection.execute("PRAGMA journal_mode=WAL")
+			self._connection.execute("PRAGMA synchronous=NORMAL")
+			if self._connection.execute("PRAGMA user_version").fetchone()[0] < TagCache.version:
+				self._connection.execute("DROP TABLE IF EXISTS sidecars")
+				self._connection.execute(f"PRAGMA user_version = {TagCache.version}")
+				self._connection.commit()
+			self._connection.execute(
+				"CREATE TABLE IF NOT EXISTS sidecars ("
+				" path TEXT PRIMARY KEY,"
+				" size INTEGER NOT NULL,"
+				" mtime_ns INTEGER NOT NULL,"
+				" inode INTEGER NOT NULL,"
+				" ctime_ns INTEGER NOT NULL,"
+				" cached_ns INTEGER NOT NULL,"
+				" tags TEXT NOT NULL)"
+			)
+		except (OSError, sqlite3.Error) as exception:
+			print(f"Error opening tag cache: {str(exception)}")
+			self._connection = None
+
+	@staticmethod
+	def _signature(stat: os.stat_result) -> tuple[int, int, int, int]:
+		# Inodes can use all 64 bits, which SQLite's signed integers can't hold
+		return stat.st_size, stat.st_mtime_ns, stat.st_ino & 0x7FFFFFFFFFFFFFFF, stat.st_ctime_ns
@@ -0,0 +1,277 @@
+import hashlib
+import json
+import mmap
+import os
+import struct
+from array import array
+from bisect import bisect_right
+from os import PathLike
+from pathlib import Path
+
+from PyQt6.QtCore import QStandardPaths
+
+from settings.config import APP_NAME
+
+
+class TagColumns:
+	"""The tag vocabulary as compact columns, memory-mapped from a file that is
+	built once from the tag database.
+
+	Rows are numbered in name order. Names live in one UTF-8 buffer indexed by
+	an offset array and post counts in a ``uint32`` array. ``by_count`` lists the
+	rows from most to fewest posts, so either ordering is a lookup rather than
+	a sort. Positions in ``by_count`` are called ranks.
+
+	The file also holds what ``CompletionIndex`` searches: lowercased names in
+	rank order, their trigram counts, and trigram postings lists of ranks. The
+	database's summary stats are stored with them, so opening the file never
+	touches the database, which may be read-only.
+	Opening it costs a page fault per touched page, and every running instance
+	shares the same pages through the OS page cache.
+	"""
+	magic = b"DSCRVOC2"
+	separator = b"\n" # between names in the string buffers, never part of a tag
+	gram_length = 3
+
+	# name, typecode, in the order they're stored
+	_sections = (
+		("name_offsets", "I"),
+		("names", "B"),
+		("folded_offsets", "I"),
+		("folded", "B"),
+		("counts", "I"),
+		("by_count", "I"),
+		("gram_counts", "H"),
+		("gram_offsets", "I"),
+		("grams", "B"),
+		("posting_offsets", "I"),
+		("postings", "I"),
+		("stats", "B") # JSON
+	)
+	_header = struct.Struct(f"<8s3Q{2 * len(_sections)}Q") # magic, rows, fingerprint, (offset, length) per section
+
+	def __init__(self, buffer: bytes | mmap.mmap):
+		self._buffer = buffer
+		view = memoryview(buffer)
+		fields = TagColumns._header.unpack_from(buffer)
+		self.size = fields[1]
+		self.fingerprint = (fields[2], fields[3])
+
+		for i, (name, typecode) in enumerate(TagColumns._sections):
+			offset, length = fields[4 + 2 * i], fields[5 + 2 * i]
+			setattr(self, "_" + name, view[offset:offset + length].cast(typecode))
+		self._folded_start = fields[4 + 2 * 3]
+
+		# Trigram -> (start, end) in postings
+		grams = bytes(self._grams).decode().split(TagColumns.separator.decode())[:-1]
+		offsets = self._posting_offsets
+		self._gram_postings = {gram: (offsets[i], offsets[i + 1]) for i, gram in enumerate(grams)}
+
+	def __len__(self) -> int:
+		return self.size
+
+	@classmethod
+	def default_path(cls, db_path: str | PathLike) -> Path:
+		"""Returns where the columns built from ``db_path`` are kept."""
+		cache_dir = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.GenericCacheLocation)
+		key = hashlib.sha1(os.fsencode(os.path.abspath(db_path))).hexdigest()[:16]
+		return Path(cache_dir) / APP_NAME / f"vocabulary-{key}.bin"
+
+	@staticmethod
+	def file_fingerprint(db_path: str | PathLike) -> tuple[int, int]:
+		"""Returns the ``(size, mtime_ns)`` of the source database, or zeros if it's missing."""
+		try:
+			result = os.stat(db_path)
+		except OSError:
+			return 0, 0
+		return result.st_size, result.st_mtime_ns
+
+	@classmethod
+	def from_rows(
+			cls,
+			rows: list[tuple[str, int]],
+			fingerprint: tuple[int, int],
+			stats: dict[str, int] | None = None
+	) -> "TagColumns":
+		"""Builds the columns in memory from ``(name, post_count)`` rows and the
+		stats ``read_vocabulary`` returned with them."""
+		rows = sorted(rows)
+		n = len(rows)
+		counts = array("I", (min(max(count, 0), 0xFFFFFFFF) for _, count in rows))
+		by_count = array("I", sorted(range(n), key=counts.__getitem__, reverse=True))
+		folded = [rows[row][0].lower() for row in by_count]
+
+		postings: dict[str, array] = {}
+		gram_counts = array("H")
+		for rank, name in enumerate(folded):
+			grams = cls.grams(name)
+			gram_counts.append(min(len(grams), 0xFFFF))
+			for gram in grams:
+				posting = postings.get(gram)
+				if posting is None:
+					posting = postings[gram] = array("I")
+				posting.append(rank)
+
+		gram_list = sorted(postings)
+		posting_offsets = array("I", [0])
+		all_postings = array("I")
+		for gram in gram_list:
+			all_postings.extend(postings[gram])
+			posting_offsets.append(len(all_postings))
+
+		names, name_offsets = cls._pack([name.encode() for name, _ in rows])
+		folded_bytes, folded_offsets = cls._pack([name.encode() for name in folded])
+		grams, gram_offsets = cls._pack([gram.encode() for gram in gram_list])
+		sections = {
+			"name_offsets": name_offsets,
+			"names": names,
+			"folded_offsets": folded_offsets,
+			"folded": folded_bytes,
+			"counts": counts,
+			"by_count": by_count,
+			"gram_counts": gram_counts,
+			"gram_offsets": gram_offsets,
+			"grams": grams,
+			"posting_offsets": posting_offsets,
+			"postings": all_postings,
+			"stats": json.dumps(stats or {}).encode()
+		}
+
+		body = bytearray()
+		placements = []
+		position = TagColumns._header.size
+		for name, _ in TagColumns._sections:
+			data = bytes(sections[name])
+			padding = -position % 8
+			body += b"\0" * padding
+			position += padding
+			placements += [position, len(data)]
+			body += data
+			position += len(data)
+
+		header = TagColumns._header.pack(TagColumns.magic, n, *fingerprint, *placements)
+		return cls(header + bytes(body))
+
+	@staticmethod
+	def grams(text: str) -> set[str]:
+		n = TagColumns.gram_length
+		return {text[i:i + n] for i in range(len(text) - n + 1)}
+
+	@classmethod
+	def open(cls, path: Path, fingerprint: tuple[int, int]) -> "TagColumns | None":
+		"""Maps a previously saved file, or returns None if it's missing, damaged
+		or was built from a different database."""
+		try:
+			with open(path, "rb") as file:
+				buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+		except (OSError, ValueError):
+			return None
+
+		try:
+			fields = cls._header.unpack_from(buffer)
+			if fields[0] != cls.magic or (fields[2], fields[3]) != tuple(fingerprint):
+				buffer.close()
+				return None
+			return cls(buffer)
+		except (struct.error, ValueError, TypeError, UnicodeDecodeError) as exception:
+			print(f"Error opening vocabulary columns: {str(exception)}")
+			buffer.close()
+			return None
+
+	def save(self, path: Path) -> bool:
+		"""Writes the columns to ``path`` atomically."""
+		temp_path = path.with_name(path.name + ".tmp")
+		try:
+			path.parent.mkdir(parents=True, exist_ok=True)
+			with open(temp_path, "wb") as file:
+				file.write(self._buffer)
+			os.replace(temp_path, path)
+			return True
+		except OSError as exception:
+			print(f"Error saving vocabulary columns: {str(exception)}")
+			return False
+
+	def stats(self) -> dict[str, int]:
+		"""Returns the summary stats of the database the columns were built from."""
+		return json.loads(bytes(self._stats)) if len(self._stats) else {}
+
+	# Rows
+
+	@property
+	def by_count(self) -> memoryview:
+		return self._by_count
+
+	def count(self, row: int) -> int:
+		return self._counts[row]
+
+	def find(self, name: str) -> int | None:
+		"""Returns the row of ``name``, found by binary search."""
+		target = name.encode()
+		offsets = self._name_offsets
+		names = self._names
+		low, high = 0, self.size
+		while low < high:
+			middle = (low + high) // 2
+			if bytes(names[offsets[middle]:offsets[middle + 1] - 1]) < target:
+				low = middle + 1
+			else:
+				high = middle
+		if low < self.size and bytes(names[offsets[low]:offsets[low + 1] - 1]) == target:
+			return low
+		return None
+
+	def name(self, row: int) -> str:
+		offsets = self._name_offsets
+		return str(self._names[offsets[row]:offsets[row + 1] - 1], "utf-8")
+
+	# Ranks, for CompletionIndex
+
+	def find_folded(self, query: bytes, rank: int = 0) -> int | None:
+		"""Returns the first rank from ``rank`` on whose lowercased name contains
+		``query``, by searching the whole buffer at once."""
+		offsets = self._folded_offsets
+		if rank >= self.size:
+			return None
+		start = self._folded_start
+		position = self._buffer.find(query, start + offsets[rank], start + offsets[self.size])
+		if position < 0:
+			return None
+		return bisect_right(offsets, position - start) - 1
+
+	def filter_folded(self, ranks, query: bytes, k: int) -> list[int]:
+		"""Returns the first ``k`` of ``ranks`` whose lowercased name contains ``query``."""
+		find = self._buffer.find
+		offsets = self._folded_offsets
+		start = self._folded_start
+		results = []
+		for rank in ranks:
+			if find(query, start + offsets[rank], start + offsets[rank + 1] - 1) >= 0:
+				results.append(rank)
+				if len(results) == k:
+					break
+		return results
+
+	def gram_count(self, rank: int) -> int:
+		return self._gram_counts[rank]
+
+	def posting(self, gram: str) -> memoryview | None:
+		"""Returns the ascending ranks of names containing ``gram``."""
+		span = self._gram_postings.get(gram)
+		if span is None:
+			return None
+		return self._postings[span[0]:span[1]]
+
+	# --- Private methods
+
+	@staticmethod
+	def _pack(strings: list[bytes]) -> tuple[bytes, array]:
+		"""Joins ``strings`` with separators after each, and returns the buffer
+		with the offset of each string plus the end."""
+		offsets = array("I", [0])
+		total = 0
+		for string in strings:
+			total += len(string) + 1
+			offsets.append(total)
+		if total > 0xFFFFFFFF:
+			raise ValueError("vocabulary too large for 32-bit offsets")
+		return b"".join(string + TagColumns.separator for string in strings), offsets
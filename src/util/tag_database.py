@@ -0,0 +1,65 @@
+import os.path
+import sqlite3
+from os import PathLike
+
+# Percentiles of tag name length kept in the stats table
+NAME_LENGTH_PERCENTILES = (90, 95, 99)
+
+
+def read_vocabulary(db_path: str | PathLike) -> tuple[list[tuple[str, int]], dict[str, int]]:
+	"""Reads every ``(name, post_count)`` from the danbooru tag database, sorted
+	by name, along with its summary stats.
+
+	Stats are computed on the first read and stored in a ``tag_stats`` table,
+	next to the row count and highest ID they were computed from, so later
+	reads only recompute them after the tags change.
+	"""
+	if not os.path.exists(db_path):
+		print("Error: database not found")
+		return [], {}
+
+	try:
+		connection = sqlite3.connect(db_path)
+	except sqlite3.Error as exception:
+		print(f"Error connecting to database: {str(exception)}")
+		return [], {}
+
+	rows = []
+	stats = {}
+	try:
+		rows = connection.execute("SELECT REPLACE(name, '_', ' ') AS name, post_count FROM tags ORDER BY name ASC").fetchall()
+		row_count, max_id = connection.execute("SELECT COUNT(*), MAX(id) FROM tags").fetchone()
+		stats = _read_stats(connection)
+		if stats.get("row_count") != row_count or stats.get("max_id") != (max_id or 0):
+			stats = compute_stats(rows)
+			stats["row_count"] = row_count
+			stats["max_id"] = max_id or 0
+			_write_stats(connection, stats)
+	except sqlite3.Error as exception:
+		print(f"Error querying database: {str(exception)}")
+
+	connection.close()
+	return rows, stats
+
+def compute_stats(rows: list[tuple[str, int]]) -> dict[str, int]:
+	stats = {"max_count_len": len(str(max((count for _, count in rows), default=0)))}
+	lengths = sorted(len(name) for name, _ in rows)
+	for percentile in NAME_LENGTH_PERCENTILES:
+		stats[f"name_length_p{percentile}"] = lengths[int(percentile / 100 * (len(lengths) - 1))] if lengths else 0
+	return stats
+
+# --- Private functions
+
+def _read_stats(connection: sqlite3.Connection) -> dict[str, int]:
+	exists = connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'tag_stats'").fetchone()
+	if not exists:
+		return {}
+	return dict(connection.execute("SELECT key, value FROM tag_stats"))
+
+def _write_stats(connection: sqlite3.Connection, stats: dict[str, int]):
+	try:
+		connection.execute("CREATE TABLE IF NOT EXISTS tag_stats (key TEXT PRIMARY KEY, value INTEGER NOT NULL)")
+		connection.executemany("INSERT OR REPLACE INTO tag_stats (key, value) VALUES (?, ?)", stats.items())
+		connection.commit()
+	except sqlite3.Error as exception:
+		print(f"Error storing tag stats: {str(exception)}") # e.g. a read-only database, recomputed next time
@@ -0,0 +1,203 @@
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from PyQt6.QtCore import QBuffer, QIODevice, QSize, QStandardPaths
+from PyQt6.QtGui import QImage
+
+from settings.config import APP_NAME, Config, Setting
+from util.image_decode import ThumbnailQuality
+
+
+class ThumbnailCache:
+	"""Persistent on-disk store of scaled thumbnail previews.
+
+	Entries are keyed by source path, thumbnail size and decode quality, so
+	changing the quality setting doesn't keep serving thumbnails made at the
+	old one. They are only returned
+	while the source file's size and mtime still match, so edited or replaced
+	images miss and get overwritten. Total size is capped; the least recently
+	used entries are evicted first.
+	"""
+	_instance = None
+	# Bumped when stored entries stop matching what decoding produces, which
+	# empties older caches. 1: previews and sizes are EXIF oriented.
+	# 2: entries are keyed by quality as well.
+	version = 2
+
+	def __init__(self, db_path: Path | None = None, capacity: int | None = None):
+		if db_path is None:
+			cache_dir = QStandardPaths.writableLocation(QStandardPaths.StandardLocation.GenericCacheLocation)
+			db_path = Path(cache_dir) / APP_NAME / "thumbnails.db"
+		if capacity is None:
+			capacity = Config.read(Setting.ThumbnailCacheSize) * 1024 * 1024
+
+		self.db_path = Path(db_path)
+		self.capacity = capacity
+		self._lock = threading.Lock()
+		self._touched: dict[tuple[str, int, str], float] = {} # pending atime updates
+		self._total_bytes = 0
+		self._connection: sqlite3.Connection | None = None
+		self._open()
+
+	@classmethod
+	def instance(cls):
+		if cls._instance is None:
+			cls._instance = cls()
+		return cls._instance
+
+	@staticmethod
+	def stat(path: Path) -> tuple[int, int] | None:
+		"""Returns the ``(size, mtime_ns)`` pair used to validate entries."""
+		try:
+			result = os.stat(path)
+		except OSError:
+			return None
+		return result.st_size, result.st_mtime_ns
+
+	def clear(self):
+		with self._lock:
+			if self._connection is None:
+				return
+			self._connection.execute("DELETE FROM thumbnails")
+			self._connection.commit()
+			self._connection.execute("VACUUM")
+			self._touched.clear()
+			self._total_bytes = 0
+
+	def close(self):
+		with self._lock:
+			if self._connection is None:
+				return
+			self._flush_touched()
+			self._connection.close()
+			self._connection = None
+
+	def get(self, path: Path, thumb_size: int, quality: ThumbnailQuality) -> tuple[QImage, QSize] | None:
+		"""Returns the cached preview and original image size, or ``None`` on a miss."""
+		stat = ThumbnailCache.stat(path)
+		if stat is None:
+			return None
+
+		key = (str(path), thumb_size, quality.value)
+		with self._lock:
+			if self._connection is None:
+				return None
+			row = self._connection.execute(
+				"SELECT file_size, mtime_ns, width, height, data FROM thumbnails WHERE path = ? AND thumb_size = ? AND quality = ?",
+				key
+			).fetchone()
+			if row is None or (row[0], row[1]) != stat:
+				return None
+			self._touched[key] = time.time()
+			if len(self._touched) >= 256:
+				self._flush_touched()
+
+		qimage = QImage.fromData(row[4])
+		if qimage.isNull():
+			return None
+		return qimage, QSize(row[2], row[3])
+
+	def put(self, path: Path, thumb_size: int, quality: ThumbnailQuality, stat: tuple[int, int], preview: QImage, size: QSize):
+		"""Stores ``preview`` for ``path``. ``stat`` should be taken *before* decoding
+		so a file modified mid-decode is not cached under its new mtime."""
+		data = ThumbnailCache._encode(preview)
+		if data is None:
+			return
+
+		with self._lock:
+			if self._connection is None:
+				return
+			old = self._connection.execute(
+				"SELECT bytes FROM thumbnails WHERE path = ? AND thumb_size = ? AND quality = ?",
+				(str(path), thumb_size, quality.value)
+			).fetchone()
+			self._connection.execute(
+				"INSERT OR REPLACE INTO thumbnails"
+				" (path, thumb_size, quality, file_size, mtime_ns, width, height, data, bytes, atime)"
+				" VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+				(str(path), thumb_size, quality.value, stat[0], stat[1], size.width(), size.height(), data, len(data), time.time())
+			)
+			self._total_bytes += len(data) - (old[0] if old else 0)
+			self._flush_touched()
+			if self._total_bytes > self.capacity:
+				self._evict(self.capacity * 9 // 10)
+			self._connection.commit()
+
+	def set_capacity(self, capacity: int):
+		with self._lock:
+			self.capacity = capacity
+			if self._connection is not None and self._total_bytes > capacity:
+				self._evict(capacity)
+				self._connection.commit()
+
+	# --- Private methods
+
+	@staticmethod
+	def _encode(qimage: QImage) -> bytes | None:
+		if qimage.isNull():
+			return None
+		buffer = QBuffer()
+		buffer.open(QIODevice.OpenModeFlag.WriteOnly)
+		if qimage.hasAlphaChannel():
+			ok = qimage.save(buffer, "PNG")
+		else:
+			ok = qimage.save(buffer, "JPG", 90)
+		return bytes(buffer.data()) if ok else None
+
+	def _evict(self, target: int):
+		"""Deletes least recently used entries until the total is at most ``target``.
+		Caller must hold the lock."""
+		excess = self._total_bytes - target
+		victims = []
+		for rowid, size in self._connection.execute("SELECT rowid, bytes FROM thumbnails ORDER BY atime"):
+			if excess <= 0:
+				break
+			victims.append((rowid,))
+			excess -= size
+			self._total_bytes -= size
+		self._connection.executemany("DELETE FROM thumbnails WHERE rowid = ?", victims)
+
+	def _flush_touched(self):
+		"""Caller must hold the lock."""
+		if not self._touched:
+			return
+		self._connection.executemany(
+			"UPDATE thumbnails SET atime = ? WHERE path = ? AND thumb_size = ? AND quality = ?",
+			[(atime, *key) for key, atime in self._touched.items()]
+		)
+		self._connection.commit()
+		self._touched.clear()
+
+	def _open(self):
+		try:
+			self.db_path.parent.mkdir(parents=True, exist_ok=True)
+			self._connection = sqlite3.connect(self.db_path, check_same_thread=False)
+			self._connection.execute("PRAGMA journal_mode=WAL")
+			self._connection.execute("PRAGMA synchronous=NORMAL")
+			if self._connection.execute("PRAGMA user_version").fetchone()[0] < ThumbnailCache.version:
+				# Older tables may lack columns of the current key, so they are rebuilt
+				self._connection.execute("DROP TABLE IF EXISTS thumbnails")
+				self._connection.execute(f"PRAGMA user_version = {ThumbnailCache.version}")
+				self._connection.commit()
+			self._connection.execute(
+				"CREATE TABLE IF NOT EXISTS thumbnails ("
+				" path TEXT NOT NULL,"
+				" thumb_size INTEGER NOT NULL,"
+				" quality TEXT NOT NULL,"
+				" file_size INTEGER NOT NULL,"
+				" mtime_ns INTEGER NOT NULL,"
+				" width INTEGER NOT NULL,"
+				" height INTEGER NOT NULL,"
+				" data BLOB NOT NULL,"
+				" bytes INTEGER NOT NULL,"
+				" atime REAL NOT NULL,"
+				" PRIMARY KEY (path, thumb_size, quality))"
+			)
+			self._connection.execute("CREATE INDEX IF NOT EXISTS thumbnails_atime ON thumbnails (atime)")
+			self._total_bytes = self._connection.execute("SELECT COALESCE(SUM(bytes), 0) FROM thumbnails").fetchone()[0]
+		except (OSError, sqlite3.Error) as exception:
+			print(f"Error opening thumbnail cache: {str(exception)}")
+			self._connection = None